@@ -25,7 +25,10 @@
         'security/ir.model.access.csv',
         'views/delivery_pedidosya_view.xml',
         'views/webhook_config_view.xml',
+        'views/pedidosya_coverage_view.xml',
+        'views/pedidosya_metrics_view.xml',
         'data/delivery_pedidosya_data.xml',
+        'data/ir_cron_data.xml',
     ],
     'images': ['static/description/icon.png'],
     'installable': True,
@@ -0,0 +1,502 @@
+# -*- coding: utf-8 -*-
+"""
+Load benchmarks of the PedidosYa integration against the mock API
+
+    python3 benchmarks/bench.py -c /etc/odoo.conf -d bench_db --odoo-path /opt/odoo \\
+        --scenarios rate,send,tracking,labels,webhook --orders 200 --latency 80 --output results.json
+
+Runs inside one transaction on the given database, with the module installed, and
+rolls everything back at the end. With --server-url the webhook scenario commits its
+fixture for that server to see it, use a disposable database. Unless --api-url is given
+the mock API is started on a free port, all carriers are pointed to it through the
+pedidosya.api_url parameter.
+With --baseline, results are compared to a previous --output and the script exits
+with 1 when a scenario got slower
+"""
+
+import argparse
+import importlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from stats import Recorder, Timer, compare_reports, print_report, save_report
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ['json', 'payload', 'rate', 'send', 'tracking', 'labels', 'webhook']
+
+# Warehouse pickup point, customers are spread around it
+PICKUP = (-34.9058, -56.1913)
+
+# Indexes the webhook code path relies on, dropped to measure the old one
+WEBHOOK_INDEXES = ['stock_picking__carrier_tracking_ref_index', 'delivery_carrier__pedidosya_webhook_key_index']
+
+
+def start_mock(options):
+    """Start the mock API in its own process, so it does not share the GIL with Odoo"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, 'mock_server.py'), '--port', str(port),
+        '--latency', str(options.latency), '--jitter', str(options.jitter),
+        '--error-rate', str(options.error_rate), '--throttle-rate', str(options.throttle_rate),
+        '--retry-after', str(options.retry_after), '--uncovered-rate', str(options.uncovered_rate),
+    ], stdout=subprocess.DEVNULL)
+    for _attempt in range(50):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    return process, f"http://127.0.0.1:{port}"
+
+
+class Fixture:
+    """Carrier, products, customers, orders and pickings created for the run"""
+
+    def __init__(self, env, options, api_url):
+        from odoo import Command
+
+        self.env = env
+        self.options = options
+        rng = random.Random(options.seed)
+        env['ir.config_parameter'].set_param('pedidosya.api_url', api_url)
+
+        self.warehouse = env['stock.warehouse'].search([('company_id', '=', env.company.id)], limit=1)
+        self.warehouse.partner_id.write({
+            'street': 'Av. 18 de Julio 1000', 'city': 'Montevideo',
+            'partner_latitude': PICKUP[0], 'partner_longitude': PICKUP[1],
+        })
+        delivery_product = env['product.product'].create({'name': 'PedidosYa Benchmark Delivery', 'type': 'service'})
+        self.carrier = env['delivery.carrier'].create({
+            'name': 'PedidosYa Benchmark',
+            'delivery_type': 'pedidosya',
+            'product_id': delivery_product.id,
+            'pedidosya_api_key': 'bench',
+            'pedidosya_api_secret': 'bench',
+            'pedidosya_environment': 'test',
+            'pedidosya_max_concurrency': options.concurrency,
+            'pedidosya_pool_size': options.concurrency,
+            'pedidosya_rate_limit': 0,
+            'pedidosya_webhook_key': 'bench-webhook-key',
+        })
+        self.products = env['product.product'].create([{
+            'name': f"Benchmark Product {index}",
+            'default_code': f"BENCH{index:04d}",
+            'type': 'consu',
+            'list_price': rng.uniform(10, 500),
+            'weight': rng.uniform(0.1, 5),
+            'volume': rng.uniform(0.0001, 0.01),
+        } for index in range(options.products)])
+        self.customers = env['res.partner'].create([{
+            'name': f"Benchmark Customer {index}",
+            'street': f"Calle {index}",
+            'city': 'Montevideo',
+            'phone': '+598 2900 0000',
+            'partner_latitude': PICKUP[0] + rng.uniform(-0.05, 0.05),
+            'partner_longitude': PICKUP[1] + rng.uniform(-0.05, 0.05),
+        } for index in range(options.orders)])
+        self.orders = env['sale.order'].create([{
+            'partner_id': customer.id,
+            'warehouse_id': self.warehouse.id,
+            'carrier_id': self.carrier.id,
+            'order_line': [
+                Command.create({'product_id': product.id, 'product_uom_qty': rng.randint(1, 3)})
+                for product in rng.sample(list(self.products), min(options.order_lines, len(self.products)))
+            ],
+        } for customer in self.customers])
+        self.orders.action_confirm()
+        self.pickings = self.orders.picking_ids
+        self.pickings.write({'carrier_id': self.carrier.id})
+
+    def ensure_shipped(self):
+        """Give every picking a shipping id, shipments unknown to the mock start their lifecycle when read"""
+        for picking in self.pickings.filtered(lambda p: not p.carrier_tracking_ref):
+            picking.carrier_tracking_ref = f"bench{picking.id:08d}"
+
+    def addon_module(self, name):
+        package = type(self.carrier).pedidosya_rate_shipment.__module__.rsplit('.', 1)[0]
+        return importlib.import_module(f"{package}.{name}")
+
+
+def bench_json(fixture, options):
+    """Serializer of the module against the stdlib on a large estimate response and a webhook burst"""
+    pedidosya_json = fixture.addon_module('pedidosya_json')
+    estimate = {'deliveryOffers': [{
+        'deliveryMode': 'EXPRESS',
+        'pricing': {'total': 100.0 + index, 'currency': 'UYU', 'subtotal': 90.0, 'taxes': 10.0},
+        'waypoints': [{'latitude': -34.9, 'longitude': -56.1, 'addressStreet': 'Calle', 'type': 'DROP_OFF'}] * 5,
+        'items': [{'description': f"Item {item}", 'quantity': 1, 'weight': 1.5, 'volume': 2000.0} for item in range(20)],
+    } for index in range(200)]}
+    events = [{'topic': 'SHIPPING_STATUS', 'id': f"ship{index}", 'generated': '2024-01-01T00:00:00Z',
+               'data': {'status': 'PICKED_UP'}} for index in range(1000)]
+    body = json.dumps(estimate).encode()
+    bodies = [json.dumps(event).encode() for event in events]
+
+    results = []
+    for label, dumps, loads in [
+        ('module', pedidosya_json.dumps, pedidosya_json.loads),
+        ('stdlib', lambda data: json.dumps(data).encode(), json.loads),
+    ]:
+        for name, func in [
+            (f"json encode estimate ({label})", lambda: dumps(estimate)),
+            (f"json decode estimate ({label})", lambda: loads(body)),
+            (f"json decode 1000 webhooks ({label})", lambda: [loads(item) for item in bodies]),
+        ]:
+            recorder = Recorder(name)
+            with Timer(recorder, count=options.repeat):
+                for _run in range(options.repeat):
+                    recorder.time(func)
+            results.append(recorder)
+    return results
+
+
+def bench_payload(fixture, options):
+    """Item builder with precomputed product descriptors against recomputing them, batched or line by line, on a large order"""
+    from odoo import Command
+
+    env = fixture.env
+    carrier = fixture.carrier
+    order = env['sale.order'].create({
+        'partner_id': fixture.customers[0].id,
+        'warehouse_id': fixture.warehouse.id,
+        'order_line': [Command.create({'product_id': fixture.products[index % len(fixture.products)].id,
+                                       'product_uom_qty': 1}) for index in range(options.lines)],
+    })
+
+    def _line_by_line():
+        items = []
+        for line in order.order_line:
+            if line.product_id.type != 'service':
+                items.append({
+                    'type': line.product_id.pedidosya_product_type or 'STANDARD',
+                    'value': line.price_unit,
+                    'description': line.product_id.name,
+                    'sku': line.product_id.default_code or '',
+                    'quantity': int(line.product_uom_qty),
+                    'volume': line.product_id.volume * 1000000,
+                    'weight': line.product_id.weight,
+                })
+        return items
+
+    def _batched_recomputed():
+        # Batched reads, item fields derived from the raw product fields on every call
+        products = {values['id']: values for values in order.order_line.product_id.read(
+            ['name', 'default_code', 'volume', 'weight', 'pedidosya_product_type', 'type'])}
+        items = []
+        for line in order.order_line.read(['product_id', 'price_unit', 'discount', 'product_uom_qty', 'is_delivery'], load=None):
+            product = products.get(line['product_id'])
+            if product and product['type'] in ['product', 'consu'] and not line['is_delivery']:
+                items.append({
+                    'type': product['pedidosya_product_type'] or 'STANDARD',
+                    'value': line['price_unit'] * (1 - (line['discount'] or 0.0) / 100.0),
+                    'description': product['name'],
+                    'sku': product['default_code'] or '',
+                    'quantity': int(line['product_uom_qty']),
+                    'volume': product['volume'] * 1000000,
+                    'weight': product['weight'],
+                })
+        return items
+
+    results = []
+    for name, func in [
+        (f"order items, {options.lines} lines (line by line)", _line_by_line),
+        (f"order items, {options.lines} lines (batched, recomputed)", _batched_recomputed),
+        (f"order items, {options.lines} lines (batched, precomputed)", lambda: carrier._prepare_pedidosya_order_items(order.order_line)),
+    ]:
+        recorder = Recorder(name)
+        with Timer(recorder, count=options.repeat):
+            for _run in range(options.repeat):
+                # Cold ORM cache, as on a fresh request
+                env.invalidate_all()
+                recorder.time(func)
+        results.append(recorder)
+    return results
+
+
+def bench_rate(fixture, options):
+    """Rate quotes without caches, with the coverage index, from the quote cache and in bulk"""
+    carrier = fixture.carrier
+    results = []
+
+    def _run(name, setup=None, warm=False):
+        if setup:
+            carrier.write(setup)
+        if warm:
+            for order in fixture.orders:
+                carrier.pedidosya_rate_shipment(order)
+        recorder = Recorder(name)
+        with Timer(recorder, count=len(fixture.orders)):
+            for order in fixture.orders:
+                if not recorder.time(carrier.pedidosya_rate_shipment, order)['success']:
+                    recorder.errors += 1
+        results.append(recorder)
+
+    no_cache = {'pedidosya_quote_cache_ttl': 0, 'pedidosya_stale_quote_age': 0}
+    fixture.env['pedidosya.coverage'].search([('carrier_id', '=', carrier.id)]).unlink()
+    _run('rate quote (no coverage index)', dict(no_cache, pedidosya_coverage_index=False))
+    _run('rate quote (coverage index warm)', dict(no_cache, pedidosya_coverage_index=True), warm=True)
+    _run('rate quote (parallel coverage)', dict(no_cache, pedidosya_coverage_index=False, pedidosya_quote_mode='parallel'))
+    _run('rate quote (estimate only)', dict(no_cache, pedidosya_coverage_index=False, pedidosya_quote_mode='estimate_only'))
+    _run('rate quote (quote cache hit)', {'pedidosya_quote_cache_ttl': 300, 'pedidosya_quote_mode': 'sequential'}, warm=True)
+    for backend in _backends(fixture):
+        carrier.write(dict(no_cache, pedidosya_coverage_index=False, pedidosya_http_backend=backend))
+        recorder = Recorder(f"rate quote (bulk, {backend})")
+        with Timer(recorder, count=len(fixture.orders)):
+            quotes = recorder.time(carrier.pedidosya_rate_shipments_bulk, fixture.orders)
+        recorder.errors += sum(1 for res in quotes.values() if not res['success'])
+        results.append(recorder)
+    return results
+
+
+def _backends(fixture):
+    backends = ['threads']
+    if fixture.addon_module('pedidosya_async').is_available():
+        backends.append('asyncio')
+    return backends
+
+
+def _batches(records, size):
+    return [records[index:index + size] for index in range(0, len(records), size)]
+
+
+def bench_send(fixture, options):
+    """
+    Shipment creation per backend: batches of --batch pickings, then a sweep where
+    each size is sent in a single call with as many concurrent API calls
+    """
+    carrier = fixture.carrier
+    sizes = [int(size) for size in options.send_sweep.split(',') if size.strip()]
+    pickings = fixture.pickings
+    while len(pickings) < max(sizes, default=0):
+        # Copies keep their moves, so their payloads match the originals
+        pickings |= pickings[:max(sizes) - len(pickings)].copy()
+    results = []
+    for backend in _backends(fixture):
+        carrier.write({'pedidosya_http_backend': backend, 'pedidosya_max_concurrency': options.concurrency,
+                       'pedidosya_pool_size': options.concurrency})
+        fixture.pickings.write({'carrier_tracking_ref': False})
+        recorder = Recorder(f"bulk send, batches of {options.batch} ({backend})")
+        with Timer(recorder, count=len(fixture.pickings)):
+            for batch in _batches(fixture.pickings, options.batch):
+                res = recorder.time(carrier.pedidosya_send_shipping, batch)
+                recorder.errors += sum(1 for item in res if item.get('error_message'))
+        results.append(recorder)
+
+        for size in sizes:
+            batch = pickings[:size]
+            batch.write({'carrier_tracking_ref': False})
+            carrier.write({'pedidosya_max_concurrency': size, 'pedidosya_pool_size': size})
+            recorder = Recorder(f"send sweep, {size} concurrent ({backend})")
+            with Timer(recorder, count=size):
+                res = recorder.time(carrier.pedidosya_send_shipping, batch)
+            recorder.errors += sum(1 for item in res if item.get('error_message'))
+            results.append(recorder)
+    return results
+
+
+def bench_tracking(fixture, options):
+    """Tracking refresh of shipments in progress, per backend"""
+    fixture.ensure_shipped()
+    results = []
+    for backend in _backends(fixture):
+        fixture.carrier.pedidosya_http_backend = backend
+        fixture.pickings.write({'carrier_tracking_status': 'waiting', 'pedidosya_status': False,
+                                'pedidosya_status_sequence': 0, 'pedidosya_status_date': False})
+        recorder = Recorder(f"tracking refresh, batches of {options.batch} ({backend})")
+        with Timer(recorder, count=len(fixture.pickings)):
+            for batch in _batches(fixture.pickings, options.batch):
+                recorder.time(fixture.carrier.pedidosya_tracking_state_update, batch)
+        results.append(recorder)
+    return results
+
+
+def bench_labels(fixture, options):
+    """Label prints, downloaded then served from the label cache"""
+    fixture.ensure_shipped()
+    fixture.pickings._pedidosya_clear_label_cache()
+    results = []
+    for name in ('labels (download)', 'labels (cached)'):
+        recorder = Recorder(f"{name}, batches of {options.batch}")
+        with Timer(recorder, count=len(fixture.pickings)):
+            for batch in _batches(fixture.pickings, options.batch):
+                recorder.time(fixture.carrier.pedidosya_get_shipping_labels, batch)
+        results.append(recorder)
+    return results
+
+
+def bench_webhook(fixture, options):
+    """
+    Webhook handling on a picking table grown with filler pickings
+    The old code path replays the original controller for every event: carrier and
+    picking searches without the indexes on the webhook key and the shipping reference,
+    status write and chatter messages. It runs in a savepoint rolled back afterwards.
+    The new one enqueues with the cached key map, then processes the inbox. With
+    --server-url the events are also posted to the controller of a running server
+    """
+    from webhook_replay import generate_events, replay
+
+    env = fixture.env
+    fixture.ensure_shipped()
+    if options.filler_pickings:
+        # Copy a picking many times in SQL, the indexed lookup must stay fast on a large table
+        template = fixture.pickings[0]
+        env.cr.execute("""
+            SELECT column_name FROM information_schema.columns
+             WHERE table_name = 'stock_picking' AND column_name NOT IN ('id', 'name', 'carrier_tracking_ref')
+        """)
+        columns = ', '.join(f'"{row[0]}"' for row in env.cr.fetchall())
+        env.cr.execute(f"""
+            INSERT INTO stock_picking ({columns}, name, carrier_tracking_ref)
+            SELECT {columns}, 'BENCH/FILL/' || g, 'filler' || g
+              FROM stock_picking, generate_series(1, %s) g
+             WHERE stock_picking.id = %s
+        """, [options.filler_pickings, template.id])
+        env.cr.execute("ANALYZE stock_picking")
+
+    Carrier = env['delivery.carrier'].sudo()
+    Event = env['pedidosya.webhook.event'].sudo()
+    key = fixture.carrier.pedidosya_webhook_key
+    events = generate_events(fixture.pickings.mapped('carrier_tracking_ref'), duplicates=0.1, shuffle=True)
+
+    Picking = env['stock.picking'].sudo()
+    old_statuses = {
+        'CONFIRMED': 'waiting', 'IN_PROGRESS': 'in_transit', 'NEAR_PICKUP': 'in_transit',
+        'PICKED_UP': 'in_transit', 'NEAR_DROPOFF': 'in_transit', 'COMPLETED': 'delivered', 'CANCELLED': 'canceled',
+    }
+
+    def _apply_old(event, auth_key):
+        # Controller before the inbox: lookups, write and chatter inline, for every event
+        shipping_id = event['id']
+        status = event['data']['status']
+        carrier = None
+        if auth_key:
+            carrier = Carrier.search([('delivery_type', '=', 'pedidosya'), ('pedidosya_webhook_key', '=', auth_key)],
+                                     limit=1)
+        if not carrier:
+            picking = Picking.search([('carrier_tracking_ref', '=', shipping_id)], limit=1)
+            carrier = picking.carrier_id
+        picking = Picking.search([('carrier_tracking_ref', '=', shipping_id)], limit=1)
+        if picking:
+            # The inline validation of completed pickings is left out, it is deferred in both paths
+            picking.write({'carrier_tracking_status': old_statuses[status]})
+            if status == 'CANCELLED':
+                picking.message_post(body=f"PedidosYa shipment canceled<br/>Reason: {event['data'].get('cancelReason', '')}"
+                                          f"<br/>Code: {event['data'].get('cancelCode', '')}")
+            picking.message_post(body=f"PedidosYa Status Update: {status}")
+
+    def _enqueue_new(event):
+        return Event._enqueue(event, Carrier.browse(Carrier._get_pedidosya_carrier_id_by_webhook_key(key)))
+
+    results = []
+    # Without a matching key the old controller also searched the picking to find the carrier
+    for name, auth_key in (('old path', key), ('old path, unknown key', False)):
+        env.flush_all()
+        env.cr.execute("SAVEPOINT bench_webhook_old_path")
+        env.cr.execute(f"DROP INDEX IF EXISTS {', '.join(WEBHOOK_INDEXES)}")
+        recorder = Recorder(f"webhook inline apply ({name})")
+        with Timer(recorder, count=len(events)):
+            for event in events:
+                recorder.time(_apply_old, event, auth_key)
+        results.append(recorder)
+        env.flush_all()
+        env.cr.execute("ROLLBACK TO SAVEPOINT bench_webhook_old_path")
+        env.invalidate_all()
+
+    ingest = Recorder('webhook enqueue (new path)')
+    with Timer(ingest, count=len(events)):
+        for event in events:
+            ingest.time(_enqueue_new, event)
+    process = Recorder('webhook inbox processing (new path)')
+    pending = Event.search([('state', '=', 'pending')], order='id')
+    with Timer(process, count=len(pending)):
+        for chunk in _batches(pending, 500):
+            process.time(chunk._process_events)
+    results += [ingest, process]
+
+    if options.server_url:
+        # The server reads the fixture from its own cursors, it has to be committed
+        env.cr.commit()
+        results.append(replay(options.server_url, key, events, options.concurrency))
+    return results
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-c', '--config', help='Odoo configuration file')
+    parser.add_argument('-d', '--database', required=True)
+    parser.add_argument('--odoo-path', help='Directory of the Odoo sources, when odoo is not importable')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"Comma separated, among {', '.join(SCENARIOS)}")
+    parser.add_argument('--orders', type=int, default=100, help='Sale orders and pickings created for the run')
+    parser.add_argument('--order-lines', type=int, default=5, help='Lines per sale order')
+    parser.add_argument('--products', type=int, default=50)
+    parser.add_argument('--lines', type=int, default=500, help='Lines of the order used by the payload scenario')
+    parser.add_argument('--batch', type=int, default=50, help='Pickings per send, tracking and label call')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent API calls of batch operations')
+    parser.add_argument('--send-sweep', default='10,100,1000',
+                        help='Comma separated numbers of shipments sent at once by the send scenario')
+    parser.add_argument('--repeat', type=int, default=20, help='Runs of the json and payload scenarios')
+    parser.add_argument('--filler-pickings', type=int, default=100000,
+                        help='Extra pickings inserted for the webhook scenario')
+    parser.add_argument('--server-url', help='Also post the webhook events to this Odoo server, commits the fixture')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--api-url', help='Use this API instead of starting the mock')
+    parser.add_argument('--latency', type=float, default=50.0, help='Mock API mean latency in milliseconds')
+    parser.add_argument('--jitter', type=float, default=20.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=float, default=1.0)
+    parser.add_argument('--uncovered-rate', type=float, default=0.0)
+    parser.add_argument('--output', help='Save the results as JSON')
+    parser.add_argument('--baseline', help='Compare with results saved by --output, exit with 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown against the baseline')
+    return parser
+
+
+def main(options):
+    if options.odoo_path:
+        sys.path.insert(0, options.odoo_path)
+    import odoo
+    from odoo import api, SUPERUSER_ID
+    from odoo.modules.registry import Registry
+
+    odoo.tools.config.parse_config(['-c', options.config] if options.config else [])
+    mock = None
+    api_url = options.api_url
+    if not api_url:
+        mock, api_url = start_mock(options)
+
+    summaries = []
+    try:
+        registry = Registry(options.database)
+        with registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            try:
+                fixture = Fixture(env, options, api_url)
+                for scenario in options.scenarios.split(','):
+                    for recorder in globals()[f"bench_{scenario.strip()}"](fixture, options):
+                        summaries.append(recorder.summary())
+            finally:
+                cr.rollback()
+    finally:
+        if mock:
+            mock.terminate()
+
+    print_report(summaries)
+    if options.output:
+        save_report(summaries, options.output)
+    if options.baseline:
+        regressions = compare_reports(summaries, options.baseline, options.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(get_parser().parse_args()))
\ No newline at end of file
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Mock of the PedidosYa Courier API v3 endpoints used by the module
+
+    python3 benchmarks/mock_server.py --port 8899 --latency 80 --jitter 40 --error-rate 0.01 --throttle-rate 0.02
+
+Point Odoo to it with the system parameter pedidosya.api_url = http://127.0.0.1:8899
+Shipment statuses move one step forward every time a shipment is read.
+GET /_stats returns the number of calls and simulated failures per endpoint
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+STATUSES = ['CONFIRMED', 'IN_PROGRESS', 'NEAR_PICKUP', 'PICKED_UP', 'NEAR_DROPOFF', 'COMPLETED']
+
+
+def build_pdf(labels):
+    """Minimal PDF with one page per label, each showing its text"""
+    objects = []
+    page_ids = []
+    font_id = 3
+    for index, label in enumerate(labels):
+        page_id = 4 + index * 2
+        content_id = page_id + 1
+        page_ids.append(page_id)
+        stream = f"BT /F1 14 Tf 40 150 Td (PedidosYa {label}) Tj ET".encode()
+        objects.append((page_id, f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 288 216] "
+                                 f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {content_id} 0 R >>".encode()))
+        objects.append((content_id, b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)))
+    kids = ' '.join(f"{page_id} 0 R" for page_id in page_ids)
+    objects = [
+        (1, b"<< /Type /Catalog /Pages 2 0 R >>"),
+        (2, f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode()),
+        (font_id, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"),
+    ] + objects
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for object_id, body in objects:
+        offsets[object_id] = len(out)
+        out += b"%d 0 obj\n%s\nendobj\n" % (object_id, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for object_id in range(1, len(objects) + 1):
+        out += b"%010d 00000 n \n" % offsets[object_id]
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+class MockState:
+    """Shipments, webhook configuration and call counters shared by all handler threads"""
+
+    def __init__(self, options):
+        self.options = options
+        self.shipments = {}
+        self.webhooks = []
+        self.calls = Counter()
+        self.failures = Counter()
+        self.lock = threading.Lock()
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in a single write, avoiding delayed ACK stalls on keep-alive connections
+    wbufsize = -1
+    state = None
+
+    ROUTES = [
+        ('POST', re.compile(r'^/v3/authentication/token$'), 'auth'),
+        ('POST', re.compile(r'^/v3/estimates/coverage$'), 'coverage'),
+        ('POST', re.compile(r'^/v3/shippings/estimates$'), 'estimates'),
+        ('GET', re.compile(r'^/v3/shippings/labels$'), 'labels'),
+        ('POST', re.compile(r'^/v3/shippings/(?P<id>[^/]+)/cancel$'), 'cancel'),
+        ('GET', re.compile(r'^/v3/shippings/(?P<id>[^/]+)$'), 'get_shipping'),
+        ('POST', re.compile(r'^/v3/shippings$'), 'create_shipping'),
+        ('PUT', re.compile(r'^/v3/webhooks-configuration$'), 'put_webhooks'),
+        ('GET', re.compile(r'^/v3/webhooks-configuration$'), 'get_webhooks'),
+        ('GET', re.compile(r'^/_stats$'), 'stats'),
+    ]
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def _dispatch(self, method):
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        for route_method, pattern, name in self.ROUTES:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                break
+        else:
+            return self._send(404, {'message': f"Unknown endpoint {method} {url.path}"})
+
+        state = self.state
+        options = state.options
+        with state.lock:
+            state.calls[name] += 1
+        if name == 'stats':
+            return self._send(200, {'calls': state.calls, 'failures': state.failures, 'shipments': len(state.shipments)})
+
+        # Simulated network latency
+        delay = max(random.gauss(options.latency, options.jitter), 0) / 1000.0
+        if delay:
+            time.sleep(delay)
+
+        if random.random() < options.throttle_rate:
+            with state.lock:
+                state.failures[f"{name}:429"] += 1
+            return self._send(429, {'message': 'Too Many Requests'}, headers={'Retry-After': str(options.retry_after)})
+        if random.random() < options.error_rate:
+            with state.lock:
+                state.failures[f"{name}:503"] += 1
+            return self._send(503, {'message': 'Service Unavailable'})
+        if name != 'auth' and not self.headers.get('Authorization'):
+            return self._send(401, {'message': 'Missing token'})
+
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            return self._send(400, {'message': 'Invalid JSON'})
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        getattr(self, f"_{name}")(data, params, **match.groupdict())
+
+    def _send(self, status, data=None, content_type='application/json', headers=None):
+        body = data if isinstance(data, bytes) else json.dumps(data or {}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+    # Endpoints
+    def _auth(self, data, params):
+        if not (data.get('apiKey') and data.get('apiSecret')):
+            return self._send(401, {'message': 'Invalid credentials'})
+        self._send(200, {'access_token': f"mock-{uuid.uuid4().hex}", 'expires_in': self.state.options.token_lifetime})
+
+    def _is_covered(self, waypoints):
+        """Deterministic coverage per drop-off point, so repeated checks agree"""
+        drop_off = next((w for w in waypoints if w.get('type') == 'DROP_OFF'), {})
+        seed = f"{drop_off.get('latitude')}:{drop_off.get('longitude')}"
+        return random.Random(seed).random() >= self.state.options.uncovered_rate
+
+    def _coverage(self, data, params):
+        covered = self._is_covered(data.get('waypoints', []))
+        self._send(200, {'status': 200 if covered else 404})
+
+    def _price(self, data):
+        items = data.get('items', [])
+        weight = sum((item.get('weight') or 0) * (item.get('quantity') or 1) for item in items)
+        waypoints = data.get('waypoints') or [{}]
+        pickup, drop_off = waypoints[0], waypoints[-1]
+        distance = math.hypot((pickup.get('latitude') or 0) - (drop_off.get('latitude') or 0),
+                              (pickup.get('longitude') or 0) - (drop_off.get('longitude') or 0)) * 111
+        return round(150 + 35 * distance + 10 * weight, 2)
+
+    def _estimates(self, data, params):
+        if not self._is_covered(data.get('waypoints', [])):
+            return self._send(422, {'code': 'WAYPOINTS_OUT_OF_ZONE', 'message': 'Route not covered'})
+        price = self._price(data)
+        self._send(200, {
+            'deliveryOffers': [
+                {'deliveryMode': 'EXPRESS', 'pricing': {'total': price, 'currency': 'UYU'}},
+                {'deliveryMode': 'SCHEDULED', 'pricing': {'total': round(price * 0.8, 2), 'currency': 'UYU'}},
+            ],
+        })
+
+    def _create_shipping(self, data, params):
+        if not data.get('items') or not data.get('waypoints'):
+            return self._send(400, {'message': 'Missing items or waypoints'})
+        shipping_id = uuid.uuid4().hex[:12]
+        with self.state.lock:
+            self.state.shipments[shipping_id] = {'referenceId': data.get('referenceId'), 'step': 0}
+        self._send(200, {
+            'shippingId': shipping_id,
+            'confirmationCode': shipping_id[:6].upper(),
+            'shareLocationUrl': f"https://mock.pedidosya/track/{shipping_id}",
+            'status': 'CONFIRMED',
+            'route': {'pricing': {'total': self._price(data)}},
+        })
+
+    def _get_shipping(self, data, params, id):
+        with self.state.lock:
+            shipment = self.state.shipments.get(id)
+            if shipment is None:
+                # Unknown to this mock, e.g. created before a restart: start its lifecycle now
+                shipment = self.state.shipments[id] = {'referenceId': None, 'step': 0}
+            elif shipment.get('status') != 'CANCELLED':
+                shipment['step'] = min(shipment['step'] + 1, len(STATUSES) - 1)
+            status = shipment.get('status') or STATUSES[shipment['step']]
+        self._send(200, {'id': id, 'referenceId': shipment['referenceId'], 'status': status})
+
+    def _cancel(self, data, params, id):
+        with self.state.lock:
+            shipment = self.state.shipments.setdefault(id, {'referenceId': None, 'step': 0})
+            shipment['status'] = 'CANCELLED'
+        self._send(200, {'id': id, 'status': 'CANCELLED', 'reasonText': data.get('reasonText')})
+
+    def _labels(self, data, params):
+        ids = [value for value in (params.get('values') or '').split(',') if value]
+        if not ids:
+            return self._send(400, {'message': 'Missing values'})
+        self._send(200, build_pdf(ids), content_type='application/pdf')
+
+    def _put_webhooks(self, data, params):
+        with self.state.lock:
+            self.state.webhooks = data.get('webhooksConfiguration', [])
+        self._send(200, {'webhooksConfiguration': self.state.webhooks})
+
+    def _get_webhooks(self, data, params):
+        self._send(200, {'webhooksConfiguration': self.state.webhooks})
+
+
+class MockServer(ThreadingHTTPServer):
+    # Large accept backlog, bursts of new connections must not wait for SYN retransmissions
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def make_server(options):
+    """Build the mock server, call serve_forever() on it"""
+    handler = type('Handler', (MockHandler,), {'state': MockState(options)})
+    return MockServer((options.host, options.port), handler)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8899)
+    parser.add_argument('--latency', type=float, default=50.0, help='Mean response latency in milliseconds')
+    parser.add_argument('--jitter', type=float, default=20.0, help='Standard deviation of the latency in milliseconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of calls answered with a 503')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Share of calls answered with a 429')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After seconds sent with 429 responses')
+    parser.add_argument('--uncovered-rate', type=float, default=0.0, help='Share of drop-off points outside the coverage area')
+    parser.add_argument('--token-lifetime', type=int, default=3600, help='Lifetime of issued tokens in seconds')
+    return parser
+
+
+if __name__ == '__main__':
+    options = get_parser().parse_args()
+    server = make_server(options)
+    print(f"PedidosYa mock API listening on http://{options.host}:{server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
\ No newline at end of file
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import json
+import math
+import time
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = max(math.ceil(pct / 100.0 * len(values)), 1)
+    return values[rank - 1]
+
+
+class Recorder:
+    """Collects call durations of a scenario and summarizes them"""
+
+    def __init__(self, name):
+        self.name = name
+        self.durations = []
+        self.errors = 0
+        self.wall = 0.0
+        self.count = 0
+
+    def time(self, func, *args, **kwargs):
+        """Call func and record its duration, exceptions are counted as errors and re-raised"""
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.durations.append(time.perf_counter() - start)
+
+    def summary(self):
+        count = self.count or len(self.durations)
+        return {
+            'name': self.name,
+            'count': count,
+            'errors': self.errors,
+            'p50_ms': percentile(self.durations, 50) * 1000,
+            'p99_ms': percentile(self.durations, 99) * 1000,
+            'throughput': count / self.wall if self.wall else 0.0,
+        }
+
+
+class Timer:
+    """Context manager measuring the wall time of a whole scenario into a recorder"""
+
+    def __init__(self, recorder, count=None):
+        self.recorder = recorder
+        self.count = count
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self.recorder
+
+    def __exit__(self, *exc):
+        self.recorder.wall += time.perf_counter() - self.start
+        if self.count is not None:
+            self.recorder.count += self.count
+
+
+def print_report(summaries):
+    print(f"{'scenario':<40} {'count':>7} {'errors':>6} {'p50 ms':>10} {'p99 ms':>10} {'items/s':>12}")
+    for s in summaries:
+        print(f"{s['name']:<40} {s['count']:>7} {s['errors']:>6} {s['p50_ms']:>10.2f} {s['p99_ms']:>10.2f} "
+              f"{s['throughput']:>12.1f}")
+
+
+def save_report(summaries, path):
+    with open(path, 'w') as f:
+        json.dump(summaries, f, indent=2)
+
+
+def compare_reports(summaries, baseline_path, tolerance=0.2):
+    """
+    Compare results with a saved baseline, return the regressions found
+    A scenario regresses when its p99 grows or its throughput drops by more than tolerance
+    """
+    with open(baseline_path) as f:
+        baseline = {s['name']: s for s in json.load(f)}
+    regressions = []
+    for s in summaries:
+        base = baseline.get(s['name'])
+        if not base:
+            continue
+        if base['p99_ms'] and s['p99_ms'] > base['p99_ms'] * (1 + tolerance):
+            regressions.append(f"{s['name']}: p99 {base['p99_ms']:.2f}ms -> {s['p99_ms']:.2f}ms")
+        if base['throughput'] and s['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append(f"{s['name']}: throughput {base['throughput']:.1f} -> {s['throughput']:.1f}")
+    return regressions
\ No newline at end of file
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Replay PedidosYa shipment status webhooks against an Odoo server
+
+    python3 benchmarks/webhook_replay.py --url http://localhost:8069 --key WEBHOOK_KEY \\
+        --ids-file shipping_ids.txt --concurrency 20 --duplicates 0.1 --shuffle
+
+Every shipment goes through the full status lifecycle, optionally with retried
+(duplicate) and out of order deliveries. Without shipping ids, synthetic ones are
+generated: the events are ingested and then ignored by the inbox processor
+"""
+
+import argparse
+import datetime
+import json
+import random
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from stats import Recorder, Timer, compare_reports, print_report, save_report
+
+LIFECYCLE = ['CONFIRMED', 'IN_PROGRESS', 'NEAR_PICKUP', 'PICKED_UP', 'NEAR_DROPOFF', 'COMPLETED']
+
+
+def generate_events(shipping_ids, statuses=LIFECYCLE, duplicates=0.0, shuffle=False, cancel_rate=0.0):
+    """Webhook bodies for every shipment and status, in delivery order"""
+    start = datetime.datetime.now(datetime.timezone.utc)
+    events = []
+    for shipping_id in shipping_ids:
+        lifecycle = list(statuses)
+        if random.random() < cancel_rate:
+            lifecycle = lifecycle[:random.randint(1, len(lifecycle) - 1)] + ['CANCELLED']
+        for step, status in enumerate(lifecycle):
+            event = {
+                'topic': 'SHIPPING_STATUS',
+                'id': shipping_id,
+                'referenceId': f"BENCH/{shipping_id}",
+                'generated': (start + datetime.timedelta(seconds=step)).isoformat(),
+                'data': {'status': status},
+            }
+            if status == 'CANCELLED':
+                event['data'].update({'cancelCode': 'BENCH', 'cancelReason': 'Canceled by the webhook replay'})
+            events.append(event)
+            if random.random() < duplicates:
+                events.append(event)
+    if shuffle:
+        random.shuffle(events)
+    return events
+
+
+def send_event(url, key, event, timeout=30):
+    request = urllib.request.Request(url, data=json.dumps(event).encode(), method='POST', headers={
+        'Content-Type': 'application/json',
+        'Authorization': key,
+    })
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+        return response.status
+
+
+def replay(url, key, events, concurrency=10):
+    """Post the events with concurrent senders, returns the recorder of the run"""
+    recorder = Recorder('webhook ingestion (http)')
+    endpoint = f"{url.rstrip('/')}/pedidosya/webhook"
+
+    def _send(event):
+        try:
+            recorder.time(send_event, endpoint, key, event)
+        except (urllib.error.URLError, OSError):
+            pass
+
+    with Timer(recorder, count=len(events)):
+        with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+            list(executor.map(_send, events))
+    return recorder
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8069', help='Base URL of the Odoo server')
+    parser.add_argument('--key', default='', help='Webhook authorization key of the carrier')
+    parser.add_argument('--ids-file', help='File with one PedidosYa shipping id per line')
+    parser.add_argument('--count', type=int, default=100, help='Number of synthetic shipments without --ids-file')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--duplicates', type=float, default=0.0, help='Share of events delivered twice')
+    parser.add_argument('--cancel-rate', type=float, default=0.0, help='Share of shipments canceled midway')
+    parser.add_argument('--shuffle', action='store_true', help='Deliver events out of order')
+    parser.add_argument('--output', help='Save the results as JSON')
+    parser.add_argument('--baseline', help='Compare with results saved by --output, exit with 1 on regressions')
+    return parser
+
+
+if __name__ == '__main__':
+    options = get_parser().parse_args()
+    if options.ids_file:
+        with open(options.ids_file) as f:
+            shipping_ids = [line.strip() for line in f if line.strip()]
+    else:
+        shipping_ids = [f"bench{index:08d}" for index in range(options.count)]
+    events = generate_events(shipping_ids, duplicates=options.duplicates, shuffle=options.shuffle,
+                             cancel_rate=options.cancel_rate)
+    summaries = [replay(options.url, options.key, events, options.concurrency).summary()]
+    print_report(summaries)
+    if options.output:
+        save_report(summaries, options.output)
+    if options.baseline:
+        regressions = compare_reports(summaries, options.baseline)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        raise SystemExit(1 if regressions else 0)
\ No newline at end of file
@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 
-from odoo import http, _
+from odoo import http
 from odoo.http import request
+import hmac
 import logging
-import json
-from werkzeug.exceptions import BadRequest, Unauthorized
+import time
+from werkzeug.exceptions import BadRequest, NotFound, Unauthorized
+
+from ..models.pedidosya_cache import webhook_seen, skipped_status_updates
+from ..models.pedidosya_json import loads
+from ..models.pedidosya_metrics import metrics
 
 _logger = logging.getLogger(__name__)
 
@@ -14,18 +19,22 @@ class PedidosYaController(http.Controller):
     def pedidosya_webhook(self, **kwargs):
         """
         Controller for PedidosYa webhook callbacks
-        This receives shipping status updates from PedidosYa
+        This receives shipping status updates from PedidosYa and queues them,
+        pickings are updated asynchronously by the webhook event processor
         """
+        start = time.monotonic()
         # Get authorization header
         auth_header = request.httprequest.headers.get('Authorization')
         api_key_header = request.httprequest.headers.get('x-api-key')
         
-        # Load JSON data
-        try:
-            data = json.loads(request.httprequest.data.decode('utf-8'))
-        except json.JSONDecodeError as e:
-            _logger.error(f"Invalid JSON received from PedidosYa webhook: {e}")
-            raise BadRequest("Invalid JSON format")
+        # Load JSON data, already parsed by the json route dispatcher
+        data = getattr(request.dispatcher, 'jsonrequest', None)
+        if data is None:
+            try:
+                data = loads(request.httprequest.get_data())
+            except ValueError as e:
+                _logger.error(f"Invalid JSON received from PedidosYa webhook: {e}")
+                raise BadRequest("Invalid JSON format")
         
         # Validate request
         if not data:
@@ -35,8 +44,6 @@ class PedidosYaController(http.Controller):
         # Extract fields from data
         topic = data.get('topic')
         shipping_id = data.get('id')
-        reference_id = data.get('referenceId')
-        confirmation_code = data.get('confirmationCode')
         status_data = data.get('data', {})
         status = status_data.get('status')
         
@@ -50,63 +57,43 @@ class PedidosYaController(http.Controller):
             _logger.info(f"Ignoring non-shipping status webhook: {topic}")
             return {'status': 'OK'}
         
-        # Find carrier by webhook key
-        carrier = None
+        # Drop retried events already received by this worker before any database access
+        event_key = (shipping_id, status, data.get('generated'))
+        if event_key in webhook_seen:
+            skipped_status_updates['duplicate'] += 1
+            _logger.debug(f"Ignoring duplicate PedidosYa webhook for {shipping_id}: {status}")
+            return {'status': 'OK'}
+        
+        # Find carrier by webhook key, resolved from a cached key map
+        carrier = request.env['delivery.carrier'].sudo()
+        auth_key = auth_header or api_key_header
+        if auth_key:
+            carrier = carrier.browse(carrier._get_pedidosya_carrier_id_by_webhook_key(auth_key))
         
-        if auth_header or api_key_header:
-            auth_key = auth_header or api_key_header
-            carrier = request.env['delivery.carrier'].sudo().search([
-                ('delivery_type', '=', 'pedidosya'),
-                ('pedidosya_webhook_key', '=', auth_key)
-            ], limit=1)
+        # Store the event, it is applied to the picking by the inbox processor
+        request.env['pedidosya.webhook.event'].sudo()._enqueue(data, carrier)
+        # Only an event actually stored counts as seen, a failed insert or commit lets the retry through
+        request.env.cr.postcommit.add(lambda: webhook_seen.add(event_key))
+        metrics.observe_webhook('receive', time.monotonic() - start)
         
-        # If carrier not found by key, search by reference
-        if not carrier and shipping_id:
-            picking = request.env['stock.picking'].sudo().search([
-                ('carrier_tracking_ref', '=', shipping_id)
-            ], limit=1)
-            if picking:
-                carrier = picking.carrier_id
+        return {'status': 'OK'}
+    
+    @http.route('/pedidosya/metrics', type='http', auth='public', csrf=False, methods=['GET'])
+    def pedidosya_metrics(self, **kwargs):
+        """
+        Metrics of the worker serving the request, in the Prometheus text format
+        Disabled unless the pedidosya.metrics_token system parameter is set, the token
+        is expected as a bearer Authorization header or as the token query parameter
+        """
+        token = request.env['ir.config_parameter'].sudo().get_param('pedidosya.metrics_token')
+        if not token:
+            raise NotFound()
         
-        # Handle shipping status update
-        if shipping_id:
-            picking = request.env['stock.picking'].sudo().search([
-                ('carrier_tracking_ref', '=', shipping_id)
-            ], limit=1)
-            
-            if picking:
-                # Update picking status based on PedidosYa status
-                if status == 'COMPLETED':
-                    picking.sudo().write({'carrier_tracking_status': 'delivered'})
-                    # If picking is not done, mark it as done
-                    if picking.state != 'done':
-                        picking.sudo().with_context(tracking_disable=False).button_validate()
-                elif status in ['IN_PROGRESS', 'NEAR_PICKUP', 'PICKED_UP', 'NEAR_DROPOFF']:
-                    picking.sudo().write({'carrier_tracking_status': 'in_transit'})
-                elif status == 'CANCELLED':
-                    picking.sudo().write({'carrier_tracking_status': 'canceled'})
-                    # Add cancel reason if provided
-                    cancel_reason = status_data.get('cancelReason', '')
-                    cancel_code = status_data.get('cancelCode', '')
-                    if cancel_reason or cancel_code:
-                        picking.sudo().message_post(
-                            body=_(f"PedidosYa shipment canceled<br/>"
-                                  f"Reason: {cancel_reason}<br/>"
-                                  f"Code: {cancel_code}")
-                        )
-                elif status == 'CONFIRMED':
-                    picking.sudo().write({'carrier_tracking_status': 'waiting'})
-                
-                # Add message with status update
-                picking.sudo().message_post(
-                    body=_(f"PedidosYa Status Update: {status}")
-                )
-                
-                _logger.info(f"Updated picking {picking.name} with PedidosYa status: {status}")
-                
-                return {'status': 'OK'}
-            else:
-                _logger.warning(f"Picking not found for PedidosYa shipping ID: {shipping_id}")
-                return {'status': 'OK'}
+        auth_header = request.httprequest.headers.get('Authorization') or ''
+        provided = auth_header[7:] if auth_header.startswith('Bearer ') else kwargs.get('token', '')
+        if not hmac.compare_digest(provided.encode(), token.encode()):
+            raise Unauthorized()
         
-        return {'status': 'OK'}
\ No newline at end of file
+        return request.make_response(metrics.render_prometheus(), headers=[
+            ('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+        ])
\ No newline at end of file
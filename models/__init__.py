@@ -1,5 +1,13 @@
 # -*- coding: utf-8 -*-
 
+from . import pedidosya_request
 from . import delivery_carrier
 from . import product_template
-from . import webhook_config
\ No newline at end of file
+from . import webhook_config
+from . import webhook_event
+from . import pedidosya_coverage
+from . import pedidosya_quote_history
+from . import pedidosya_dashboard
+from . import pedidosya_service_area
+from . import res_partner
+from . import sale_order
\ No newline at end of file
@@ -1,22 +1,106 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields, api, _
-from odoo.exceptions import UserError
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import UserError, ValidationError
+from odoo.tools import split_every
+from odoo.tools.pdf import PdfFileReader, PdfFileWriter
+from odoo.tools.sql import create_index
+from psycopg2 import OperationalError
 import requests
-import json
 import logging
 import datetime
+import hashlib
+import io
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from .pedidosya_cache import token_cache, get_quote_cache, clear_quote_cache, skipped_status_updates
+from .pedidosya_geo import haversine
+from .pedidosya_json import dumps, loads
+from .pedidosya_metrics import metrics
+from . import pedidosya_async
+from .pedidosya_request import PedidosYaRequest, CircuitOpenError, decode_response, imap_concurrent, map_concurrent
 
 _logger = logging.getLogger(__name__)
 
+# Token lifetime in seconds assumed when the API does not return expires_in
+PEDIDOSYA_DEFAULT_TOKEN_LIFETIME = 3600
+
+# Picking tracking status for each PedidosYa shipping status
+PEDIDOSYA_TRACKING_STATUS = {
+    'CONFIRMED': 'waiting',
+    'IN_PROGRESS': 'in_transit',
+    'NEAR_PICKUP': 'in_transit',
+    'PICKED_UP': 'in_transit',
+    'NEAR_DROPOFF': 'in_transit',
+    'COMPLETED': 'delivered',
+    'CANCELLED': 'canceled',
+}
+PEDIDOSYA_TERMINAL_TRACKING_STATUSES = ['delivered', 'canceled']
+
+# Order of PedidosYa shipping statuses, used to drop events older than the current status
+PEDIDOSYA_STATUS_SEQUENCE = {
+    'CONFIRMED': 10,
+    'IN_PROGRESS': 20,
+    'NEAR_PICKUP': 30,
+    'PICKED_UP': 40,
+    'NEAR_DROPOFF': 50,
+    'COMPLETED': 100,
+    'CANCELLED': 100,
+}
+PEDIDOSYA_FINAL_STATUS_SEQUENCE = 100
+
+# Status fields of a picking cleared when it gets a new shipment
+PEDIDOSYA_STATUS_RESET = {
+    'pedidosya_status': False,
+    'pedidosya_status_sequence': 0,
+    'pedidosya_status_date': False,
+    'carrier_tracking_status': False,
+}
+
+# Error codes of the estimates API rejecting a route as out of coverage
+PEDIDOSYA_NOT_COVERED_CODES = ('WAYPOINTS_OUT_OF_ZONE',)
+
+# Attempts to validate a delivered picking before leaving it to the user
+PEDIDOSYA_VALIDATE_MAX_ATTEMPTS = 6
+
+# Wizards button_validate returns instead of validating, print and report actions come after it
+PEDIDOSYA_VALIDATION_WIZARDS = (
+    'stock.backorder.confirmation',
+    'stock.immediate.transfer',
+    'expiry.picking.confirmation',
+    'confirm.stock.sms',
+)
+
+# Fields read in batch to build shipment items and waypoints
+PEDIDOSYA_PRODUCT_FIELDS = ['pedidosya_item_json', 'pedidosya_volume', 'pedidosya_weight', 'list_price', 'type']
+PEDIDOSYA_PARTNER_FIELDS = ['name', 'street', 'street2', 'city', 'partner_latitude', 'partner_longitude', 'phone', 'mobile']
+PEDIDOSYA_EMPTY_PARTNER = dict.fromkeys(PEDIDOSYA_PARTNER_FIELDS, False)
+PEDIDOSYA_ORDER_LINE_FIELDS = ['product_id', 'price_unit', 'discount', 'product_uom_qty', 'is_delivery']
+
+# Attachment descriptions of cached shipment labels and of merged label prints
+PEDIDOSYA_LABEL_TAG = 'pedidosya_label'
+PEDIDOSYA_LABELS_BATCH_TAG = 'pedidosya_labels'
+PEDIDOSYA_LABEL_NAME = 'PedidosYa_Label_%s.pdf'
+
 class DeliveryPedidosYa(models.Model):
     _inherit = 'delivery.carrier'
 
     delivery_type = fields.Selection(selection_add=[('pedidosya', 'PedidosYa')], ondelete={'pedidosya': 'set default'})
     pedidosya_api_key = fields.Char(string='API Key', help='PedidosYa API Key')
     pedidosya_api_secret = fields.Char(string='API Secret', help='PedidosYa API Secret')
-    pedidosya_token = fields.Char(string='Auth Token', readonly=True, help='PedidosYa authentication token')
+    pedidosya_token = fields.Char(string='Auth Token', readonly=True,
+                                  help='PedidosYa authentication token shared by all workers (database token storage only)')
     pedidosya_token_expiry = fields.Datetime(string='Token Expiry', readonly=True)
+    pedidosya_token_backend = fields.Selection([
+        ('memory', 'Worker Memory'),
+        ('database', 'Database (shared by all workers)')
+    ], string='Token Storage', default='memory',
+        help='Worker Memory: each worker keeps its own token, nothing is written to the database.\n'
+             'Database: workers share one token stored on the carrier, refreshed under an advisory lock.')
+    pedidosya_token_refresh_margin = fields.Integer(string='Token Refresh Margin (s)', default=300,
+                                                    help='Refresh the token this many seconds before it expires')
     pedidosya_environment = fields.Selection([
         ('test', 'Testing'),
         ('prod', 'Production')
@@ -26,70 +110,243 @@ class DeliveryPedidosYa(models.Model):
         ('SCHEDULED', 'Scheduled (Specific time frame)')
     ], string='Service Type', default='EXPRESS')
     pedidosya_webhook_url = fields.Char(string='Webhook URL', help='URL for PedidosYa to send shipping status updates')
-    pedidosya_webhook_key = fields.Char(string='Webhook Authorization Key', help='Security key for webhook authentication')
+    pedidosya_webhook_key = fields.Char(string='Webhook Authorization Key', index='btree_not_null',
+                                        help='Security key for webhook authentication')
+    pedidosya_connect_timeout = fields.Float(string='Connect Timeout (s)', default=5.0,
+                                             help='Seconds to wait for a connection to the PedidosYa API')
+    pedidosya_read_timeout = fields.Float(string='Read Timeout (s)', default=30.0,
+                                          help='Seconds to wait for a response from the PedidosYa API')
+    pedidosya_pool_size = fields.Integer(string='Connection Pool Size', default=10,
+                                         help='Maximum number of keep-alive connections kept open per worker')
+    pedidosya_max_concurrency = fields.Integer(string='Max Concurrent Requests', default=8,
+                                               help='Maximum number of API calls sent at the same time by batch operations')
+    pedidosya_http_backend = fields.Selection([
+        ('threads', 'Thread Pool'),
+        ('asyncio', 'Asyncio (httpx)')
+    ], string='Batch HTTP Backend', default='threads',
+        help='How batch operations send their concurrent API calls. '
+             'Asyncio needs the httpx library and falls back to the thread pool without it.')
+    pedidosya_label_chunk_size = fields.Integer(string='Labels per Request', default=50,
+                                                help='Number of shipments whose labels are requested in a single API call')
+    pedidosya_rate_limit = fields.Float(string='Rate Limit (requests/s)', default=10.0,
+                                        help='Maximum API calls per second sent by each worker, 0 for no limit')
+    pedidosya_max_retries = fields.Integer(string='Max Retries', default=3,
+                                           help='Retries of throttled or failed API calls that are safe to repeat')
+    pedidosya_breaker_threshold = fields.Integer(string='Circuit Breaker Threshold', default=5,
+                                                 help='Consecutive failed or slow API calls after which calls are suspended, 0 disables the breaker')
+    pedidosya_breaker_slow_call = fields.Float(string='Slow Call (s)', default=10.0,
+                                               help='API calls taking longer than this count as failures for the circuit breaker, 0 to ignore durations')
+    pedidosya_breaker_cooldown = fields.Integer(string='Circuit Breaker Cooldown (s)', default=60,
+                                                help='Seconds API calls stay suspended before a single call is tried again')
+    pedidosya_slow_log_threshold = fields.Float(string='Slow Call Log (s)', default=5.0,
+                                                help='API calls taking longer than this are logged with a fingerprint of the request, 0 disables the log')
+    pedidosya_stale_quote_age = fields.Integer(string='Fallback Quote Validity (h)', default=24,
+                                               help='While the API is unavailable, quote the last known price of a similar delivery '
+                                                    'if it is not older than this, 0 disables the fallback')
+    pedidosya_quote_cache_ttl = fields.Integer(string='Quote Cache TTL (s)', default=300,
+                                               help='Seconds a rate quote is reused for the same route and cart, 0 disables the cache')
+    pedidosya_quote_cache_size = fields.Integer(string='Quote Cache Size', default=1000,
+                                                help='Maximum number of quotes kept in memory per worker')
+    pedidosya_quote_mode = fields.Selection([
+        ('sequential', 'Coverage Check, then Estimate'),
+        ('parallel', 'Coverage Check and Estimate in Parallel'),
+        ('estimate_only', 'Estimate Only')
+    ], string='Quote Mode', default='sequential',
+        help='Sequential: check coverage first and only then request the estimate.\n'
+             'Parallel: send the coverage check and the estimate at the same time.\n'
+             'Estimate Only: skip the coverage check, an estimate without offers means the route is not covered.')
+    pedidosya_coverage_index = fields.Boolean(string='Use Coverage Index', default=True,
+                                              help='Answer coverage checks from previously checked areas instead of calling the API')
+    pedidosya_coverage_ttl = fields.Integer(string='Coverage Validity (h)', default=24,
+                                            help='Hours a coverage result is trusted before it is checked again')
+    pedidosya_coverage_precision = fields.Integer(string='Coverage Cell Precision', default=6,
+                                                  help='Geohash length of a coverage cell: 6 is about 1.2km x 0.6km, 7 about 150m x 150m')
+    pedidosya_service_area_ids = fields.One2many('pedidosya.service.area', 'carrier_id', string='Service Areas',
+                                                 help='Delivery area of each warehouse, addresses outside of it are rejected '
+                                                      'without calling the API. Warehouses without an area are not restricted')
+    pedidosya_eligible_partner_ids = fields.Many2many('res.partner', 'pedidosya_eligible_partner_rel', 'carrier_id', 'partner_id',
+                                                      string='Eligible Customers', readonly=True)
+    pedidosya_consolidate = fields.Boolean(string='Multi-stop Shipments', default=False,
+                                           help='Group pickings sent together into shipments with several drop-offs')
+    pedidosya_consolidation_window = fields.Integer(string='Time Window (min)', default=60,
+                                                    help='Maximum gap between the scheduled dates of pickings sharing a shipment')
+    pedidosya_consolidation_radius = fields.Float(string='Radius (km)', default=3.0,
+                                                  help='Maximum distance between the drop-offs of a shipment')
+    pedidosya_consolidation_max_stops = fields.Integer(string='Max Stops', default=4,
+                                                       help='Maximum number of drop-offs of a shipment')
+    pedidosya_consolidation_max_weight = fields.Float(string='Max Weight (kg)', default=20.0,
+                                                      help='Maximum total weight of a shipment, 0 for no limit')
+    pedidosya_consolidation_max_volume = fields.Float(string='Max Volume (cm³)', default=0.0,
+                                                      help='Maximum total volume of a shipment, 0 for no limit')
     
     # URLs for API endpoints
     def _get_pedidosya_api_url(self):
+        # Point every carrier to another server, e.g. the mock API of the load benchmarks
+        api_url = self.env['ir.config_parameter'].sudo().get_param('pedidosya.api_url')
+        if api_url:
+            return api_url.rstrip('/')
         if self.pedidosya_environment == 'test':
             return 'https://courier-api-sandbox.pedidosya.com'
         return 'https://courier-api.pedidosya.com'
 
+    # Pooled API client, shared per carrier and environment within the worker
+    def _get_pedidosya_client(self):
+        self.ensure_one()
+        return PedidosYaRequest(
+            self._get_pedidosya_api_url(),
+            (self.env.cr.dbname, self.id, self.pedidosya_environment),
+            connect_timeout=self.pedidosya_connect_timeout,
+            read_timeout=self.pedidosya_read_timeout,
+            pool_size=self.pedidosya_pool_size,
+            rate_limit=self.pedidosya_rate_limit,
+            max_retries=self.pedidosya_max_retries,
+            breaker_threshold=self.pedidosya_breaker_threshold,
+            breaker_slow_call=self.pedidosya_breaker_slow_call,
+            breaker_cooldown=self.pedidosya_breaker_cooldown,
+            slow_log=self.pedidosya_slow_log_threshold,
+        )
+
+    def _get_pedidosya_async_client(self, client=None):
+        """Asyncio client for batch operations, None when the thread pool backend is used"""
+        self.ensure_one()
+        if self.pedidosya_http_backend != 'asyncio':
+            return None
+        if not pedidosya_async.is_available():
+            _logger.warning("The httpx library is not installed, PedidosYa batch calls use the thread pool")
+            return None
+        return pedidosya_async.PedidosYaAsyncRequest(client or self._get_pedidosya_client(),
+                                                     max_concurrency=self.pedidosya_max_concurrency)
+    
     # Authentication method
     def _get_pedidosya_auth_token(self):
         """
         Get authentication token from PedidosYa API
-        If token exists and is not expired, return it
-        Otherwise, request a new token
+        Tokens are cached in worker memory and refreshed ahead of expiry,
+        only one thread per worker requests a new token at a time
         """
-        now = fields.Datetime.now()
-        if self.pedidosya_token and self.pedidosya_token_expiry and self.pedidosya_token_expiry > now:
-            return self.pedidosya_token
+        self.ensure_one()
+        key = self._get_pedidosya_token_cache_key()
+        token = token_cache.get(key)
+        if token:
+            return token
+        
+        with token_cache.lock_for(key):
+            # Another thread may have refreshed the token while we waited
+            token = token_cache.get(key, count=False)
+            if token:
+                return token
             
-        url = f"{self._get_pedidosya_api_url()}/v3/authentication/token"
-        headers = {
-            'Content-Type': 'application/json'
-        }
+            if self.pedidosya_token_backend == 'database':
+                token, expires_in = self._get_pedidosya_shared_token()
+            else:
+                token, expires_in = self._request_pedidosya_auth_token()
+            
+            token_cache.set(key, token, ttl=self._get_pedidosya_token_ttl(expires_in))
+            return token
+    
+    def _get_pedidosya_token_cache_key(self):
+        return (self.env.cr.dbname, self.id, self.pedidosya_environment, self.pedidosya_api_key)
+    
+    def _get_pedidosya_token_ttl(self, expires_in):
+        """Seconds a token may be served from cache, keeping a refresh margin before real expiry"""
+        margin = min(self.pedidosya_token_refresh_margin or 0, expires_in / 2)
+        return max(expires_in - margin, 0)
+    
+    def _request_pedidosya_auth_token(self):
+        """Request a new token, returns the token and its lifetime in seconds"""
         data = {
             'apiKey': self.pedidosya_api_key,
             'apiSecret': self.pedidosya_api_secret
         }
         
         try:
-            response = requests.post(url, headers=headers, data=json.dumps(data))
+            response = self._get_pedidosya_client().post('/v3/authentication/token', data=data, idempotent=True)
             response.raise_for_status()
-            result = response.json()
+            result = decode_response(response)
             token = result.get('access_token')
             
-            # Set token expiry to 1 hour from now (assuming PedidosYa tokens last for this duration)
-            expiry = now + datetime.timedelta(hours=1)
-            
-            # Save token and expiry
-            self.write({
-                'pedidosya_token': token,
-                'pedidosya_token_expiry': expiry
-            })
+            # Fall back to 1 hour when the API does not tell us the token lifetime
+            try:
+                expires_in = float(result.get('expires_in') or PEDIDOSYA_DEFAULT_TOKEN_LIFETIME)
+            except (TypeError, ValueError):
+                expires_in = PEDIDOSYA_DEFAULT_TOKEN_LIFETIME
             
-            return token
+            return token, expires_in
         except requests.exceptions.RequestException as e:
             _logger.error(f"PedidosYa authentication error: {e}")
             raise UserError(_('Error connecting to PedidosYa: %s') % str(e))
     
+    def _get_pedidosya_shared_token(self):
+        """
+        Share one token between all workers through the carrier row
+        An advisory lock makes a single worker refresh it, the others wait and
+        reuse the stored token. Runs on its own cursor so the carrier row is
+        never locked by the business transaction that needed the token
+        """
+        lock_id = int(hashlib.sha1(f"pedidosya_token:{self.id}".encode()).hexdigest()[:15], 16)
+        margin = datetime.timedelta(seconds=self.pedidosya_token_refresh_margin or 0)
+        with self.env.registry.cursor() as cr:
+            cr.execute("SELECT pg_advisory_xact_lock(%s)", [lock_id])
+            cr.execute("""
+                SELECT pedidosya_token, pedidosya_token_expiry
+                  FROM delivery_carrier
+                 WHERE id = %s
+            """, [self.id])
+            token, expiry = cr.fetchone()
+            now = fields.Datetime.now()
+            if token and expiry and expiry - margin > now:
+                return token, (expiry - now).total_seconds()
+            
+            token, expires_in = self._request_pedidosya_auth_token()
+            expiry = now + datetime.timedelta(seconds=expires_in)
+            cr.execute("""
+                UPDATE delivery_carrier
+                   SET pedidosya_token = %s, pedidosya_token_expiry = %s
+                 WHERE id = %s
+            """, [token, expiry, self.id])
+        self.invalidate_recordset(['pedidosya_token', 'pedidosya_token_expiry'])
+        return token, expires_in
+    
     # Check coverage (if shipping is possible)
-    def _check_pedidosya_coverage(self, pickup_address, delivery_address):
+    def _check_pedidosya_coverage(self, pickup_address, delivery_address, warehouse=None, lookup=True):
         """
         Check if PedidosYa covers the shipping route between pickup and delivery addresses
         Returns True if service is available, False otherwise
+        When the warehouse is given, known drop-off cells are answered from the coverage index,
+        callers that already looked the cell up pass lookup=False
         """
-        token = self._get_pedidosya_auth_token()
+        if lookup:
+            is_covered = self._lookup_pedidosya_coverage(warehouse, delivery_address)
+            if is_covered is not None:
+                return is_covered
         
-        # API request to check coverage
-        url = f"{self._get_pedidosya_api_url()}/v3/estimates/coverage"
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': token
-        }
+        data = self._prepare_pedidosya_coverage_data(pickup_address, delivery_address)
+        is_covered = self._request_pedidosya_coverage(data)
+        if is_covered is None:
+            return False
         
-        data = {
+        self._record_pedidosya_coverage(warehouse, delivery_address, is_covered)
+        return is_covered
+    
+    def _lookup_pedidosya_coverage(self, warehouse, delivery_address):
+        """Coverage known from the index, None when unknown or the index is disabled"""
+        if not (self.pedidosya_coverage_index and warehouse):
+            return None
+        Coverage = self.env['pedidosya.coverage'].sudo()
+        cell = Coverage._get_cell(self, delivery_address.partner_latitude, delivery_address.partner_longitude)
+        is_covered = Coverage._lookup(self, warehouse, cell)
+        metrics.count_cache('coverage', is_covered is not None)
+        return is_covered
+    
+    def _record_pedidosya_coverage(self, warehouse, delivery_address, is_covered):
+        if not (self.pedidosya_coverage_index and warehouse):
+            return
+        Coverage = self.env['pedidosya.coverage'].sudo()
+        cell = Coverage._get_cell(self, delivery_address.partner_latitude, delivery_address.partner_longitude)
+        Coverage._record(self, warehouse, cell, is_covered, delivery_address)
+    
+    def _prepare_pedidosya_coverage_data(self, pickup_address, delivery_address):
+        return {
             "waypoints": [
                 {
                     "addressStreet": pickup_address.street,
@@ -107,17 +364,26 @@ class DeliveryPedidosYa(models.Model):
                 }
             ]
         }
+    
+    def _request_pedidosya_coverage(self, data, token=None, client=None):
+        """
+        Call the coverage API
+        Returns True or False, or None when the API could not be reached
+        Does not touch the ORM when token and client are given, so it can run in a thread
+        """
+        token = token or self._get_pedidosya_auth_token()
+        client = client or self._get_pedidosya_client()
         
         try:
-            response = requests.post(url, headers=headers, data=json.dumps(data))
+            response = client.post('/v3/estimates/coverage', token=token, data=data, idempotent=True)
             response.raise_for_status()
-            result = response.json()
+            result = decode_response(response)
             
             # Return True if status is 200 (OK)
             return result.get('status') == 200
         except requests.exceptions.RequestException as e:
             _logger.error(f"PedidosYa coverage check error: {e}")
-            return False
+            return None
     
     # Rate shipment method
     def pedidosya_rate_shipment(self, order):
@@ -128,68 +394,59 @@ class DeliveryPedidosYa(models.Model):
             return {'success': False, 'price': 0.0, 'error_message': _('No shipping address provided'), 'warning_message': False}
         
         # Check if warehouse and shipping address have coordinates
-        warehouse_address = order.warehouse_id.partner_id
+        warehouse = order.warehouse_id
+        warehouse_address = warehouse.partner_id
         shipping_address = order.partner_shipping_id
         
         if not (warehouse_address.partner_latitude and warehouse_address.partner_longitude and 
                 shipping_address.partner_latitude and shipping_address.partner_longitude):
             return {'success': False, 'price': 0.0, 'error_message': _('Missing coordinates for warehouse or delivery address'), 'warning_message': False}
         
-        # Check if PedidosYa service is available for these addresses
-        if not self._check_pedidosya_coverage(warehouse_address, shipping_address):
-            return {'success': False, 'price': 0.0, 'error_message': _('PedidosYa delivery service is not available for this route'), 'warning_message': False}
-        
-        # Get authentication token
-        token = self._get_pedidosya_auth_token()
+        # Addresses outside the service area of the warehouse are rejected locally
+        if not self._check_pedidosya_deliverability(warehouse, shipping_address).get(shipping_address.id, True):
+            return {'success': False, 'price': 0.0, 'error_message': _('The delivery address is outside the PedidosYa service area of the warehouse'), 'warning_message': False}
         
         # Prepare request data for shipping estimate
-        order_items = []
-        for line in order.order_line:
-            if line.product_id.type in ['product', 'consu'] and not line.is_delivery:
-                item = {
-                    'type': line.product_id.pedidosya_product_type or 'STANDARD',
-                    'value': line.price_unit * (1 - (line.discount or 0.0) / 100.0),
-                    'description': line.product_id.name,
-                    'sku': line.product_id.default_code or '',
-                    'quantity': int(line.product_uom_qty),
-                    'volume': line.product_id.volume * 1000000,  # Convert m³ to cm³
-                    'weight': line.product_id.weight  # Weight in kg
-                }
-                order_items.append(item)
-                
+        order_items = self._prepare_pedidosya_order_items(order.order_line)
+        
+        # Serve identical route and cart combinations from the quote cache
+        quote_cache = self._get_pedidosya_quote_cache()
+        fingerprint = None
+        if quote_cache is not None and order_items:
+            fingerprint = self._get_pedidosya_quote_fingerprint(warehouse_address, shipping_address, order_items)
+            cached = quote_cache.get(fingerprint)
+            if cached is not None:
+                return dict(cached)
+        
+        not_covered = {'success': False, 'price': 0.0, 'error_message': _('PedidosYa delivery service is not available for this route'), 'warning_message': False}
+        
+        # Areas already checked are answered by the coverage index
+        is_covered = self._lookup_pedidosya_coverage(warehouse, shipping_address)
+        if is_covered is False:
+            return not_covered
+        
+        # Fail fast while the API is unavailable
+        client = self._get_pedidosya_client()
+        if client.breaker.is_open and order_items:
+            return self._get_pedidosya_stale_quote(warehouse, shipping_address, order_items)
+        
+        quote_mode = self.pedidosya_quote_mode or 'sequential'
+        if is_covered is None and quote_mode == 'sequential':
+            # Check if PedidosYa service is available for these addresses
+            if not self._check_pedidosya_coverage(warehouse_address, shipping_address, warehouse=warehouse, lookup=False):
+                return not_covered
+            is_covered = True
+        
         if not order_items:
             return {'success': False, 'price': 0.0, 'error_message': _('No items to ship'), 'warning_message': False}
         
-        # API request for shipping estimate
-        url = f"{self._get_pedidosya_api_url()}/v3/shippings/estimates"
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': token
-        }
+        # Get authentication token
+        token = self._get_pedidosya_auth_token()
         
+        # API request for shipping estimate
         waypoints = [
-            {
-                'type': 'PICK_UP',
-                'addressStreet': warehouse_address.street or '',
-                'addressAdditional': warehouse_address.street2 or '',
-                'city': warehouse_address.city or '',
-                'latitude': warehouse_address.partner_latitude,
-                'longitude': warehouse_address.partner_longitude,
-                'phone': warehouse_address.phone or warehouse_address.mobile or '',
-                'name': warehouse_address.name,
-                'instructions': ''
-            },
-            {
-                'type': 'DROP_OFF',
-                'addressStreet': shipping_address.street or '',
-                'addressAdditional': shipping_address.street2 or '',
-                'city': shipping_address.city or '',
-                'latitude': shipping_address.partner_latitude,
-                'longitude': shipping_address.partner_longitude,
-                'phone': shipping_address.phone or shipping_address.mobile or '',
-                'name': shipping_address.name,
-                'instructions': ''
-            }
+            self._get_pedidosya_pickup_waypoint(warehouse_address),
+            self._prepare_pedidosya_waypoint(self._read_pedidosya_partners(shipping_address)[shipping_address.id], 'DROP_OFF')
         ]
         
         data = {
@@ -199,270 +456,921 @@ class DeliveryPedidosYa(models.Model):
             'waypoints': waypoints
         }
         
+        # Parallel mode: run the coverage check while the estimate is computed
+        executor = coverage_future = None
+        if is_covered is None and quote_mode == 'parallel':
+            coverage_data = self._prepare_pedidosya_coverage_data(warehouse_address, shipping_address)
+            executor = ThreadPoolExecutor(max_workers=1)
+            coverage_future = executor.submit(self._request_pedidosya_coverage, coverage_data, token, client)
+        
         try:
-            response = requests.post(url, headers=headers, data=json.dumps(data))
+            response = client.post('/v3/shippings/estimates', token=token, data=data, idempotent=True)
             response.raise_for_status()
-            result = response.json()
-            
-            if result.get('deliveryOffers'):
-                # Find the delivery offer that matches our service type
-                for offer in result.get('deliveryOffers', []):
-                    if offer.get('deliveryMode') == self.pedidosya_service_type:
-                        pricing = offer.get('pricing', {})
-                        price = pricing.get('total', 0.0)
-                        return {'success': True, 'price': price, 'error_message': False, 'warning_message': False}
-                
-                # If specific service not found, use the first offer
-                pricing = result.get('deliveryOffers', [{}])[0].get('pricing', {})
-                price = pricing.get('total', 0.0)
-                return {'success': True, 'price': price, 'error_message': False, 'warning_message': False}
-            else:
-                return {'success': False, 'price': 0.0, 'error_message': _('No delivery offers available from PedidosYa'), 'warning_message': False}
-                
+            result = decode_response(response)
         except requests.exceptions.RequestException as e:
             _logger.error(f"PedidosYa rate calculation error: {e}")
+            if coverage_future is not None:
+                is_covered = coverage_future.result()
+                executor.shutdown(wait=False)
+                if is_covered is not None:
+                    self._record_pedidosya_coverage(warehouse, shipping_address, is_covered)
+                if is_covered is False:
+                    return not_covered
+            elif is_covered is None and self._is_pedidosya_not_covered_error(e):
+                # Estimate only mode: the estimate rejecting the route means it is not covered
+                self._record_pedidosya_coverage(warehouse, shipping_address, False)
+                return not_covered
+            if isinstance(e, CircuitOpenError) or client.breaker.is_open:
+                return self._get_pedidosya_stale_quote(warehouse, shipping_address, order_items)
             return {'success': False, 'price': 0.0, 'error_message': _('Error getting shipping rate: %s') % str(e), 'warning_message': False}
+        
+        if coverage_future is not None:
+            is_covered = coverage_future.result()
+            executor.shutdown(wait=False)
+            if is_covered is not None:
+                self._record_pedidosya_coverage(warehouse, shipping_address, is_covered)
+            if is_covered is False:
+                return not_covered
+        elif is_covered is None:
+            # Estimate only mode: offers mean the route is covered, none means it is not
+            self._record_pedidosya_coverage(warehouse, shipping_address, bool(result.get('deliveryOffers')))
+        
+        res = self._parse_pedidosya_estimate(result)
+        if fingerprint is not None:
+            quote_cache.set(fingerprint, dict(res))
+        if res['success'] and warehouse and self.pedidosya_stale_quote_age > 0:
+            # Keep the price as a fallback for similar deliveries while the API is unavailable
+            History = self.env['pedidosya.quote.history'].sudo()
+            cell, cart_class = History._get_key(self, shipping_address, order_items)
+            History._record(self, warehouse, cell, cart_class, res['price'])
+        return res
     
-    # Ship method
-    def pedidosya_send_shipping(self, pickings):
-        """Create shipping orders in PedidosYa"""
-        res = []
-        for picking in pickings:
-            # Get auth token
-            token = self._get_pedidosya_auth_token()
-            
-            # Get addresses
-            warehouse_address = picking.picking_type_id.warehouse_id.partner_id
-            customer_address = picking.partner_id
-            
-            # Prepare items data
-            order_items = []
-            for move in picking.move_lines:
-                item = {
-                    'type': move.product_id.pedidosya_product_type or 'STANDARD',
-                    'value': move.product_id.list_price,
-                    'description': move.product_id.name,
-                    'sku': move.product_id.default_code or '',
-                    'quantity': int(move.product_uom_qty),
-                    'volume': move.product_id.volume * 1000000,  # Convert m³ to cm³
-                    'weight': move.product_id.weight  # Weight in kg
-                }
-                order_items.append(item)
+    def pedidosya_rate_shipments_bulk(self, orders):
+        """
+        Quote many orders at once, returns {order id: rate_shipment result}
+        Orders with the same route and cart share a single estimate, the estimates
+        missing from the quote cache are requested concurrently with one token.
+        The coverage index is used as in estimate only mode and the quotes are
+        written back on the orders with one write per distinct result
+        """
+        self.ensure_one()
+        results = {}
+        if not orders:
+            return results
+        
+        # Order lines, products and partners are read in batch
+        lines_by_order = defaultdict(list)
+        for line in orders.order_line.read(PEDIDOSYA_ORDER_LINE_FIELDS + ['order_id'], load=None):
+            lines_by_order[line['order_id']].append(line)
+        products = self._read_pedidosya_products(orders.order_line.product_id)
+        partners = self._read_pedidosya_partners(orders.partner_shipping_id)
+        deliverable = {}
+        for warehouse in orders.warehouse_id:
+            deliverable[warehouse.id] = self._check_pedidosya_deliverability(
+                warehouse, orders.filtered(lambda o: o.warehouse_id == warehouse).partner_shipping_id)
+        
+        quote_cache = self._get_pedidosya_quote_cache()
+        client = self._get_pedidosya_client()
+        requests_by_fingerprint = {}
+        for order in orders:
+            warehouse = order.warehouse_id
+            warehouse_address = warehouse.partner_id
+            shipping_address = order.partner_shipping_id
+            if not shipping_address:
+                results[order.id] = {'success': False, 'price': 0.0, 'error_message': _('No shipping address provided'), 'warning_message': False}
+                continue
+            if not (warehouse_address.partner_latitude and warehouse_address.partner_longitude and
+                    shipping_address.partner_latitude and shipping_address.partner_longitude):
+                results[order.id] = {'success': False, 'price': 0.0, 'error_message': _('Missing coordinates for warehouse or delivery address'), 'warning_message': False}
+                continue
+            if not deliverable[warehouse.id].get(shipping_address.id, True):
+                results[order.id] = {'success': False, 'price': 0.0, 'error_message': _('The delivery address is outside the PedidosYa service area of the warehouse'), 'warning_message': False}
+                continue
+            order_items = self._prepare_pedidosya_line_items(lines_by_order[order.id], products)
+            if not order_items:
+                results[order.id] = {'success': False, 'price': 0.0, 'error_message': _('No items to ship'), 'warning_message': False}
+                continue
             
-            # Prepare waypoints
-            waypoints = [
-                {
-                    'type': 'PICK_UP',
-                    'addressStreet': warehouse_address.street or '',
-                    'addressAdditional': warehouse_address.street2 or '',
-                    'city': warehouse_address.city or '',
-                    'latitude': warehouse_address.partner_latitude,
-                    'longitude': warehouse_address.partner_longitude,
-                    'phone': warehouse_address.phone or warehouse_address.mobile or '',
-                    'name': warehouse_address.name,
-                    'instructions': ''
-                },
+            # Identical routes and carts are quoted once
+            fingerprint = self._get_pedidosya_quote_fingerprint(warehouse_address, shipping_address, order_items)
+            if fingerprint in requests_by_fingerprint:
+                requests_by_fingerprint[fingerprint]['orders'].append(order)
+                continue
+            cached = quote_cache.get(fingerprint) if quote_cache is not None else None
+            if cached is not None:
+                results[order.id] = dict(cached)
+                continue
+            requests_by_fingerprint[fingerprint] = {
+                'orders': [order],
+                'warehouse': warehouse,
+                'address': shipping_address,
+                'items': order_items,
+            }
+        
+        not_covered = {'success': False, 'price': 0.0, 'error_message': _('PedidosYa delivery service is not available for this route'), 'warning_message': False}
+        to_estimate = []
+        for fingerprint, request in requests_by_fingerprint.items():
+            if self._lookup_pedidosya_coverage(request['warehouse'], request['address']) is False:
+                request['result'] = not_covered
+            elif client.breaker.is_open:
+                # Fail fast while the API is unavailable
+                request['result'] = self._get_pedidosya_stale_quote(request['warehouse'], request['address'], request['items'])
+            else:
+                to_estimate.append(fingerprint)
+        
+        if to_estimate:
+            # Get auth token, once for the whole batch
+            token = self._get_pedidosya_auth_token()
+            payloads = [
                 {
-                    'type': 'DROP_OFF',
-                    'addressStreet': customer_address.street or '',
-                    'addressAdditional': customer_address.street2 or '',
-                    'city': customer_address.city or '',
-                    'latitude': customer_address.partner_latitude,
-                    'longitude': customer_address.partner_longitude,
-                    'phone': customer_address.phone or customer_address.mobile or '',
-                    'name': customer_address.name,
-                    'instructions': ''
+                    'referenceId': requests_by_fingerprint[fingerprint]['orders'][0].name,
+                    'isTest': self.pedidosya_environment == 'test',
+                    'items': requests_by_fingerprint[fingerprint]['items'],
+                    'waypoints': [
+                        self._get_pedidosya_pickup_waypoint(requests_by_fingerprint[fingerprint]['warehouse'].partner_id),
+                        self._prepare_pedidosya_waypoint(partners[requests_by_fingerprint[fingerprint]['address'].id], 'DROP_OFF'),
+                    ],
                 }
+                for fingerprint in to_estimate
             ]
             
-            # API request to create shipping order
-            url = f"{self._get_pedidosya_api_url()}/v3/shippings"
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': token
-            }
+            def _estimate(data):
+                response = client.post('/v3/shippings/estimates', token=token, data=data, idempotent=True)
+                response.raise_for_status()
+                return decode_response(response)
             
-            data = {
-                'referenceId': picking.name,
-                'isTest': self.pedidosya_environment == 'test',
-                'items': order_items,
-                'waypoints': waypoints
-            }
+            async_client = self._get_pedidosya_async_client(client)
+            if async_client:
+                estimates = async_client.estimates(payloads, token)
+            else:
+                estimates = map_concurrent(_estimate, payloads, max_workers=self.pedidosya_max_concurrency)
             
-            # Add delivery time for scheduled shipments
-            if self.pedidosya_service_type == 'SCHEDULED' and picking.scheduled_date:
-                # Convert to UTC string format required by PedidosYa
-                scheduled_date = fields.Datetime.to_string(picking.scheduled_date)
-                data['deliveryTime'] = scheduled_date
+            History = self.env['pedidosya.quote.history'].sudo()
+            for fingerprint, (result, error) in zip(to_estimate, estimates):
+                request = requests_by_fingerprint[fingerprint]
+                warehouse, address, items = request['warehouse'], request['address'], request['items']
+                if error is not None:
+                    if not isinstance(error, requests.exceptions.RequestException):
+                        raise error
+                    _logger.error(f"PedidosYa rate calculation error: {error}")
+                    if self._is_pedidosya_not_covered_error(error):
+                        self._record_pedidosya_coverage(warehouse, address, False)
+                        request['result'] = not_covered
+                    elif isinstance(error, CircuitOpenError) or client.breaker.is_open:
+                        request['result'] = self._get_pedidosya_stale_quote(warehouse, address, items)
+                    else:
+                        request['result'] = {'success': False, 'price': 0.0, 'error_message': _('Error getting shipping rate: %s') % str(error), 'warning_message': False}
+                    continue
+                # Offers mean the route is covered, none means it is not
+                self._record_pedidosya_coverage(warehouse, address, bool(result.get('deliveryOffers')))
+                res = request['result'] = self._parse_pedidosya_estimate(result)
+                if quote_cache is not None:
+                    quote_cache.set(fingerprint, dict(res))
+                if res['success'] and self.pedidosya_stale_quote_age > 0:
+                    cell, cart_class = History._get_key(self, address, items)
+                    History._record(self, warehouse, cell, cart_class, res['price'])
+        
+        for request in requests_by_fingerprint.values():
+            for order in request['orders']:
+                results[order.id] = dict(request['result'])
+        
+        orders._pedidosya_write_quotes(self, results)
+        return results
+    
+    def _get_pedidosya_stale_quote(self, warehouse, delivery_address, items):
+        """Last known price of a similar delivery, returned with a warning while the API is unavailable"""
+        unavailable = {'success': False, 'price': 0.0, 'error_message': _('PedidosYa is temporarily unavailable, please try again later'), 'warning_message': False}
+        if self.pedidosya_stale_quote_age <= 0:
+            return unavailable
+        History = self.env['pedidosya.quote.history'].sudo()
+        cell, cart_class = History._get_key(self, delivery_address, items)
+        quote = History._lookup(self, warehouse, cell, cart_class)
+        if not quote:
+            return unavailable
+        _logger.info(f"PedidosYa unavailable, quoting the last known price of cell {cell} for carrier {self.name}")
+        return {
+            'success': True,
+            'price': quote.price,
+            'error_message': False,
+            'warning_message': _('PedidosYa is temporarily unavailable, this price is the last known quote for a similar delivery (%s)') % fields.Datetime.to_string(quote.quote_date),
+        }
+    
+    # Deliverability
+    def _check_pedidosya_deliverability(self, warehouse, partners):
+        """
+        Whether the partners are within the service area of the warehouse, as {partner id: bool}
+        Empty when the warehouse has no service area
+        """
+        area = self.pedidosya_service_area_ids.filtered(lambda a: a.warehouse_id == warehouse)[:1]
+        if not area or not partners:
+            return {}
+        points = partners.read(['partner_latitude', 'partner_longitude'])
+        eligible = area._get_service_area().check([point['partner_latitude'] for point in points],
+                                                  [point['partner_longitude'] for point in points])
+        return {point['id']: ok for point, ok in zip(points, eligible)}
+    
+    def action_pedidosya_tag_eligible_partners(self):
+        """
+        Tag the customers within the service area of any warehouse of the carrier
+        All addresses with coordinates are checked at once per warehouse
+        """
+        self.ensure_one()
+        if not self.pedidosya_service_area_ids:
+            raise UserError(_('Define the service area of at least one warehouse first'))
+        
+        points = self.env['res.partner'].search_read(
+            [('partner_latitude', '!=', 0), ('partner_longitude', '!=', 0)],
+            ['partner_latitude', 'partner_longitude'],
+        )
+        latitudes = [point['partner_latitude'] for point in points]
+        longitudes = [point['partner_longitude'] for point in points]
+        eligible = [False] * len(points)
+        for area in self.pedidosya_service_area_ids:
+            eligible = [ok or in_area for ok, in_area in zip(eligible, area._get_service_area().check(latitudes, longitudes))]
+        
+        partner_ids = [point['id'] for point, ok in zip(points, eligible) if ok]
+        self.pedidosya_eligible_partner_ids = [fields.Command.set(partner_ids)]
+        _logger.info(f"Tagged {len(partner_ids)} of {len(points)} partners as eligible for PedidosYa carrier {self.name}")
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('PedidosYa Eligible Customers'),
+                'message': _('%s of %s addresses with coordinates are within the service areas.') % (len(partner_ids), len(points)),
+                'type': 'success',
+                'sticky': False,
+            },
+        }
+    
+    def _is_pedidosya_not_covered_error(self, error):
+        """
+        Whether an API error is the route being rejected as out of coverage
+        Other client errors (invalid item, phone...) say nothing about the coverage of the area
+        """
+        response = getattr(error, 'response', None)
+        if response is None or response.status_code not in (400, 422):
+            return False
+        try:
+            body = decode_response(response)
+        except requests.exceptions.RequestException:
+            return False
+        return isinstance(body, dict) and body.get('code') in PEDIDOSYA_NOT_COVERED_CODES
+    
+    def _parse_pedidosya_estimate(self, result):
+        """Turn an estimates API response into a rate_shipment result"""
+        if result.get('deliveryOffers'):
+            # Find the delivery offer that matches our service type
+            for offer in result.get('deliveryOffers', []):
+                if offer.get('deliveryMode') == self.pedidosya_service_type:
+                    pricing = offer.get('pricing', {})
+                    price = pricing.get('total', 0.0)
+                    return {'success': True, 'price': price, 'error_message': False, 'warning_message': False}
             
-            try:
-                response = requests.post(url, headers=headers, data=json.dumps(data))
-                response.raise_for_status()
-                result = response.json()
-                
-                if result.get('shippingId'):
-                    tracking_number = result.get('shippingId')
-                    confirmation_code = result.get('confirmationCode')
-                    tracking_url = result.get('shareLocationUrl')
-                    
-                    # Save the PedidosYa shipping ID and confirmation code
-                    picking.write({
-                        'carrier_tracking_ref': tracking_number,
-                        'pedidosya_confirmation_code': confirmation_code,
-                        'pedidosya_tracking_url': tracking_url
-                    })
-                    
-                    # Calculate the shipping cost
-                    shipping_cost = 0.0
-                    route = result.get('route', {})
-                    if route and route.get('pricing'):
-                        shipping_cost = route.get('pricing', {}).get('total', 0.0)
-                    
-                    msg = _(f"Shipment created in PedidosYa<br/>"
-                           f"<b>Shipping ID:</b> {tracking_number}<br/>"
-                           f"<b>Confirmation Code:</b> {confirmation_code}<br/>"
-                           f"<b>Tracking URL:</b> {tracking_url}")
-                    picking.message_post(body=msg)
-                    
-                    res.append({
-                        'exact_price': shipping_cost,
-                        'tracking_number': tracking_number,
-                        'tracking_url': tracking_url
-                    })
-                else:
-                    error_msg = result.get('message', 'Unknown error')
-                    raise UserError(_('Error creating PedidosYa shipment: %s') % error_msg)
-                    
-            except requests.exceptions.RequestException as e:
-                _logger.error(f"PedidosYa shipment creation error: {e}")
-                raise UserError(_('Error creating PedidosYa shipment: %s') % str(e))
-                
+            # If specific service not found, use the first offer
+            pricing = result.get('deliveryOffers', [{}])[0].get('pricing', {})
+            price = pricing.get('total', 0.0)
+            return {'success': True, 'price': price, 'error_message': False, 'warning_message': False}
+        return {'success': False, 'price': 0.0, 'error_message': _('No delivery offers available from PedidosYa'), 'warning_message': False}
+    
+    # Rate quote cache
+    def _get_pedidosya_quote_cache(self):
+        """Quote cache of the carrier, None when caching is disabled"""
+        if self.pedidosya_quote_cache_ttl <= 0 or self.pedidosya_quote_cache_size <= 0:
+            return None
+        return get_quote_cache((self.env.cr.dbname, self.id), self.pedidosya_quote_cache_size, self.pedidosya_quote_cache_ttl)
+    
+    def _get_pedidosya_quote_fingerprint(self, pickup_address, delivery_address, items):
+        """Hash of everything that determines a quote: route, cart contents and service"""
+        key = [
+            self.pedidosya_environment,
+            self.pedidosya_service_type,
+            round(pickup_address.partner_latitude, 6),
+            round(pickup_address.partner_longitude, 6),
+            round(delivery_address.partner_latitude, 6),
+            round(delivery_address.partner_longitude, 6),
+            sorted(
+                (item['type'], item['quantity'], round(item['volume'], 3), round(item['weight'], 3), round(item['value'], 2))
+                for item in items
+            ),
+        ]
+        return hashlib.sha1(dumps(key)).hexdigest()
+    
+    def _get_pedidosya_quote_cache_stats(self):
+        """Size and hit/miss counters of the quote cache in this worker"""
+        self.ensure_one()
+        cache = self._get_pedidosya_quote_cache()
+        return cache.stats() if cache is not None else {}
+    
+    @api.model
+    @tools.ormcache('key')
+    def _get_pedidosya_carrier_id_by_webhook_key(self, key):
+        """Carrier id for a webhook authorization key, cached until carriers change"""
+        carrier = self.sudo().search([
+            ('delivery_type', '=', 'pedidosya'),
+            ('pedidosya_webhook_key', '=', key)
+        ], limit=1)
+        return carrier.id
+    
+    @api.model_create_multi
+    def create(self, vals_list):
+        carriers = super().create(vals_list)
+        if any(vals.get('pedidosya_webhook_key') for vals in vals_list):
+            self.env.registry.clear_cache()
+        return carriers
+    
+    def write(self, vals):
+        res = super().write(vals)
+        # Cached tokens and quotes depend on the PedidosYa configuration
+        if any(field.startswith('pedidosya_') and field != 'pedidosya_eligible_partner_ids' for field in vals):
+            dbname = self.env.cr.dbname
+            for carrier in self:
+                clear_quote_cache((dbname, carrier.id))
+                token_cache.evict(lambda key, carrier_id=carrier.id: key[:2] == (dbname, carrier_id))
+        # Webhook key map
+        if {'pedidosya_webhook_key', 'delivery_type', 'active'} & set(vals):
+            self.env.registry.clear_cache()
         return res
     
-    # Cancel shipment method
-    def pedidosya_cancel_shipment(self, pickings):
-        """Cancel shipping orders in PedidosYa"""
-        for picking in pickings:
-            if not picking.carrier_tracking_ref:
+    def unlink(self):
+        if any(self.mapped('pedidosya_webhook_key')):
+            self.env.registry.clear_cache()
+        return super().unlink()
+    
+    # Payload builders, reading product and partner fields in batch
+    def _read_pedidosya_products(self, products):
+        """
+        Fields used in shipment items for all products at once, as {product id: values}
+        The precomputed item fields of each product are parsed once, under 'pedidosya_item'
+        """
+        values_by_id = {values['id']: values for values in products.read(PEDIDOSYA_PRODUCT_FIELDS)}
+        for values in values_by_id.values():
+            values['pedidosya_item'] = loads(values['pedidosya_item_json'])
+        return values_by_id
+    
+    def _read_pedidosya_partners(self, partners):
+        """Fields used in waypoints for all partners at once, as {partner id: values}"""
+        return {values['id']: values for values in partners.read(PEDIDOSYA_PARTNER_FIELDS)}
+    
+    def _prepare_pedidosya_item(self, product, value, quantity):
+        return dict(product['pedidosya_item'], value=value, quantity=int(quantity))
+    
+    def _prepare_pedidosya_order_items(self, order_lines):
+        """Shipment items of sale order lines, delivery lines and services excluded"""
+        products = self._read_pedidosya_products(order_lines.product_id)
+        return self._prepare_pedidosya_line_items(order_lines.read(PEDIDOSYA_ORDER_LINE_FIELDS, load=None), products)
+    
+    def _prepare_pedidosya_line_items(self, lines, products):
+        """Shipment items of sale order line values read in batch"""
+        order_items = []
+        for line in lines:
+            product = products.get(line['product_id'])
+            if product and product['type'] in ['product', 'consu'] and not line['is_delivery']:
+                value = line['price_unit'] * (1 - (line['discount'] or 0.0) / 100.0)
+                order_items.append(self._prepare_pedidosya_item(product, value, line['product_uom_qty']))
+        return order_items
+    
+    def _prepare_pedidosya_move_items(self, moves, products):
+        """Shipment items of stock moves, valued at the product sales price"""
+        order_items = []
+        for move in moves.read(['product_id', 'product_uom_qty'], load=None):
+            product = products[move['product_id']]
+            order_items.append(self._prepare_pedidosya_item(product, product['list_price'], move['product_uom_qty']))
+        return order_items
+    
+    def _prepare_pedidosya_waypoint(self, partner, waypoint_type):
+        return {
+            'type': waypoint_type,
+            'addressStreet': partner['street'] or '',
+            'addressAdditional': partner['street2'] or '',
+            'city': partner['city'] or '',
+            'latitude': partner['partner_latitude'],
+            'longitude': partner['partner_longitude'],
+            'phone': partner['phone'] or partner['mobile'] or '',
+            'name': partner['name'],
+            'instructions': ''
+        }
+    
+    def _get_pedidosya_pickup_waypoint(self, warehouse_address):
+        """Pickup waypoint of a warehouse address, cached until the address is modified"""
+        if not warehouse_address:
+            return self._prepare_pedidosya_waypoint(PEDIDOSYA_EMPTY_PARTNER, 'PICK_UP')
+        return dict(self._get_pedidosya_pickup_waypoint_cached(warehouse_address.id, str(warehouse_address.write_date)))
+    
+    @api.model
+    @tools.ormcache('partner_id', 'write_date')
+    def _get_pedidosya_pickup_waypoint_cached(self, partner_id, write_date):
+        partner = self._read_pedidosya_partners(self.env['res.partner'].browse(partner_id))[partner_id]
+        return self._prepare_pedidosya_waypoint(partner, 'PICK_UP')
+    
+    # Ship method
+    def pedidosya_send_shipping(self, pickings):
+        """
+        Create shipping orders in PedidosYa
+        All shipments of the batch are created concurrently with a single token,
+        results are then written back to the pickings on the main cursor.
+        With multi-stop shipments, nearby pickings share a shipment with one
+        drop-off each. Errors are reported per picking, a single picking still raises
+        """
+        if not pickings:
+            return []
+        
+        # Pickings of a multi-stop shipment created before their validation, unless it was canceled
+        res_by_picking = {
+            picking.id: {
+                'exact_price': picking.pedidosya_shipping_cost,
+                'tracking_number': picking.carrier_tracking_ref,
+                'tracking_url': picking.pedidosya_tracking_url
+            }
+            for picking in pickings.filtered(lambda p: p.carrier_tracking_ref and p.pedidosya_stop
+                                             and p.carrier_tracking_status != 'canceled')
+        }
+        to_send = pickings.filtered(lambda p: p.id not in res_by_picking)
+        if not to_send:
+            return [res_by_picking[picking.id] for picking in pickings]
+        
+        # Get auth token, once for the whole batch
+        token = self._get_pedidosya_auth_token()
+        client = self._get_pedidosya_client()
+        
+        # Payloads are built here since the ORM can't be used from the pool threads
+        products = self._read_pedidosya_products(to_send.move_ids.product_id)
+        partners = self._read_pedidosya_partners(to_send.partner_id)
+        if self.pedidosya_consolidate:
+            groups = self._group_pedidosya_pickings(to_send, products, partners)
+        else:
+            groups = list(to_send)
+        payloads = [self._prepare_pedidosya_shipping_data(group, products, partners) for group in groups]
+        
+        def _create_shipping(data):
+            response = client.post('/v3/shippings', token=token, data=data)
+            response.raise_for_status()
+            return decode_response(response)
+        
+        async_client = self._get_pedidosya_async_client(client)
+        if async_client:
+            results = async_client.create_shippings(payloads, token)
+        else:
+            results = map_concurrent(_create_shipping, payloads, max_workers=self.pedidosya_max_concurrency)
+        
+        for group, (result, error) in zip(groups, results):
+            if error is not None:
+                if not isinstance(error, requests.exceptions.RequestException):
+                    raise error
+                _logger.error(f"PedidosYa shipment creation error: {error}")
+                error_msg = str(error)
+            elif not result.get('shippingId'):
+                error_msg = result.get('message', 'Unknown error')
+            else:
+                res_by_picking.update(self._apply_pedidosya_shipping_result(group, result))
                 continue
-                
-            # Get auth token
-            token = self._get_pedidosya_auth_token()
             
-            # API request to cancel shipment
-            url = f"{self._get_pedidosya_api_url()}/v3/shippings/{picking.carrier_tracking_ref}/cancel"
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': token
-            }
+            if len(pickings) == 1:
+                raise UserError(_('Error creating PedidosYa shipment: %s') % error_msg)
+            for picking in group:
+                picking.message_post(body=_('Error creating PedidosYa shipment: %s') % error_msg)
+                res_by_picking[picking.id] = {
+                    'exact_price': 0.0,
+                    'tracking_number': False,
+                    'tracking_url': False,
+                    'error_message': error_msg
+                }
+        
+        return [res_by_picking[picking.id] for picking in pickings]
+    
+    def _group_pedidosya_pickings(self, pickings, products, partners):
+        """
+        Consolidate pickings into multi-stop shipments, returns a list of picking recordsets
+        Pickings are taken in scheduled order and join the first shipment of their
+        warehouse that started less than the time window before them, whose
+        drop-offs are all within the radius and that still fits the max stops,
+        weight and volume. Pickings without coordinates are shipped alone
+        """
+        window = datetime.timedelta(minutes=self.pedidosya_consolidation_window)
+        max_stops = max(self.pedidosya_consolidation_max_stops, 1)
+        max_weight = self.pedidosya_consolidation_max_weight
+        max_volume = self.pedidosya_consolidation_max_volume
+        
+        # Load of every picking, read in batch
+        weights = defaultdict(float)
+        volumes = defaultdict(float)
+        for move in pickings.move_ids.read(['picking_id', 'product_id', 'product_uom_qty'], load=None):
+            product = products[move['product_id']]
+            weights[move['picking_id']] += product['pedidosya_weight'] * move['product_uom_qty']
+            volumes[move['picking_id']] += product['pedidosya_volume'] * move['product_uom_qty']
+        
+        groups = []
+        open_groups = defaultdict(list)
+        for picking in pickings.sorted(lambda p: (p.scheduled_date, p.id)):
+            partner = partners.get(picking.partner_id.id, PEDIDOSYA_EMPTY_PARTNER)
+            point = (partner['partner_latitude'], partner['partner_longitude'])
+            if not all(point):
+                groups.append(picking)
+                continue
             
-            data = {
-                'reasonText': _('Canceled from Odoo')
+            candidates = open_groups[picking.picking_type_id.warehouse_id.id]
+            # Shipments started too long ago can't take more pickings
+            candidates[:] = [group for group in candidates if picking.scheduled_date - group['start'] <= window]
+            for group in candidates:
+                if (len(group['points']) < max_stops
+                        and (not max_weight or group['weight'] + weights[picking.id] <= max_weight)
+                        and (not max_volume or group['volume'] + volumes[picking.id] <= max_volume)
+                        and all(haversine(*point, *other) <= self.pedidosya_consolidation_radius
+                                for other in group['points'])):
+                    break
+            else:
+                group = {'start': picking.scheduled_date, 'points': [], 'weight': 0.0, 'volume': 0.0,
+                         'index': len(groups)}
+                candidates.append(group)
+                groups.append(self.env['stock.picking'])
+            group['points'].append(point)
+            group['weight'] += weights[picking.id]
+            group['volume'] += volumes[picking.id]
+            groups[group['index']] |= picking
+        
+        return groups
+    
+    def _prepare_pedidosya_shipping_data(self, pickings, products=None, partners=None):
+        """
+        Build the /v3/shippings request body for a picking, or for several pickings
+        of the same warehouse sharing a multi-stop shipment with one drop-off each
+        products and partners are the values read in batch for all pickings sent together
+        """
+        if products is None:
+            products = self._read_pedidosya_products(pickings.move_ids.product_id)
+        if partners is None:
+            partners = self._read_pedidosya_partners(pickings.partner_id)
+        
+        # Prepare items data
+        order_items = []
+        for picking in pickings:
+            order_items += self._prepare_pedidosya_move_items(picking.move_ids, products)
+        
+        # Prepare waypoints
+        waypoints = [self._get_pedidosya_pickup_waypoint(pickings[:1].picking_type_id.warehouse_id.partner_id)]
+        waypoints += [
+            self._prepare_pedidosya_waypoint(partners.get(picking.partner_id.id, PEDIDOSYA_EMPTY_PARTNER), 'DROP_OFF')
+            for picking in pickings
+        ]
+        
+        data = {
+            'referenceId': ','.join(pickings.mapped('name')),
+            'isTest': self.pedidosya_environment == 'test',
+            'items': order_items,
+            'waypoints': waypoints
+        }
+        
+        # Add delivery time for scheduled shipments
+        scheduled_dates = [date for date in pickings.mapped('scheduled_date') if date]
+        if self.pedidosya_service_type == 'SCHEDULED' and scheduled_dates:
+            # Convert to UTC string format required by PedidosYa
+            scheduled_date = fields.Datetime.to_string(min(scheduled_dates))
+            data['deliveryTime'] = scheduled_date
+        
+        return data
+    
+    def _apply_pedidosya_shipping_result(self, pickings, result):
+        """
+        Save a created shipment on its pickings, returns the send_shipping result of each picking
+        The price of a multi-stop shipment is shared equally between its pickings
+        """
+        tracking_number = result.get('shippingId')
+        confirmation_code = result.get('confirmationCode')
+        tracking_url = result.get('shareLocationUrl')
+        
+        # Calculate the shipping cost
+        shipping_cost = 0.0
+        route = result.get('route', {})
+        if route and route.get('pricing'):
+            shipping_cost = route.get('pricing', {}).get('total', 0.0)
+        shipping_cost /= len(pickings)
+        
+        # Save the PedidosYa shipping ID and confirmation code
+        vals = {
+            'carrier_tracking_ref': tracking_number,
+            'pedidosya_confirmation_code': confirmation_code,
+            'pedidosya_tracking_url': tracking_url,
+            'pedidosya_shipping_cost': shipping_cost
+        }
+        if len(pickings) == 1:
+            # Only drop-offs of multi-stop shipments are numbered
+            vals['pedidosya_stop'] = 0
+        pickings.write(vals)
+        
+        if len(pickings) > 1:
+            # Number the drop-offs in a single statement rather than one write per picking
+            pickings.flush_recordset(['pedidosya_stop'])
+            self.env.cr.execute("""
+                UPDATE stock_picking SET pedidosya_stop = stop.number
+                FROM unnest(%s, %s) AS stop(id, number)
+                WHERE stock_picking.id = stop.id
+            """, [pickings.ids, list(range(1, len(pickings) + 1))])
+            pickings.invalidate_recordset(['pedidosya_stop'])
+        
+        res = {}
+        for stop, picking in enumerate(pickings, 1):
+            msg = _(f"Shipment created in PedidosYa<br/>"
+                   f"<b>Shipping ID:</b> {tracking_number}<br/>"
+                   f"<b>Confirmation Code:</b> {confirmation_code}<br/>"
+                   f"<b>Tracking URL:</b> {tracking_url}")
+            if len(pickings) > 1:
+                msg += _(f"<br/><b>Stop:</b> {stop} of {len(pickings)}")
+            picking.message_post(body=msg)
+            res[picking.id] = {
+                'exact_price': shipping_cost,
+                'tracking_number': tracking_number,
+                'tracking_url': tracking_url
             }
+        return res
+    
+    # Cancel shipment method
+    def pedidosya_cancel_shipment(self, pickings, reason=None):
+        """
+        Cancel shipping orders in PedidosYa
+        All shipments of the batch are canceled concurrently with a single token,
+        the successful cancellations are then written back together. Errors are
+        reported per picking, a single shipment still raises. Canceling a multi-stop
+        shipment cancels it for all its stops, their pickings are added to the batch
+        Returns one result per picking: picking_id, tracking_number, success and error_message
+        """
+        pickings = pickings.filtered('carrier_tracking_ref')
+        if not pickings:
+            return []
+        pickings |= self.env['stock.picking'].search([
+            ('carrier_id', '=', self.id),
+            ('carrier_tracking_ref', 'in', pickings.mapped('carrier_tracking_ref')),
+        ])
+        
+        # Get auth token, once for the whole batch
+        token = self._get_pedidosya_auth_token()
+        client = self._get_pedidosya_client()
+        reason = reason or _('Canceled from Odoo')
+        # A multi-stop shipment is canceled once for all its pickings
+        cancellations = [(shipping_id, reason) for shipping_id in dict.fromkeys(pickings.mapped('carrier_tracking_ref'))]
+        
+        def _cancel_shipping(cancellation):
+            shipping_id, reason_text = cancellation
+            response = client.post(f"/v3/shippings/{shipping_id}/cancel", token=token,
+                                   data={'reasonText': reason_text}, idempotent=True)
+            response.raise_for_status()
+            return decode_response(response)
+        
+        async_client = self._get_pedidosya_async_client(client)
+        if async_client:
+            results = async_client.cancel_shippings(cancellations, token)
+        else:
+            results = map_concurrent(_cancel_shipping, cancellations, max_workers=self.pedidosya_max_concurrency)
+        
+        results = dict(zip((shipping_id for shipping_id, _reason in cancellations), results))
+        res = []
+        canceled = self.env['stock.picking']
+        for picking in pickings:
+            result, error = results[picking.carrier_tracking_ref]
+            if error is not None:
+                if not isinstance(error, requests.exceptions.RequestException):
+                    raise error
+                _logger.error(f"PedidosYa shipment cancellation error: {error}")
+                error_msg = str(error)
+            elif result.get('status') != 'CANCELLED':
+                error_msg = result.get('message', 'Unknown error')
+            else:
+                canceled |= picking
+                res.append({
+                    'picking_id': picking.id,
+                    'tracking_number': picking.carrier_tracking_ref,
+                    'success': True,
+                    'error_message': False,
+                })
+                continue
             
-            try:
-                response = requests.post(url, headers=headers, data=json.dumps(data))
-                response.raise_for_status()
-                result = response.json()
-                
-                if result.get('status') == 'CANCELLED':
-                    picking.message_post(body=_('Shipment canceled with PedidosYa'))
-                else:
-                    error_msg = result.get('message', 'Unknown error')
-                    raise UserError(_('Error canceling PedidosYa shipment: %s') % error_msg)
-                    
-            except requests.exceptions.RequestException as e:
-                _logger.error(f"PedidosYa shipment cancellation error: {e}")
-                raise UserError(_('Error canceling PedidosYa shipment: %s') % str(e))
-                
-        return True
+            if len(cancellations) == 1:
+                raise UserError(_('Error canceling PedidosYa shipment: %s') % error_msg)
+            picking.message_post(body=_('Error canceling PedidosYa shipment: %s') % error_msg)
+            res.append({
+                'picking_id': picking.id,
+                'tracking_number': picking.carrier_tracking_ref,
+                'success': False,
+                'error_message': error_msg,
+            })
+        
+        # Successful cancellations are written together, their cached labels are dropped on the way
+        canceled._pedidosya_write_statuses({picking.id: 'CANCELLED' for picking in canceled})
+        for picking in canceled:
+            picking.message_post(body=_('Shipment canceled with PedidosYa'))
+        
+        return res
     
     # Get shipping labels
     def pedidosya_get_shipping_labels(self, pickings):
-        """Get shipping labels from PedidosYa"""
+        """
+        Get shipping labels from PedidosYa
+        Each shipment label is cached as an attachment on its pickings, only the
+        missing ones are requested, in chunks downloaded concurrently. The labels
+        are merged in picking order as they arrive and stored as a single attachment
+        """
         if not pickings:
             return False
-            
-        shipment_ids = []
-        for picking in pickings:
-            if picking.carrier_tracking_ref:
-                shipment_ids.append(picking.carrier_tracking_ref)
-                
-        if not shipment_ids:
+        
+        pickings = pickings.filtered('carrier_tracking_ref')
+        if not pickings:
             raise UserError(_('No valid shipment IDs found for selected pickings'))
-            
-        # Get auth token
-        token = self._get_pedidosya_auth_token()
         
-        # API request to get shipping labels
-        url = f"{self._get_pedidosya_api_url()}/v3/shippings/labels"
-        headers = {
-            'Authorization': token
-        }
+        # Pickings of a multi-stop shipment share its label, it is added once
+        shipment_ids = list(dict.fromkeys(pickings.mapped('carrier_tracking_ref')))
+        
+        # Labels already fetched are served from the filestore
+        labels = pickings._get_pedidosya_label_attachments()
+        fetched = self._fetch_pedidosya_labels(pickings, [shipping_id for shipping_id in shipment_ids
+                                                           if shipping_id not in labels])
+        
+        writer = PdfFileWriter()
+        for shipping_id in shipment_ids:
+            if shipping_id in labels:
+                reader = PdfFileReader(io.BytesIO(labels[shipping_id].raw), strict=False)
+                pages = [reader.getPage(page) for page in range(reader.getNumPages())]
+            else:
+                pages = next(fetched)
+            for page in pages:
+                writer.addPage(page)
+        with io.BytesIO() as buffer:
+            writer.write(buffer)
+            pdf = buffer.getvalue()
         
-        params = {
-            'values': ','.join(shipment_ids)
+        file_name = f"PedidosYa_Labels_{fields.Date.today()}.pdf"
+        attachment = self.env['ir.attachment'].sudo().create({
+            'name': file_name,
+            'raw': pdf,
+            'mimetype': 'application/pdf',
+            'res_model': self._name,
+            'res_id': self.id,
+            'description': PEDIDOSYA_LABELS_BATCH_TAG,
+        })
+        
+        # Return PDF content
+        return {
+            'pdf': pdf,
+            'file_name': file_name,
+            'attachment_id': attachment.id
         }
+    
+    @api.autovacuum
+    def _gc_pedidosya_label_prints(self):
+        """Remove merged label prints older than a day, shipment labels stay cached on their pickings"""
+        self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('description', '=', PEDIDOSYA_LABELS_BATCH_TAG),
+            ('create_date', '<', fields.Datetime.now() - datetime.timedelta(days=1)),
+        ]).unlink()
+    
+    def _fetch_pedidosya_labels(self, pickings, shipment_ids):
+        """
+        Download the labels of the given shipments, in chunks of shipping ids
+        Yields the pages of each shipment label in the order of shipment_ids as
+        they arrive, each label is cached on every picking of its shipment. A chunk
+        PDF is split per shipment when it has one page per shipment, otherwise the
+        labels of that chunk are requested one by one
+        """
+        if not shipment_ids:
+            return
         
-        try:
-            response = requests.get(url, headers=headers, params=params)
-            response.raise_for_status()
-            
-            # Return PDF content
-            return {
-                'pdf': response.content,
-                'file_name': f"PedidosYa_Labels_{fields.Date.today()}.pdf"
+        # Get auth token
+        token = self._get_pedidosya_auth_token()
+        client = self._get_pedidosya_client()
+        async_client = self._get_pedidosya_async_client(client)
+        
+        def _get_labels(chunk):
+            # API request to get shipping labels
+            params = {
+                'values': ','.join(chunk)
             }
-                
-        except requests.exceptions.RequestException as e:
-            _logger.error(f"PedidosYa label retrieval error: {e}")
-            raise UserError(_('Error getting PedidosYa shipping labels: %s') % str(e))
+            response = client.get('/v3/shippings/labels', token=token, params=params)
+            response.raise_for_status()
+            return response.content
+        
+        def _download(chunks):
+            if async_client:
+                results = async_client.get_labels(chunks, token)
+            else:
+                results = imap_concurrent(_get_labels, chunks, max_workers=self.pedidosya_max_concurrency)
+            for content, error in results:
+                if error is not None:
+                    if not isinstance(error, requests.exceptions.RequestException):
+                        raise error
+                    _logger.error(f"PedidosYa label retrieval error: {error}")
+                    raise UserError(_('Error getting PedidosYa shipping labels: %s') % str(error))
+                yield PdfFileReader(io.BytesIO(content), strict=False)
+        
+        picking_ids = defaultdict(list)
+        for picking in pickings:
+            picking_ids[picking.carrier_tracking_ref].append(picking.id)
+        Attachment = self.env['ir.attachment'].sudo()
+        
+        def _cache(shipping_id, pages):
+            writer = PdfFileWriter()
+            for page in pages:
+                writer.addPage(page)
+            with io.BytesIO() as buffer:
+                writer.write(buffer)
+                content = buffer.getvalue()
+            Attachment.create([
+                {
+                    'name': PEDIDOSYA_LABEL_NAME % shipping_id,
+                    'raw': content,
+                    'mimetype': 'application/pdf',
+                    'res_model': 'stock.picking',
+                    'res_id': picking_id,
+                    'description': PEDIDOSYA_LABEL_TAG,
+                }
+                for picking_id in picking_ids[shipping_id]
+            ])
+            return pages
+        
+        chunks = list(split_every(max(self.pedidosya_label_chunk_size, 1), shipment_ids))
+        for chunk, reader in zip(chunks, _download(chunks)):
+            if reader.getNumPages() == len(chunk):
+                for index, shipping_id in enumerate(chunk):
+                    yield _cache(shipping_id, [reader.getPage(index)])
+                continue
+            # The pages can't be told apart, each label of the chunk is requested on its own
+            _logger.info(f"PedidosYa labels of {len(chunk)} shipments returned {reader.getNumPages()} pages, "
+                         f"requesting them one by one")
+            for shipping_id, label in zip(chunk, _download([[shipping_id] for shipping_id in chunk])):
+                yield _cache(shipping_id, [label.getPage(page) for page in range(label.getNumPages())])
     
     # Tracking method
     def pedidosya_tracking_state_update(self, pickings):
-        """Update tracking status from PedidosYa"""
-        for picking in pickings:
-            if not picking.carrier_tracking_ref:
-                continue
-                
-            # Get auth token
-            token = self._get_pedidosya_auth_token()
-            
-            # API request to get shipping details
-            url = f"{self._get_pedidosya_api_url()}/v3/shippings/{picking.carrier_tracking_ref}"
-            headers = {
-                'Authorization': token
-            }
-            
-            try:
-                response = requests.get(url, headers=headers)
-                response.raise_for_status()
-                result = response.json()
-                
-                if result:
-                    status = result.get('status')
-                    
-                    # Update delivery status based on PedidosYa status
-                    if status == 'COMPLETED':
-                        picking.write({'carrier_tracking_status': 'delivered'})
-                    elif status in ['IN_PROGRESS', 'NEAR_PICKUP', 'PICKED_UP', 'NEAR_DROPOFF']:
-                        picking.write({'carrier_tracking_status': 'in_transit'})
-                    elif status == 'CANCELLED':
-                        picking.write({'carrier_tracking_status': 'canceled'})
-                    elif status == 'CONFIRMED':
-                        picking.write({'carrier_tracking_status': 'waiting'})
-                        
-                    # Add message with tracking update
-                    msg = _(f"Tracking Update from PedidosYa<br/>"
-                          f"<b>Status:</b> {status}")
-                    picking.message_post(body=msg)
-                        
-            except requests.exceptions.RequestException as e:
-                _logger.error(f"PedidosYa tracking update error: {e}")
+        """
+        Update tracking status from PedidosYa
+        Statuses are fetched concurrently within the carrier rate limit, only
+        pickings whose status changed are written and get a chatter message
+        """
+        pickings = pickings.filtered('carrier_tracking_ref')
+        if not pickings:
+            return True
+        
+        # Get auth token, once for the whole batch
+        token = self._get_pedidosya_auth_token()
+        client = self._get_pedidosya_client()
+        
+        def _get_shipping(shipping_id):
+            response = client.get(f"/v3/shippings/{shipping_id}", token=token)
+            response.raise_for_status()
+            return decode_response(response)
+        
+        # Pickings of a multi-stop shipment share its status
+        shipping_ids = list(dict.fromkeys(pickings.mapped('carrier_tracking_ref')))
+        async_client = self._get_pedidosya_async_client(client)
+        if async_client:
+            results = async_client.get_shippings(shipping_ids, token)
+        else:
+            results = map_concurrent(_get_shipping, shipping_ids, max_workers=self.pedidosya_max_concurrency)
+        
+        shipping_statuses = {}
+        for shipping_id, (result, error) in zip(shipping_ids, results):
+            if error is not None:
+                if not isinstance(error, requests.exceptions.RequestException):
+                    raise error
+                _logger.error(f"PedidosYa tracking update error: {error}")
                 # Don't raise an error, just log it
-                
+                continue
+            if result and result.get('status'):
+                shipping_statuses[shipping_id] = result['status']
+        statuses = {picking.id: shipping_statuses[picking.carrier_tracking_ref] for picking in pickings
+                    if picking.carrier_tracking_ref in shipping_statuses}
+        
+        changed = pickings._pedidosya_write_statuses(statuses)
+        for picking in changed:
+            # Add message with tracking update
+            msg = _(f"Tracking Update from PedidosYa<br/>"
+                    f"<b>Status:</b> {statuses[picking.id]}")
+            picking.message_post(body=msg)
+        
         return True
     
+    def _get_pedidosya_tracking_domain(self):
+        """Pickings of the carrier whose shipment is still in progress"""
+        return [
+            ('carrier_id', '=', self.id),
+            ('carrier_tracking_ref', '!=', False),
+            ('carrier_tracking_status', 'not in', PEDIDOSYA_TERMINAL_TRACKING_STATUSES),
+            ('state', '!=', 'cancel'),
+        ]
+    
+    @api.model
+    def _cron_pedidosya_tracking_refresh(self, chunk_size=200):
+        """
+        Poll PedidosYa for the status of shipments still in progress
+        Fallback for missed webhooks, commits after each chunk of pickings
+        """
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        Picking = self.env['stock.picking']
+        for carrier in self.search([('delivery_type', '=', 'pedidosya')]):
+            picking_ids = Picking.search(carrier._get_pedidosya_tracking_domain(), order='id').ids
+            for chunk_ids in split_every(chunk_size, picking_ids):
+                carrier.pedidosya_tracking_state_update(Picking.browse(chunk_ids))
+                if auto_commit:
+                    self.env.cr.commit()
+            _logger.info(f"Refreshed tracking of {len(picking_ids)} PedidosYa shipments for carrier {carrier.name}")
+    
     # Configure webhook for tracking updates
     def pedidosya_configure_webhook(self):
         """Configure PedidosYa webhook for shipping status updates"""
@@ -475,12 +1383,6 @@ class DeliveryPedidosYa(models.Model):
         token = self._get_pedidosya_auth_token()
         
         # API request to configure webhook
-        url = f"{self._get_pedidosya_api_url()}/v3/webhooks-configuration"
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': token
-        }
-        
         data = {
             'webhooksConfiguration': [
                 {
@@ -498,7 +1400,7 @@ class DeliveryPedidosYa(models.Model):
         }
         
         try:
-            response = requests.put(url, headers=headers, data=json.dumps(data))
+            response = self._get_pedidosya_client().put('/v3/webhooks-configuration', token=token, data=data)
             response.raise_for_status()
             
             return True
@@ -511,5 +1413,280 @@ class DeliveryPedidosYa(models.Model):
 class StockPicking(models.Model):
     _inherit = 'stock.picking'
     
+    # Webhooks and tracking look pickings up by shipping ID
+    carrier_tracking_ref = fields.Char(index='btree_not_null')
     pedidosya_confirmation_code = fields.Char(string='PedidosYa Confirmation Code', readonly=True, copy=False)
-    pedidosya_tracking_url = fields.Char(string='PedidosYa Tracking URL', readonly=True, copy=False)
\ No newline at end of file
+    pedidosya_tracking_url = fields.Char(string='PedidosYa Tracking URL', readonly=True, copy=False)
+    pedidosya_stop = fields.Integer(string='PedidosYa Stop', readonly=True, copy=False,
+                                    help='Position of the picking drop-off in its PedidosYa shipment')
+    pedidosya_shipping_cost = fields.Float(string='PedidosYa Shipping Cost', readonly=True, copy=False,
+                                           help='Share of the PedidosYa shipment price charged to the picking')
+    carrier_tracking_status = fields.Selection([
+        ('waiting', 'Waiting'),
+        ('in_transit', 'In Transit'),
+        ('delivered', 'Delivered'),
+        ('canceled', 'Canceled')
+    ], string='Tracking Status', readonly=True, copy=False, index=True)
+    pedidosya_status = fields.Char(string='PedidosYa Status', readonly=True, copy=False,
+                                   help='Last shipping status received from PedidosYa')
+    pedidosya_status_sequence = fields.Integer(string='PedidosYa Status Sequence', readonly=True, copy=False,
+                                               help='Position of the last applied status in the shipment lifecycle')
+    pedidosya_status_date = fields.Datetime(string='PedidosYa Status Date', readonly=True, copy=False,
+                                            help='Time of the event that set the last applied status')
+    
+    pedidosya_to_validate = fields.Boolean(string='PedidosYa Validation Pending', readonly=True, copy=False,
+                                           help='Delivered by PedidosYa, waiting for the validation job')
+    pedidosya_validate_attempts = fields.Integer(string='PedidosYa Validation Attempts', readonly=True, copy=False)
+    pedidosya_validate_after = fields.Datetime(string='PedidosYa Validation Retry', readonly=True, copy=False)
+    
+    def init(self):
+        # Tracking refresh only looks at pickings with a shipment still in progress
+        create_index(
+            self.env.cr, 'stock_picking_pedidosya_tracking_idx', self._table,
+            ['carrier_id', 'carrier_tracking_status'], where='carrier_tracking_ref IS NOT NULL',
+        )
+        # Deferred validation queue
+        create_index(
+            self.env.cr, 'stock_picking_pedidosya_to_validate_idx', self._table,
+            ['pedidosya_validate_after'], where='pedidosya_to_validate',
+        )
+    
+    def write(self, vals):
+        if vals.get('carrier_tracking_ref'):
+            # A new shipment starts its own status lifecycle, the status of the
+            # previous one (e.g. CANCELLED) must not make its events look stale
+            resent = self.filtered(lambda p: p.carrier_tracking_ref != vals['carrier_tracking_ref']
+                                   and (p.pedidosya_status or p.carrier_tracking_status))
+            if resent:
+                super(StockPicking, resent).write(PEDIDOSYA_STATUS_RESET)
+        return super().write(vals)
+    
+    def _pedidosya_write_statuses(self, statuses):
+        """
+        Apply PedidosYa statuses given as {picking id: status} or {picking id: (status, event date)}
+        Duplicate and out of order statuses are dropped before writing, the
+        others are written with one write per status and date
+        Returns the pickings whose status actually changed
+        """
+        now = fields.Datetime.now()
+        ids_by_update = defaultdict(list)
+        for picking in self:
+            update = statuses.get(picking.id)
+            if not update:
+                continue
+            status, date = update if isinstance(update, tuple) else (update, None)
+            date = date or now
+            if status == picking.pedidosya_status:
+                skipped_status_updates['duplicate'] += 1
+                continue
+            sequence = PEDIDOSYA_STATUS_SEQUENCE.get(status, 0)
+            if picking._is_pedidosya_status_stale(sequence, date):
+                skipped_status_updates['stale'] += 1
+                _logger.debug(f"Ignoring stale PedidosYa status {status} for picking {picking.name}")
+                continue
+            ids_by_update[(status, sequence, date)].append(picking.id)
+        
+        for (status, sequence, date), picking_ids in ids_by_update.items():
+            vals = {
+                'pedidosya_status': status,
+                'pedidosya_status_sequence': sequence,
+                'pedidosya_status_date': date,
+            }
+            if status in PEDIDOSYA_TRACKING_STATUS:
+                vals['carrier_tracking_status'] = PEDIDOSYA_TRACKING_STATUS[status]
+            self.browse(picking_ids).write(vals)
+            if status == 'CANCELLED':
+                self.browse(picking_ids)._pedidosya_clear_label_cache()
+        
+        return self.browse([picking_id for picking_ids in ids_by_update.values() for picking_id in picking_ids])
+    
+    def _get_pedidosya_label_attachments(self):
+        """Cached label of each current shipment, as {shipping id: attachment}"""
+        attachments = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_id', 'in', self.ids),
+            ('description', '=', PEDIDOSYA_LABEL_TAG),
+        ])
+        shipment_ids = {PEDIDOSYA_LABEL_NAME % picking.carrier_tracking_ref: picking.carrier_tracking_ref
+                        for picking in self if picking.carrier_tracking_ref}
+        return {shipment_ids[attachment.name]: attachment for attachment in attachments
+                if attachment.name in shipment_ids}
+    
+    def _pedidosya_clear_label_cache(self):
+        """Drop the cached labels, the shipment they belong to no longer exists"""
+        self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_id', 'in', self.ids),
+            ('description', '=', PEDIDOSYA_LABEL_TAG),
+        ]).unlink()
+    
+    def _is_pedidosya_status_stale(self, sequence, date):
+        """Whether a status is behind the one already applied to the picking"""
+        self.ensure_one()
+        current = self.pedidosya_status_sequence
+        if current >= PEDIDOSYA_FINAL_STATUS_SEQUENCE or sequence < current:
+            return True
+        return sequence == current and bool(self.pedidosya_status_date) and date <= self.pedidosya_status_date
+    
+    def _pedidosya_schedule_validation(self):
+        """Queue pickings delivered by PedidosYa for the validation job"""
+        if self:
+            self.write({
+                'pedidosya_to_validate': True,
+                'pedidosya_validate_attempts': 0,
+                'pedidosya_validate_after': False,
+            })
+    
+    @api.model
+    def _cron_pedidosya_validate_completed(self, limit=500):
+        """
+        Validate pickings delivered by PedidosYa, batched per company and warehouse
+        Batches hitting a lock are retried later with exponential backoff
+        """
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        now = fields.Datetime.now()
+        pickings = self.search([
+            ('pedidosya_to_validate', '=', True),
+            '|', ('pedidosya_validate_after', '=', False), ('pedidosya_validate_after', '<=', now),
+        ], order='id', limit=limit)
+        
+        # Pickings validated by hand in the meantime
+        done = pickings.filtered(lambda p: p.state in ('done', 'cancel'))
+        done.write({'pedidosya_to_validate': False})
+        
+        groups = defaultdict(lambda: self.browse())
+        for picking in pickings - done:
+            groups[(picking.company_id, picking.picking_type_id.warehouse_id)] |= picking
+        
+        for (company, warehouse), group in groups.items():
+            group.with_company(company)._pedidosya_validate_batch()
+            if auto_commit:
+                self.env.cr.commit()
+    
+    def _pedidosya_validate_batch(self):
+        """Validate a batch of pickings, falling back to one by one when the batch fails"""
+        try:
+            with self.env.cr.savepoint():
+                res = self.with_context(tracking_disable=False).button_validate()
+                if isinstance(res, dict) and res.get('res_model') in PEDIDOSYA_VALIDATION_WIZARDS:
+                    # A wizard (backorder, expiry...) is needed, nothing was validated
+                    raise UserError(_('The transfer needs user input to be validated'))
+        except OperationalError as e:
+            # Lock or serialization conflict with another transaction, try again later
+            _logger.warning(f"PedidosYa validation of {len(self)} pickings postponed: {e}")
+            try:
+                with self.env.cr.savepoint():
+                    self._pedidosya_postpone_validation()
+            except OperationalError:
+                # Rows still locked, they stay queued for the next run
+                pass
+            return
+        except (UserError, ValidationError) as e:
+            if len(self) > 1:
+                # Isolate the pickings that make the batch fail
+                for picking in self:
+                    picking._pedidosya_validate_batch()
+                return
+            _logger.error(f"Could not validate picking {self.name} completed by PedidosYa: {e}")
+        
+        # Pickings still not done need user input (backorder, missing quantities...)
+        for picking in self.filtered(lambda p: p.state != 'done'):
+            picking.message_post(body=_('Delivered by PedidosYa, the transfer could not be validated automatically'))
+        self.write({'pedidosya_to_validate': False})
+    
+    def _pedidosya_postpone_validation(self):
+        for picking in self:
+            attempts = picking.pedidosya_validate_attempts + 1
+            if attempts > PEDIDOSYA_VALIDATE_MAX_ATTEMPTS:
+                picking.message_post(body=_('Delivered by PedidosYa, the transfer could not be validated automatically'))
+                picking.pedidosya_to_validate = False
+                continue
+            delay = min(2 ** attempts, 60)
+            picking.write({
+                'pedidosya_validate_attempts': attempts,
+                'pedidosya_validate_after': fields.Datetime.now() + datetime.timedelta(minutes=delay),
+            })
+    
+    def action_pedidosya_send_multistop(self):
+        """
+        Create the multi-stop PedidosYa shipments of the selected ready pickings
+        Pickings keep their shipment when validated later, only carriers with
+        multi-stop shipments enabled are consolidated
+        """
+        pickings = self.filtered(lambda p: p.carrier_id.delivery_type == 'pedidosya' and p.carrier_id.pedidosya_consolidate
+                                 and p.state == 'assigned' and not p.carrier_tracking_ref)
+        if not pickings:
+            raise UserError(_('No ready transfers of a PedidosYa carrier with multi-stop shipments enabled'))
+        
+        shipments = set()
+        errors = []
+        for carrier in pickings.carrier_id:
+            carrier_pickings = pickings.filtered(lambda p: p.carrier_id == carrier)
+            for picking, result in zip(carrier_pickings, carrier.pedidosya_send_shipping(carrier_pickings)):
+                if result['tracking_number']:
+                    shipments.add(result['tracking_number'])
+                else:
+                    errors.append((picking.name, result.get('error_message')))
+        
+        message = _('%s transfers sent in %s PedidosYa shipments.') % (len(pickings) - len(errors), len(shipments))
+        if errors:
+            message += ' ' + _('%s could not be sent: %s') % (
+                len(errors), ', '.join(f"{name} ({error})" for name, error in errors[:10]))
+            if len(errors) > 10:
+                message += ', ...'
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('PedidosYa Multi-stop Shipments'),
+                'message': message,
+                'type': 'warning' if errors else 'success',
+                'sticky': bool(errors),
+            },
+        }
+    
+    def action_pedidosya_cancel_shipments(self, chunk_size=200):
+        """
+        Cancel the PedidosYa shipments of the selected pickings in bulk
+        Pickings are canceled per carrier and in chunks, each chunk is committed
+        once canceled since PedidosYa can't undo a cancellation. Failures are
+        summarized in a notification instead of aborting the whole selection
+        """
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        pickings = self.filtered(lambda p: p.carrier_id.delivery_type == 'pedidosya' and p.carrier_tracking_ref)
+        
+        canceled = 0
+        errors = []
+        for carrier in pickings.carrier_id:
+            for chunk_ids in split_every(chunk_size, pickings.filtered(lambda p: p.carrier_id == carrier).ids):
+                chunk = self.browse(chunk_ids)
+                try:
+                    results = carrier.pedidosya_cancel_shipment(chunk)
+                except UserError as e:
+                    # A chunk of a single picking raises instead of reporting
+                    results = [{'picking_id': chunk.id, 'success': False, 'error_message': str(e)}]
+                succeeded = self.browse([result['picking_id'] for result in results if result['success']])
+                # Same as a cancellation from the picking form
+                succeeded.write({'carrier_tracking_ref': False})
+                canceled += len(succeeded)
+                errors += [(self.browse(result['picking_id']).name, result['error_message'])
+                           for result in results if not result['success']]
+                if auto_commit:
+                    self.env.cr.commit()
+        
+        message = _('%s PedidosYa shipments canceled.') % canceled
+        if errors:
+            message += ' ' + _('%s could not be canceled: %s') % (
+                len(errors), ', '.join(f"{name} ({error})" for name, error in errors[:10]))
+            if len(errors) > 10:
+                message += ', ...'
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('PedidosYa Cancellation'),
+                'message': message,
+                'type': 'warning' if errors else 'success',
+                'sticky': bool(errors),
+            },
+        }
\ No newline at end of file
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from .pedidosya_request import _get_retry_budget, decode_response, endpoint_name
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# A single event loop per worker process, running in its own daemon thread.
+# Coroutines are submitted to it from the request threads and awaited there,
+# so no event loop ever runs on a thread that also uses the ORM
+_loop = None
+_loop_lock = threading.Lock()
+
+# httpx clients are bound to the loop, they are only created and used from its thread
+_clients = {}
+
+
+def is_available():
+    return httpx is not None
+
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='pedidosya-asyncio', daemon=True).start()
+        return _loop
+
+
+def run(coro):
+    """Run a coroutine on the shared event loop and wait for its result"""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+
+def _get_client(key, pool_size, timeout):
+    """Return the httpx client for the given key, must be called from the loop thread"""
+    client, size = _clients.get(key, (None, None))
+    if client is not None and size == pool_size:
+        return client
+    if client is not None:
+        # Pool size changed on the carrier, the old connections are closed in the background
+        asyncio.get_running_loop().create_task(client.aclose())
+    client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+        headers={'Accept': 'application/json', 'Accept-Encoding': 'gzip, deflate'},
+    )
+    _clients[key] = (client, pool_size)
+    return client
+
+
+def _to_response(response):
+    """Turn an httpx response into a requests one, so callers handle both backends alike"""
+    res = requests.Response()
+    res.status_code = response.status_code
+    res._content = response.content
+    res.headers = CaseInsensitiveDict(response.headers)
+    res.url = str(response.url)
+    res.reason = response.reason_phrase
+    res.encoding = response.encoding
+    return res
+
+
+def _to_request_error(error):
+    """Turn an httpx error into the matching requests exception, callers only handle those"""
+    if isinstance(error, httpx.ConnectTimeout):
+        return requests.exceptions.ConnectTimeout(str(error))
+    if isinstance(error, httpx.TimeoutException):
+        return requests.exceptions.ReadTimeout(str(error))
+    if isinstance(error, httpx.DecodingError):
+        return requests.exceptions.ContentDecodingError(str(error))
+    if isinstance(error, httpx.TooManyRedirects):
+        return requests.exceptions.TooManyRedirects(str(error))
+    if isinstance(error, httpx.TransportError):
+        return requests.exceptions.ConnectionError(str(error))
+    return requests.exceptions.RequestException(str(error))
+
+
+class PedidosYaAsyncRequest:
+    """
+    Asyncio client for the PedidosYa Courier API, for high fan-out batch operations
+    Uses the configuration, rate limiter, retry policy and circuit breaker of the
+    given synchronous client. Batch coroutines run up to max_concurrency calls at a
+    time and return (result, exception) tuples in the same order as their input,
+    each has a synchronous counterpart that runs it on the shared event loop
+    """
+
+    def __init__(self, client, max_concurrency=8):
+        if httpx is None:
+            raise ImportError("The httpx library is required by the asyncio PedidosYa client")
+        self.client = client
+        self.max_concurrency = max(max_concurrency or 1, 1)
+
+    async def request(self, method, path, token=None, data=None, params=None, idempotent=None, idempotency_key=None):
+        """Same as PedidosYaRequest.request, without blocking the event loop"""
+        client = self.client
+        headers, body = client._prepare_request(token, data, idempotency_key)
+        if idempotent is None:
+            idempotent = method in ('GET', 'PUT', 'DELETE') or bool(idempotency_key)
+        budget = _get_retry_budget(client.key, endpoint_name(path))
+        session = _get_client(client.key, client.pool_size, client.timeout)
+
+        attempt = 0
+        while True:
+            client._check_breaker()
+            wait = client.limiter.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            response = error = None
+            start = time.monotonic()
+            try:
+                response = _to_response(await session.request(
+                    method, f"{client.base_url}{path}", headers=headers, content=body, params=params,
+                ))
+            except httpx.HTTPError as e:
+                error = _to_request_error(e)
+            except Exception:
+                # Never leave a half open breaker waiting for the outcome of this call
+                client.breaker.record(False, time.monotonic() - start)
+                raise
+            client._record_call(method, path, body, response, error, time.monotonic() - start, attempt)
+
+            if not client._should_retry(attempt, idempotent, response, error) or not budget.spend():
+                if error is not None:
+                    raise error
+                if response.status_code < 400:
+                    budget.earn()
+                return response
+
+            attempt += 1
+            await asyncio.sleep(client._retry_delay(method, path, attempt, response, error))
+
+    async def gather(self, func, items):
+        """Await func on every item, at most max_concurrency at a time, as (result, exception) tuples"""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def _call(item):
+            async with semaphore:
+                try:
+                    return await func(item), None
+                except Exception as e:
+                    return None, e
+
+        return await asyncio.gather(*(_call(item) for item in items))
+
+    async def _post_json(self, path, token, data, idempotent=False):
+        response = await self.request('POST', path, token=token, data=data, idempotent=idempotent)
+        response.raise_for_status()
+        return decode_response(response)
+
+    async def _get_json(self, path, token, params=None):
+        response = await self.request('GET', path, token=token, params=params)
+        response.raise_for_status()
+        return decode_response(response)
+
+    # Batch coroutines
+    async def estimates_async(self, payloads, token):
+        return await self.gather(
+            lambda data: self._post_json('/v3/shippings/estimates', token, data, idempotent=True), payloads)
+
+    async def create_shippings_async(self, payloads, token):
+        return await self.gather(lambda data: self._post_json('/v3/shippings', token, data), payloads)
+
+    async def get_shippings_async(self, shipping_ids, token):
+        return await self.gather(lambda shipping_id: self._get_json(f"/v3/shippings/{shipping_id}", token), shipping_ids)
+
+    async def cancel_shippings_async(self, cancellations, token):
+        """Cancel shipments given as (shipping id, reason) tuples"""
+        return await self.gather(
+            lambda cancellation: self._post_json(f"/v3/shippings/{cancellation[0]}/cancel", token,
+                                                 {'reasonText': cancellation[1]}, idempotent=True),
+            cancellations)
+
+    async def get_labels_async(self, shipping_id_chunks, token):
+        """Label PDFs, one call per chunk of shipping ids"""
+        async def _get_labels(chunk):
+            response = await self.request('GET', '/v3/shippings/labels', token=token, params={'values': ','.join(chunk)})
+            response.raise_for_status()
+            return response.content
+
+        return await self.gather(_get_labels, shipping_id_chunks)
+
+    # Synchronous facade
+    def estimates(self, payloads, token):
+        return run(self.estimates_async(payloads, token))
+
+    def create_shippings(self, payloads, token):
+        return run(self.create_shippings_async(payloads, token))
+
+    def get_shippings(self, shipping_ids, token):
+        return run(self.get_shippings_async(shipping_ids, token))
+
+    def cancel_shippings(self, cancellations, token):
+        return run(self.cancel_shippings_async(cancellations, token))
+
+    def get_labels(self, shipping_id_chunks, token):
+        return run(self.get_labels_async(shipping_id_chunks, token))
\ No newline at end of file
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from collections import Counter, OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with optional per-entry time to live
+    Keeps hit/miss counters so callers can report cache efficiency
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+        self._key_locks = {}
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None, count=True):
+        """Return the cached value for key, or default if missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expiry, value = entry
+                if expiry is None or expiry > time.monotonic():
+                    self._data.move_to_end(key)
+                    if count:
+                        self.hits += 1
+                    return value
+                del self._data[key]
+            if count:
+                self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        """Store value under key, evicting the least recently used entries"""
+        ttl = self.ttl if ttl is None else ttl
+        expiry = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (expiry, value)
+            self._data.move_to_end(key)
+            while len(self._data) > max(self.maxsize, 1):
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry[1] if entry is not None else default
+
+    def evict(self, predicate):
+        """Drop every entry whose key matches predicate"""
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def lock_for(self, key):
+        """
+        Return a lock dedicated to key, used to make sure only one thread
+        refreshes a given entry while the others wait for its result
+        """
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+            }
+
+
+# Authentication tokens, keyed by database, carrier, environment and API key
+token_cache = LRUCache(maxsize=256)
+
+# Rate quotes, one cache per carrier so size and TTL follow its configuration
+_quote_caches = {}
+_quote_caches_lock = threading.Lock()
+
+
+def get_quote_cache(key, maxsize, ttl):
+    """Return the quote cache for a carrier, resized to its current settings"""
+    with _quote_caches_lock:
+        cache = _quote_caches.get(key)
+        if cache is None:
+            cache = _quote_caches[key] = LRUCache(maxsize=maxsize, ttl=ttl)
+        else:
+            cache.maxsize = maxsize
+            cache.ttl = ttl
+        return cache
+
+
+def clear_quote_cache(key):
+    """Evict every quote of a carrier, counters are kept"""
+    with _quote_caches_lock:
+        cache = _quote_caches.get(key)
+    if cache is not None:
+        cache.clear()
+
+
+def cache_stats():
+    """Hits and misses of the token cache and of all quote caches of this worker"""
+    with _quote_caches_lock:
+        quote_caches = list(_quote_caches.values())
+    quotes = [cache.stats() for cache in quote_caches]
+    return {
+        'token': token_cache.stats(),
+        'quote': {
+            'hits': sum(stats['hits'] for stats in quotes),
+            'misses': sum(stats['misses'] for stats in quotes),
+        },
+    }
+
+
+class SeenSet:
+    """
+    Bounded set of recently seen keys, the oldest keys are forgotten first
+    Used to drop retried webhook events without touching the database
+    """
+
+    def __init__(self, maxsize=50000):
+        self.maxsize = maxsize
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._keys
+
+    def add(self, key):
+        """Remember key, returns False when it was already seen"""
+        with self._lock:
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                return False
+            self._keys[key] = None
+            if len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+            return True
+
+
+# Webhook events already received by this worker, keyed by shipping ID, status and event time
+webhook_seen = SeenSet()
+
+# Webhook and tracking updates dropped before reaching the database: 'duplicate' and 'stale'
+skipped_status_updates = Counter()
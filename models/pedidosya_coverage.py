@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+import datetime
+import logging
+
+from .pedidosya_geo import geohash_encode
+
+_logger = logging.getLogger(__name__)
+
+class PedidosYaCoverage(models.Model):
+    _name = 'pedidosya.coverage'
+    _description = 'PedidosYa Coverage Index'
+    _order = 'last_check desc'
+
+    carrier_id = fields.Many2one('delivery.carrier', string='Delivery Carrier', required=True,
+                                 ondelete='cascade', index=True)
+    warehouse_id = fields.Many2one('stock.warehouse', string='Warehouse', required=True, ondelete='cascade')
+    cell = fields.Char(string='Geohash Cell', required=True, index=True,
+                       help='Geohash of the drop-off coordinates')
+    is_covered = fields.Boolean(string='Covered')
+    last_check = fields.Datetime(string='Last Check', required=True, index=True)
+    # Drop-off point of the last probe, used to revalidate the cell
+    latitude = fields.Float(string='Latitude', digits=(10, 7))
+    longitude = fields.Float(string='Longitude', digits=(10, 7))
+    street = fields.Char(string='Street')
+    city = fields.Char(string='City')
+
+    _sql_constraints = [
+        ('cell_uniq', 'unique(carrier_id, warehouse_id, cell)',
+         'A coverage cell can only be recorded once per carrier and warehouse.'),
+    ]
+
+    @api.model
+    def _get_cell(self, carrier, latitude, longitude):
+        return geohash_encode(latitude, longitude, carrier.pedidosya_coverage_precision or 6)
+
+    @api.model
+    def _lookup(self, carrier, warehouse, cell):
+        """
+        Return the known coverage of a cell: True or False while the entry is fresh,
+        None when the cell was never checked or its entry expired
+        """
+        entry = self.search([
+            ('carrier_id', '=', carrier.id),
+            ('warehouse_id', '=', warehouse.id),
+            ('cell', '=', cell),
+        ], limit=1)
+        if not entry:
+            return None
+        ttl = datetime.timedelta(hours=carrier.pedidosya_coverage_ttl or 0)
+        if entry.last_check + ttl < fields.Datetime.now():
+            return None
+        return entry.is_covered
+
+    @api.model
+    def _record(self, carrier, warehouse, cell, is_covered, delivery_address):
+        """
+        Insert or refresh the coverage entry of a cell
+        An entry checked within the TTL with the same result is left as is, quotes of
+        the same cell must not all write the row they share
+        """
+        now = fields.Datetime.now()
+        checked_after = now - datetime.timedelta(hours=carrier.pedidosya_coverage_ttl or 0)
+        if self.search_count([
+            ('carrier_id', '=', carrier.id),
+            ('warehouse_id', '=', warehouse.id),
+            ('cell', '=', cell),
+            ('is_covered', '=', bool(is_covered)),
+            ('last_check', '>=', checked_after),
+        ], limit=1):
+            return
+        # Upsert in SQL, concurrent quotes for the same cell must not fail on the unique constraint
+        # nor rewrite an entry another transaction just refreshed with the same result
+        self.env.cr.execute("""
+            INSERT INTO pedidosya_coverage
+                (carrier_id, warehouse_id, cell, is_covered, last_check, latitude, longitude, street, city,
+                 create_uid, create_date, write_uid, write_date)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (carrier_id, warehouse_id, cell) DO UPDATE
+               SET is_covered = EXCLUDED.is_covered,
+                   last_check = EXCLUDED.last_check,
+                   latitude = EXCLUDED.latitude,
+                   longitude = EXCLUDED.longitude,
+                   street = EXCLUDED.street,
+                   city = EXCLUDED.city,
+                   write_uid = EXCLUDED.write_uid,
+                   write_date = EXCLUDED.write_date
+             WHERE pedidosya_coverage.is_covered IS DISTINCT FROM EXCLUDED.is_covered
+                OR pedidosya_coverage.last_check < %s
+        """, [
+            carrier.id, warehouse.id, cell, bool(is_covered), now,
+            delivery_address.partner_latitude, delivery_address.partner_longitude,
+            delivery_address.street or '', delivery_address.city or '',
+            self.env.uid, now, self.env.uid, now, checked_after,
+        ])
+        self.invalidate_model()
+
+    @api.model
+    def _cron_revalidate_coverage(self, limit=500):
+        """Check expired cells again against the coverage API"""
+        now = fields.Datetime.now()
+        carriers = self.env['delivery.carrier'].search([
+            ('delivery_type', '=', 'pedidosya'),
+            ('pedidosya_coverage_index', '=', True),
+        ])
+        for carrier in carriers:
+            expired_before = now - datetime.timedelta(hours=carrier.pedidosya_coverage_ttl or 0)
+            entries = self.search([
+                ('carrier_id', '=', carrier.id),
+                ('last_check', '<', expired_before),
+            ], order='last_check', limit=limit)
+            for entry in entries:
+                pickup_address = entry.warehouse_id.partner_id
+                data = carrier._prepare_pedidosya_coverage_data(pickup_address, pickup_address)
+                # Probe the drop-off point recorded for the cell
+                data['waypoints'][1].update({
+                    'addressStreet': entry.street,
+                    'city': entry.city,
+                    'latitude': entry.latitude,
+                    'longitude': entry.longitude,
+                })
+                is_covered = carrier._request_pedidosya_coverage(data)
+                if is_covered is None:
+                    # API unavailable, keep the entry and try again on the next run
+                    continue
+                entry.write({'is_covered': is_covered, 'last_check': fields.Datetime.now()})
+            _logger.info(f"Revalidated {len(entries)} PedidosYa coverage cells for carrier {carrier.name}")
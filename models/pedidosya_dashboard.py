@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, _
+from markupsafe import Markup
+import datetime
+import os
+
+from .pedidosya_cache import skipped_status_updates
+from .pedidosya_metrics import metrics
+
+class PedidosYaMetricsDashboard(models.TransientModel):
+    _name = 'pedidosya.metrics.dashboard'
+    _description = 'PedidosYa Metrics'
+
+    report = fields.Html(string='Metrics', compute='_compute_report', sanitize=False)
+
+    @api.depends_context('uid')
+    def _compute_report(self):
+        for dashboard in self:
+            dashboard.report = self._render_report()
+
+    @api.model
+    def _render_table(self, title, headers, rows):
+        html = Markup('<h4>%s</h4><table class="table table-sm o_main_table"><thead><tr>%s</tr></thead><tbody>%s</tbody></table>') % (
+            title,
+            Markup('').join(Markup('<th>%s</th>') % header for header in headers),
+            Markup('').join(
+                Markup('<tr>%s</tr>') % Markup('').join(Markup('<td>%s</td>') % cell for cell in row)
+                for row in rows
+            ) or Markup('<tr><td colspan="%s">%s</td></tr>') % (len(headers), _('No data yet')),
+        )
+        return html
+
+    @api.model
+    def _render_report(self):
+        """Metrics of the worker process serving the request, as HTML tables"""
+        ms = lambda seconds: f"{seconds * 1000:.0f}"
+        endpoints = self._render_table(_('API Calls'), [
+            _('Endpoint'), _('Calls'), _('Errors'), _('Retries'), _('p50 (ms)'), _('p95 (ms)'), _('p99 (ms)'),
+            _('Request (bytes)'), _('Response (bytes)'), _('Status Codes'),
+        ], [
+            (f"{row['method']} {row['endpoint']}", row['calls'], row['errors'], row['retries'],
+             ms(row['p50']), ms(row['p95']), ms(row['p99']),
+             f"{row['request_size']:.0f}", f"{row['response_size']:.0f}",
+             ', '.join(f"{status}: {count}" for status, count in sorted(row['statuses'].items())))
+            for row in metrics.endpoints()
+        ])
+        caches = self._render_table(_('Caches'), [_('Cache'), _('Hits'), _('Misses'), _('Hit Ratio')], [
+            (name, stats['hits'], stats['misses'], f"{stats['ratio']:.1%}")
+            for name, stats in metrics.cache_ratios().items()
+        ])
+        webhooks = self._render_table(_('Webhooks'), [
+            _('Stage'), _('Batches'), _('Events'), _('p50 (ms)'), _('p99 (ms)'), _('Per Event (ms)'),
+        ], [
+            (stage, stats['batches'], stats['events'], ms(stats['p50']), ms(stats['p99']), f"{stats['per_event'] * 1000:.2f}")
+            for stage, stats in metrics.webhook_stages().items()
+        ] + [
+            (_('skipped (%s)') % reason, '', count, '', '', '') for reason, count in sorted(skipped_status_updates.items())
+        ])
+        slow_calls = self._render_table(_('Latest Slow Calls'), [
+            _('Time'), _('Endpoint'), _('Status'), _('Duration (ms)'), _('Request Fingerprint'),
+        ], [
+            (fields.Datetime.to_string(datetime.datetime.fromtimestamp(call['time'], datetime.timezone.utc).replace(tzinfo=None)),
+             f"{call['method']} {call['endpoint']}", call['status'], ms(call['duration']), call['fingerprint'])
+            for call in reversed(metrics.slow_calls)
+        ])
+        header = Markup('<p class="text-muted">%s</p>') % (
+            _('Metrics of worker process %s since it started or since the last reset.') % os.getpid())
+        return header + endpoints + caches + webhooks + slow_calls
+
+    def action_refresh(self):
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'view_mode': 'form',
+            'target': 'current',
+            'name': _('PedidosYa Metrics'),
+        }
+
+    def action_reset(self):
+        metrics.reset()
+        return self.action_refresh()
\ No newline at end of file
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from .pedidosya_geo import EARTH_RADIUS, haversine
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def parse_polygon(text):
+    """
+    Read a service polygon given as a JSON list of [latitude, longitude] vertices
+    Returns a tuple of (latitude, longitude) pairs, or None for an empty text
+    """
+    if not text or not text.strip():
+        return None
+    try:
+        vertices = tuple((float(latitude), float(longitude)) for latitude, longitude in json.loads(text))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid polygon, expected a list of [latitude, longitude] pairs: {e}")
+    if len(vertices) < 3:
+        raise ValueError("A polygon needs at least 3 vertices")
+    return vertices
+
+
+def distances(latitude, longitude, latitudes, longitudes):
+    """Great circle distances in km from one point to many points"""
+    if numpy is None:
+        return [haversine(latitude, longitude, lat, lon) for lat, lon in zip(latitudes, longitudes)]
+    lat1 = numpy.radians(latitude)
+    lat2 = numpy.radians(numpy.asarray(latitudes, dtype=float))
+    dlat = lat2 - lat1
+    dlon = numpy.radians(numpy.asarray(longitudes, dtype=float) - longitude)
+    a = numpy.sin(dlat / 2) ** 2 + numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0)))
+
+
+def _contains(polygon, latitude, longitude):
+    inside = False
+    lat_j, lon_j = polygon[-1]
+    for lat_i, lon_i in polygon:
+        if (lat_i > latitude) != (lat_j > latitude):
+            if longitude < (lon_j - lon_i) * (latitude - lat_i) / (lat_j - lat_i) + lon_i:
+                inside = not inside
+        lat_j, lon_j = lat_i, lon_i
+    return inside
+
+
+def contains(polygon, latitudes, longitudes):
+    """Whether each point is inside the polygon, by ray casting over its edges"""
+    if numpy is None:
+        return [_contains(polygon, lat, lon) for lat, lon in zip(latitudes, longitudes)]
+    lats = numpy.asarray(latitudes, dtype=float)
+    lons = numpy.asarray(longitudes, dtype=float)
+    inside = numpy.zeros(len(lats), dtype=bool)
+    lat_j, lon_j = polygon[-1]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        for lat_i, lon_i in polygon:
+            # Horizontal edges never cross, their division by zero is masked out
+            crosses = (lat_i > lats) != (lat_j > lats)
+            inside ^= crosses & (lons < (lon_j - lon_i) * (lats - lat_i) / (lat_j - lat_i) + lon_i)
+            lat_j, lon_j = lat_i, lon_i
+    return inside
+
+
+class ServiceArea:
+    """
+    Delivery area of a warehouse: within a maximum distance of it, inside a
+    polygon, or both. Points are checked in batch, vectorized with NumPy when
+    it is installed
+    """
+
+    def __init__(self, latitude, longitude, radius=0.0, polygon=None):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius = radius or 0.0
+        self.polygon = polygon
+
+    def check(self, latitudes, longitudes):
+        """Whether each point can be delivered, as a list of booleans"""
+        if numpy is None:
+            result = [bool(lat and lon) for lat, lon in zip(latitudes, longitudes)]
+            if self.radius:
+                result = [ok and distance <= self.radius for ok, distance in
+                          zip(result, distances(self.latitude, self.longitude, latitudes, longitudes))]
+            if self.polygon:
+                result = [ok and inside for ok, inside in zip(result, contains(self.polygon, latitudes, longitudes))]
+            return result
+        lats = numpy.asarray(latitudes, dtype=float)
+        lons = numpy.asarray(longitudes, dtype=float)
+        # Points without coordinates are never deliverable
+        result = (lats != 0) & (lons != 0)
+        if self.radius:
+            result &= distances(self.latitude, self.longitude, lats, lons) <= self.radius
+        if self.polygon:
+            result &= contains(self.polygon, lats, lons)
+        return result.tolist()
\ No newline at end of file
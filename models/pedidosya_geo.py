@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import math
+
+_GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Mean Earth radius in km
+EARTH_RADIUS = 6371.0088
+
+
+def geohash_encode(latitude, longitude, precision=6):
+    """
+    Encode coordinates as a geohash cell of the given precision
+    Precision 6 is a cell of roughly 1.2km x 0.6km, 7 is about 150m x 150m
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    cell = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(cell) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits <<= 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits <<= 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            cell.append(_GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(cell)
+
+
+def geohash_decode(cell):
+    """Return the (latitude, longitude) center of a geohash cell"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in cell:
+        value = _GEOHASH_BASE32.index(char)
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            target = lon_range if even else lat_range
+            mid = (target[0] + target[1]) / 2
+            if bit:
+                target[0] = mid
+            else:
+                target[1] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+
+def haversine(latitude1, longitude1, latitude2, longitude2):
+    """Great circle distance in km between two points"""
+    lat1, lat2 = math.radians(latitude1), math.radians(latitude2)
+    dlat = lat2 - lat1
+    dlon = math.radians(longitude2 - longitude1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
\ No newline at end of file
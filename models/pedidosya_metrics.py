@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from collections import Counter, deque
+
+from .pedidosya_cache import cache_stats
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Histogram:
+    """Fixed bucket histogram, in the Prometheus cumulative format"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate a quantile by linear interpolation within its bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for index, count in enumerate(self.counts):
+            upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+            if count and seen + count >= rank:
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return self.buckets[-1]
+
+    def cumulative(self):
+        """(upper bound, cumulative count) pairs, the last bound being +Inf"""
+        total = 0
+        for index, count in enumerate(self.counts):
+            total += count
+            yield (self.buckets[index] if index < len(self.buckets) else '+Inf'), total
+
+
+class Metrics:
+    """
+    Metrics of the PedidosYa integration in this worker process
+    API calls per endpoint (latency, status codes, retries, payload sizes),
+    cache hits and misses, webhook timings and the latest slow calls
+    """
+
+    def __init__(self, slow_calls=50):
+        self._lock = threading.Lock()
+        self.latency = {}
+        self.request_size = {}
+        self.response_size = {}
+        self.statuses = Counter()
+        self.retries = Counter()
+        self.cache = Counter()
+        self.webhook = {}
+        self.webhook_events = Counter()
+        self.slow_calls = deque(maxlen=slow_calls)
+
+    def observe_call(self, method, endpoint, status, duration, request_size=0, response_size=0, retry=False):
+        """Record one attempt of an API call, status is the HTTP code or the error class name"""
+        key = (method, endpoint)
+        with self._lock:
+            self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(duration)
+            self.request_size.setdefault(key, Histogram(SIZE_BUCKETS)).observe(request_size)
+            self.response_size.setdefault(key, Histogram(SIZE_BUCKETS)).observe(response_size)
+            self.statuses[key + (str(status),)] += 1
+            if retry:
+                self.retries[key] += 1
+
+    def observe_slow_call(self, method, endpoint, status, duration, fingerprint):
+        with self._lock:
+            self.slow_calls.append({
+                'time': time.time(),
+                'method': method,
+                'endpoint': endpoint,
+                'status': str(status),
+                'duration': duration,
+                'fingerprint': fingerprint,
+            })
+
+    def count_cache(self, cache, hit):
+        with self._lock:
+            self.cache[(cache, 'hit' if hit else 'miss')] += 1
+
+    def observe_webhook(self, stage, duration, events=1):
+        """Record the time spent on a webhook stage: 'receive' in the controller, 'process' in the inbox"""
+        with self._lock:
+            self.webhook.setdefault(stage, Histogram(LATENCY_BUCKETS)).observe(duration)
+            self.webhook_events[stage] += events
+
+    def cache_counts(self):
+        """Hits and misses of the in-memory caches and of the caches counted here, by cache name"""
+        counts = {name: (stats['hits'], stats['misses']) for name, stats in cache_stats().items()}
+        with self._lock:
+            for name in {name for name, _result in self.cache}:
+                counts[name] = (self.cache[(name, 'hit')], self.cache[(name, 'miss')])
+        return counts
+
+    def cache_ratios(self):
+        """Hit ratio of every cache"""
+        return {
+            name: {'hits': hits, 'misses': misses, 'ratio': hits / (hits + misses) if hits + misses else 0.0}
+            for name, (hits, misses) in sorted(self.cache_counts().items())
+        }
+
+    def endpoints(self):
+        """Summary per endpoint: calls, errors, retries, latency quantiles and mean payload sizes"""
+        with self._lock:
+            summary = []
+            for key, histogram in sorted(self.latency.items()):
+                statuses = {status: count for (method, endpoint, status), count in self.statuses.items()
+                            if (method, endpoint) == key}
+                errors = sum(count for status, count in statuses.items() if not (status.isdigit() and int(status) < 400))
+                summary.append({
+                    'method': key[0],
+                    'endpoint': key[1],
+                    'calls': histogram.count,
+                    'errors': errors,
+                    'retries': self.retries[key],
+                    'statuses': statuses,
+                    'p50': histogram.quantile(0.5),
+                    'p95': histogram.quantile(0.95),
+                    'p99': histogram.quantile(0.99),
+                    'mean': histogram.sum / histogram.count if histogram.count else 0.0,
+                    'request_size': self.request_size[key].sum / histogram.count if histogram.count else 0.0,
+                    'response_size': self.response_size[key].sum / histogram.count if histogram.count else 0.0,
+                })
+            return summary
+
+    def webhook_stages(self):
+        with self._lock:
+            return {
+                stage: {
+                    'batches': histogram.count,
+                    'events': self.webhook_events[stage],
+                    'p50': histogram.quantile(0.5),
+                    'p99': histogram.quantile(0.99),
+                    'per_event': histogram.sum / self.webhook_events[stage] if self.webhook_events[stage] else 0.0,
+                }
+                for stage, histogram in sorted(self.webhook.items())
+            }
+
+    def render_prometheus(self):
+        """Metrics in the Prometheus text exposition format"""
+        lines = []
+        cache_counts = self.cache_counts()
+
+        def _histogram(name, help_text, histograms, label_names):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in sorted(histograms.items()):
+                labels = labels if isinstance(labels, tuple) else (labels,)
+                base = ','.join(f'{label}="{value}"' for label, value in zip(label_names, labels))
+                for bound, count in histogram.cumulative():
+                    lines.append(f'{name}_bucket{{{base},le="{bound}"}} {count}')
+                lines.append(f"{name}_sum{{{base}}} {histogram.sum}")
+                lines.append(f"{name}_count{{{base}}} {histogram.count}")
+
+        with self._lock:
+            _histogram('pedidosya_request_duration_seconds', 'Duration of PedidosYa API calls',
+                       self.latency, ('method', 'endpoint'))
+            _histogram('pedidosya_request_size_bytes', 'Size of PedidosYa API request bodies',
+                       self.request_size, ('method', 'endpoint'))
+            _histogram('pedidosya_response_size_bytes', 'Size of PedidosYa API response bodies',
+                       self.response_size, ('method', 'endpoint'))
+            lines.append("# HELP pedidosya_requests_total PedidosYa API calls by status code or error")
+            lines.append("# TYPE pedidosya_requests_total counter")
+            for (method, endpoint, status), count in sorted(self.statuses.items()):
+                lines.append(f'pedidosya_requests_total{{method="{method}",endpoint="{endpoint}",status="{status}"}} {count}')
+            lines.append("# HELP pedidosya_retries_total Retried PedidosYa API calls")
+            lines.append("# TYPE pedidosya_retries_total counter")
+            for (method, endpoint), count in sorted(self.retries.items()):
+                lines.append(f'pedidosya_retries_total{{method="{method}",endpoint="{endpoint}"}} {count}')
+            lines.append("# HELP pedidosya_cache_requests_total Cache lookups by cache and result")
+            lines.append("# TYPE pedidosya_cache_requests_total counter")
+            for cache, (hits, misses) in sorted(cache_counts.items()):
+                lines.append(f'pedidosya_cache_requests_total{{cache="{cache}",result="hit"}} {hits}')
+                lines.append(f'pedidosya_cache_requests_total{{cache="{cache}",result="miss"}} {misses}')
+            _histogram('pedidosya_webhook_duration_seconds', 'Time spent receiving and processing webhook events',
+                       self.webhook, ('stage',))
+            lines.append("# HELP pedidosya_webhook_events_total Webhook events received and processed")
+            lines.append("# TYPE pedidosya_webhook_events_total counter")
+            for stage, count in sorted(self.webhook_events.items()):
+                lines.append(f'pedidosya_webhook_events_total{{stage="{stage}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            for values in (self.latency, self.request_size, self.response_size, self.statuses, self.retries,
+                           self.cache, self.webhook, self.webhook_events, self.slow_calls):
+                values.clear()
+
+
+metrics = Metrics()
\ No newline at end of file
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+import datetime
+import math
+
+from .pedidosya_geo import geohash_encode
+
+# A recorded quote is shared by every checkout of its cell and cart size, it is refreshed at most this often
+QUOTE_REFRESH_INTERVAL = datetime.timedelta(minutes=10)
+
+class PedidosYaQuoteHistory(models.Model):
+    _name = 'pedidosya.quote.history'
+    _description = 'PedidosYa Last Known Quotes'
+    _order = 'quote_date desc'
+
+    carrier_id = fields.Many2one('delivery.carrier', string='Delivery Carrier', required=True,
+                                 ondelete='cascade', index=True)
+    warehouse_id = fields.Many2one('stock.warehouse', string='Warehouse', required=True, ondelete='cascade')
+    cell = fields.Char(string='Geohash Cell', required=True,
+                       help='Geohash of the drop-off coordinates')
+    cart_class = fields.Char(string='Cart Size Class', required=True,
+                             help='Order of magnitude of the cart weight and volume')
+    price = fields.Float(string='Price')
+    quote_date = fields.Datetime(string='Quote Date', required=True, index=True)
+
+    _sql_constraints = [
+        ('quote_uniq', 'unique(carrier_id, warehouse_id, cell, cart_class)',
+         'A quote can only be recorded once per carrier, warehouse, cell and cart size.'),
+    ]
+
+    @api.model
+    def _get_key(self, carrier, delivery_address, items):
+        """Cell of the drop-off point and size class of the cart a quote is filed under"""
+        cell = geohash_encode(delivery_address.partner_latitude, delivery_address.partner_longitude,
+                              carrier.pedidosya_coverage_precision or 6)
+        weight = sum(item['weight'] * item['quantity'] for item in items)
+        volume = sum(item['volume'] * item['quantity'] for item in items)
+        # Carts within the same power of two of weight (kg) and volume (cm3) are priced alike
+        cart_class = f"{math.ceil(math.log2(1 + weight))}:{math.ceil(math.log2(1 + volume))}"
+        return cell, cart_class
+
+    @api.model
+    def _lookup(self, carrier, warehouse, cell, cart_class):
+        """Last known quote for a similar delivery, an empty recordset when none is recent enough"""
+        max_age = datetime.timedelta(hours=carrier.pedidosya_stale_quote_age or 0)
+        return self.search([
+            ('carrier_id', '=', carrier.id),
+            ('warehouse_id', '=', warehouse.id),
+            ('cell', '=', cell),
+            ('cart_class', '=', cart_class),
+            ('quote_date', '>=', fields.Datetime.now() - max_age),
+        ], limit=1)
+
+    @api.model
+    def _record(self, carrier, warehouse, cell, cart_class, price):
+        """Insert the last known quote of a delivery, or refresh it once older than the refresh interval"""
+        now = fields.Datetime.now()
+        refresh_before = now - QUOTE_REFRESH_INTERVAL
+        # A plain read keeps checkouts from locking the shared row while its quote is recent
+        if self.search_count([
+            ('carrier_id', '=', carrier.id),
+            ('warehouse_id', '=', warehouse.id),
+            ('cell', '=', cell),
+            ('cart_class', '=', cart_class),
+            ('quote_date', '>=', refresh_before),
+        ], limit=1):
+            return
+        # Upsert in SQL, concurrent quotes for the same delivery must not fail on the unique constraint
+        # nor rewrite a row another transaction just refreshed
+        self.env.cr.execute("""
+            INSERT INTO pedidosya_quote_history
+                (carrier_id, warehouse_id, cell, cart_class, price, quote_date,
+                 create_uid, create_date, write_uid, write_date)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (carrier_id, warehouse_id, cell, cart_class) DO UPDATE
+               SET price = EXCLUDED.price,
+                   quote_date = EXCLUDED.quote_date,
+                   write_uid = EXCLUDED.write_uid,
+                   write_date = EXCLUDED.write_date
+             WHERE pedidosya_quote_history.quote_date < %s
+        """, [
+            carrier.id, warehouse.id, cell, cart_class, price, now,
+            self.env.uid, now, self.env.uid, now, refresh_before,
+        ])
+        self.invalidate_model()
+
+    @api.autovacuum
+    def _gc_expired_quotes(self):
+        """Remove quotes too old to be used as a fallback"""
+        now = fields.Datetime.now()
+        for carrier in self.env['delivery.carrier'].with_context(active_test=False).search([('delivery_type', '=', 'pedidosya')]):
+            max_age = datetime.timedelta(hours=carrier.pedidosya_stale_quote_age or 0)
+            self.search([('carrier_id', '=', carrier.id), ('quote_date', '<', now - max_age)]).unlink()
\ No newline at end of file
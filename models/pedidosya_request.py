@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import email.utils
+import hashlib
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .pedidosya_json import dumps, loads
+from .pedidosya_metrics import metrics
+
+_logger = logging.getLogger(__name__)
+
+# Sessions are kept per worker process and shared by every request made
+# for the same carrier and environment, so TCP/TLS connections are reused
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# Server errors worth retrying
+RETRY_STATUSES = (500, 502, 503, 504)
+# Network errors worth retrying, others (bad encoding, redirect loops...) would fail again
+RETRY_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError)
+
+
+def _get_session(key, pool_size):
+    """Return the pooled session for the given key, creating it if needed"""
+    with _sessions_lock:
+        session, size = _sessions.get(key, (None, None))
+        if session is not None and size == pool_size:
+            return session
+        if session is not None:
+            # Pool size changed on the carrier, drop the old connections
+            session.close()
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+        })
+        _sessions[key] = (session, pool_size)
+        return session
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter, safe to share between threads
+    Allows bursts of up to `burst` calls, then `rate` calls per second
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take one token and return how many seconds the caller must wait before using it"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """Block until a call is allowed"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+
+def imap_concurrent(func, items, max_workers=8):
+    """
+    Call func on every item using a bounded thread pool
+    Yields (result, exception) tuples in the same order as items, as soon as
+    each one is available, so one failing call never aborts the others.
+    func must not use the ORM
+    """
+    items = list(items)
+
+    def _call(item):
+        try:
+            return func(item), None
+        except Exception as e:
+            return None, e
+
+    if len(items) <= 1 or max_workers <= 1:
+        for item in items:
+            yield _call(item)
+        return
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items)), thread_name_prefix='pedidosya') as executor:
+        yield from executor.map(_call, items)
+
+
+def map_concurrent(func, items, max_workers=8):
+    """Same as imap_concurrent, returns the list of (result, exception) tuples"""
+    return list(imap_concurrent(func, items, max_workers=max_workers))
+
+
+def decode_response(response):
+    """Parse a JSON response body, invalid JSON is raised as a requests exception"""
+    try:
+        return loads(response.content)
+    except ValueError as e:
+        raise requests.exceptions.InvalidJSONError(str(e), response=response)
+
+
+def close_sessions(key=None):
+    """Close pooled sessions, all of them or only the one for the given key"""
+    with _sessions_lock:
+        keys = [key] if key is not None else list(_sessions)
+        for k in keys:
+            session, _size = _sessions.pop(k, (None, None))
+            if session is not None:
+                session.close()
+
+
+class RetryBudget:
+    """
+    Caps retries to a share of the calls made to an endpoint
+    Each retry spends a token, each successful call earns back a fraction of one,
+    so a failing endpoint quickly stops being retried instead of piling up load
+    """
+
+    def __init__(self, max_tokens=10.0, refill=0.1):
+        self.max_tokens = max_tokens
+        self.refill = refill
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def spend(self):
+        """Take a token for a retry, returns False when the budget is exhausted"""
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def earn(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.refill)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of calling the API while its circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Stops calling an API that keeps failing or answering too slowly
+    Opens after `threshold` consecutive failed or slow calls and fails fast for
+    `cooldown` seconds, then lets a single probe call through: the circuit closes
+    again if it succeeds and stays open for another cooldown if it fails
+    """
+
+    def __init__(self, threshold=5, slow_call=10.0, cooldown=60.0):
+        self.threshold = threshold
+        self.slow_call = slow_call
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self.opened_at is not None and time.monotonic() - self.opened_at < self.cooldown
+
+    def allow(self):
+        """Whether a call may be sent now"""
+        if not self.threshold:
+            return True
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown or self._probing:
+                return False
+            # Half open, let one probe call through
+            self._probing = True
+            return True
+
+    def record(self, success, duration):
+        if not self.threshold:
+            return
+        failed = not success or (self.slow_call and duration > self.slow_call)
+        with self._lock:
+            self._probing = False
+            if not failed:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.threshold:
+                if self.opened_at is None:
+                    _logger.warning(f"PedidosYa circuit opened after {self.failures} failed or slow calls")
+                self.opened_at = time.monotonic()
+
+
+# Rate limiters and circuit breakers per carrier, retry budgets per carrier and endpoint, shared by all threads
+_limiters = {}
+_breakers = {}
+_budgets = {}
+_registry_lock = threading.Lock()
+
+
+def _get_rate_limiter(key, rate):
+    with _registry_lock:
+        limiter = _limiters.get(key)
+        if limiter is None or limiter.rate != rate:
+            limiter = _limiters[key] = RateLimiter(rate)
+        return limiter
+
+
+def _get_circuit_breaker(key, threshold, slow_call, cooldown):
+    with _registry_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker(threshold, slow_call, cooldown)
+        else:
+            breaker.threshold, breaker.slow_call, breaker.cooldown = threshold, slow_call, cooldown
+        return breaker
+
+
+def _get_retry_budget(key, endpoint):
+    with _registry_lock:
+        budget = _budgets.get((key, endpoint))
+        if budget is None:
+            budget = _budgets[(key, endpoint)] = RetryBudget()
+        return budget
+
+
+# Fixed path segments of the API, any other segment is an identifier
+_STATIC_SEGMENTS = {
+    '', 'v3', 'authentication', 'token', 'estimates', 'coverage', 'shippings', 'labels', 'cancel',
+    'webhooks-configuration',
+}
+
+
+def endpoint_name(path):
+    """Path with its identifiers replaced by {id}, e.g. /v3/shippings/{id}/cancel"""
+    return '/'.join(segment if segment in _STATIC_SEGMENTS else '{id}' for segment in path.split('/'))
+
+
+def _retry_after(response):
+    """Seconds to wait according to the Retry-After header, None when absent or invalid"""
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+        return max((date - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class PedidosYaRequest:
+    """
+    Client for the PedidosYa Courier API
+    All calls go through a keep-alive connection pool shared per carrier
+    and environment, with explicit connect/read timeouts. Calls are throttled
+    by a rate limiter shared by all threads of the worker, throttled (429) and
+    failed calls are retried with jittered exponential backoff when it is safe.
+    A circuit breaker fails fast while the API keeps failing or is too slow.
+    Every attempt is recorded in the worker metrics, calls slower than
+    slow_log seconds are logged with a fingerprint of the request
+    """
+
+    def __init__(self, base_url, key, connect_timeout=5.0, read_timeout=30.0, pool_size=10,
+                 rate_limit=0.0, max_retries=0, backoff=0.5, max_backoff=30.0,
+                 breaker_threshold=0, breaker_slow_call=0.0, breaker_cooldown=60.0, slow_log=0.0):
+        self.base_url = base_url
+        self.key = key
+        self.timeout = (connect_timeout or None, read_timeout or None)
+        self.pool_size = max(pool_size or 1, 1)
+        self.session = _get_session(key, self.pool_size)
+        self.limiter = _get_rate_limiter(key, rate_limit or 0.0)
+        self.breaker = _get_circuit_breaker(key, breaker_threshold or 0, breaker_slow_call or 0.0, breaker_cooldown or 0.0)
+        self.max_retries = max(max_retries or 0, 0)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.slow_log = slow_log or 0.0
+
+    def request(self, method, path, token=None, data=None, params=None, idempotent=None, idempotency_key=None):
+        """
+        Send a request to the API and return the response object
+        GET and PUT are retried on server errors and network failures, POST only when
+        flagged idempotent or sent with an idempotency key. Throttled calls (429) and
+        connect timeouts, which never reached the API, are always retried
+        """
+        headers, body = self._prepare_request(token, data, idempotency_key)
+        if idempotent is None:
+            idempotent = method in ('GET', 'PUT', 'DELETE') or bool(idempotency_key)
+        budget = _get_retry_budget(self.key, endpoint_name(path))
+
+        attempt = 0
+        while True:
+            self._check_breaker()
+            self.limiter.acquire()
+            response = error = None
+            start = time.monotonic()
+            try:
+                response = self.session.request(
+                    method, f"{self.base_url}{path}",
+                    headers=headers, data=body, params=params, timeout=self.timeout,
+                )
+            except requests.exceptions.RequestException as e:
+                error = e
+            except Exception:
+                # Never leave a half open breaker waiting for the outcome of this call
+                self.breaker.record(False, time.monotonic() - start)
+                raise
+            self._record_call(method, path, body, response, error, time.monotonic() - start, attempt)
+
+            if not self._should_retry(attempt, idempotent, response, error) or not budget.spend():
+                if error is not None:
+                    raise error
+                if response.status_code < 400:
+                    budget.earn()
+                return response
+
+            attempt += 1
+            delay = self._retry_delay(method, path, attempt, response, error)
+            time.sleep(delay)
+
+    def _prepare_request(self, token, data, idempotency_key):
+        """Headers and JSON body of a call"""
+        headers = {}
+        if token:
+            headers['Authorization'] = token
+        if idempotency_key:
+            headers['Idempotency-Key'] = idempotency_key
+        body = None
+        if data is not None:
+            headers['Content-Type'] = 'application/json'
+            body = dumps(data)
+        return headers, body
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"PedidosYa API unavailable, calls suspended for {self.breaker.cooldown:.0f}s")
+
+    def _record_call(self, method, path, body, response, error, duration, attempt):
+        """Feed the outcome of an attempt to the circuit breaker and the metrics"""
+        self.breaker.record(
+            error is None and response.status_code < 500 and response.status_code != 429,
+            duration,
+        )
+        endpoint = endpoint_name(path)
+        status = type(error).__name__ if error is not None else response.status_code
+        metrics.observe_call(
+            method, endpoint, status, duration,
+            request_size=len(body or b''),
+            response_size=len(response.content) if response is not None else 0,
+            retry=attempt > 0,
+        )
+        if self.slow_log and duration > self.slow_log:
+            fingerprint = hashlib.sha1(b'%s %s %s' % (method.encode(), path.encode(), body or b'')).hexdigest()[:16]
+            metrics.observe_slow_call(method, endpoint, status, duration, fingerprint)
+            _logger.warning(f"Slow PedidosYa call {method} {endpoint}: {duration * 1000:.0f}ms, "
+                            f"status {status}, request fingerprint {fingerprint}")
+
+    def _should_retry(self, attempt, idempotent, response, error):
+        if attempt >= self.max_retries:
+            return False
+        if error is not None:
+            if not isinstance(error, RETRY_ERRORS):
+                return False
+            return idempotent or isinstance(error, requests.exceptions.ConnectTimeout)
+        if response.status_code == 429:
+            return True
+        return response.status_code in RETRY_STATUSES and idempotent
+
+    def _retry_delay(self, method, path, attempt, response, error):
+        """Seconds to wait before the given retry: Retry-After when sent, jittered exponential backoff otherwise"""
+        delay = _retry_after(response)
+        if delay is None:
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        delay = min(delay, self.max_backoff)
+        _logger.info(f"Retrying PedidosYa {method} {endpoint_name(path)} in {delay:.2f}s "
+                     f"(attempt {attempt}, {error or response.status_code})")
+        return delay
+
+    def get(self, path, token=None, params=None):
+        return self.request('GET', path, token=token, params=params)
+
+    def post(self, path, token=None, data=None, idempotent=False, idempotency_key=None):
+        return self.request('POST', path, token=token, data=data,
+                            idempotent=idempotent, idempotency_key=idempotency_key)
+
+    def put(self, path, token=None, data=None):
+        return self.request('PUT', path, token=token, data=data)
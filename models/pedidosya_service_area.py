@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import ValidationError
+
+from .pedidosya_deliverability import ServiceArea, parse_polygon
+
+class PedidosYaServiceArea(models.Model):
+    _name = 'pedidosya.service.area'
+    _description = 'PedidosYa Service Area'
+    _rec_name = 'warehouse_id'
+
+    carrier_id = fields.Many2one('delivery.carrier', string='Delivery Carrier', required=True,
+                                 ondelete='cascade', index=True)
+    warehouse_id = fields.Many2one('stock.warehouse', string='Warehouse', required=True, ondelete='cascade')
+    max_radius = fields.Float(string='Max Distance (km)',
+                              help='Maximum distance from the warehouse address, 0 for no limit')
+    polygon = fields.Text(string='Service Polygon',
+                          help='Vertices of the delivery area as a JSON list of [latitude, longitude] pairs, '
+                               'e.g. [[-34.85, -56.25], [-34.85, -56.05], [-34.95, -56.05]]. Empty for no polygon')
+
+    _sql_constraints = [
+        ('warehouse_uniq', 'unique(carrier_id, warehouse_id)',
+         'A warehouse can only have one service area per carrier.'),
+    ]
+
+    @api.constrains('polygon')
+    def _check_polygon(self):
+        for area in self:
+            try:
+                parse_polygon(area.polygon)
+            except ValueError as e:
+                raise ValidationError(_('Invalid service polygon for %s: %s') % (area.warehouse_id.name, e))
+
+    def _get_service_area(self):
+        """Deliverability checker of the area, cached until the area or the warehouse address is modified"""
+        self.ensure_one()
+        origin = self.warehouse_id.partner_id
+        return self._get_service_area_cached(self.id, str(self.write_date), origin.id, str(origin.write_date))
+
+    @api.model
+    @tools.ormcache('area_id', 'write_date', 'origin_id', 'origin_write_date')
+    def _get_service_area_cached(self, area_id, write_date, origin_id, origin_write_date):
+        area = self.browse(area_id)
+        origin = self.env['res.partner'].browse(origin_id)
+        return ServiceArea(origin.partner_latitude, origin.partner_longitude, area.max_radius, parse_polygon(area.polygon))
\ No newline at end of file
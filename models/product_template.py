@@ -2,6 +2,8 @@
 
 from odoo import models, fields, api
 
+from .pedidosya_json import dumps
+
 class ProductTemplate(models.Model):
     _inherit = 'product.template'
     
@@ -10,4 +12,30 @@ class ProductTemplate(models.Model):
         ('FRAGILE', 'Fragile'),
         ('COLD', 'Cold')
     ], string='PedidosYa Product Type', default='STANDARD',
-    help='Product type category for PedidosYa Shipping')
\ No newline at end of file
+    help='Product type category for PedidosYa Shipping')
+
+
+class ProductProduct(models.Model):
+    _inherit = 'product.product'
+    
+    # Shipment item descriptors, recomputed by the ORM when the product changes
+    # so that building the items of a payload only adds the value and quantity
+    pedidosya_volume = fields.Float(string='PedidosYa Volume (cm³)', compute='_compute_pedidosya_item', store=True)
+    pedidosya_weight = fields.Float(string='PedidosYa Weight (kg)', compute='_compute_pedidosya_item', store=True)
+    pedidosya_item_type = fields.Char(string='PedidosYa Item Type', compute='_compute_pedidosya_item', store=True)
+    pedidosya_item_json = fields.Char(string='PedidosYa Item', compute='_compute_pedidosya_item', store=True,
+                                      help='JSON of the product fields of a PedidosYa shipment item')
+    
+    @api.depends('name', 'default_code', 'volume', 'weight', 'product_tmpl_id.pedidosya_product_type')
+    def _compute_pedidosya_item(self):
+        for product in self:
+            product.pedidosya_volume = product.volume * 1000000  # Convert m³ to cm³
+            product.pedidosya_weight = product.weight  # Weight in kg
+            product.pedidosya_item_type = product.pedidosya_product_type or 'STANDARD'
+            product.pedidosya_item_json = dumps({
+                'type': product.pedidosya_item_type,
+                'description': product.name,
+                'sku': product.default_code or '',
+                'volume': product.pedidosya_volume,
+                'weight': product.pedidosya_weight,
+            }).decode()
\ No newline at end of file
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields
+
+class ResPartner(models.Model):
+    _inherit = 'res.partner'
+    
+    pedidosya_carrier_ids = fields.Many2many('delivery.carrier', 'pedidosya_eligible_partner_rel', 'partner_id', 'carrier_id',
+                                             string='PedidosYa Eligible Carriers', readonly=True,
+                                             help='PedidosYa carriers whose service areas include the address, '
+                                                  'as of the last tagging of eligible customers')
\ No newline at end of file
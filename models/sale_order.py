@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, _
+from odoo.exceptions import UserError
+from collections import defaultdict
+
+class SaleOrder(models.Model):
+    _inherit = 'sale.order'
+    
+    pedidosya_quote_price = fields.Float(string='PedidosYa Quote', readonly=True, copy=False,
+                                         help='Delivery price of the last bulk PedidosYa quote')
+    pedidosya_quote_date = fields.Datetime(string='PedidosYa Quote Date', readonly=True, copy=False)
+    pedidosya_quote_carrier_id = fields.Many2one('delivery.carrier', string='PedidosYa Quote Carrier', readonly=True, copy=False)
+    pedidosya_quote_error = fields.Char(string='PedidosYa Quote Error', readonly=True, copy=False,
+                                        help='Why the last bulk PedidosYa quote failed')
+    
+    def _pedidosya_write_quotes(self, carrier, results):
+        """Save bulk quotes given as {order id: rate_shipment result}, with one write per distinct result"""
+        ids_by_quote = defaultdict(list)
+        for order in self:
+            res = results.get(order.id)
+            if res:
+                price = res['price'] if res['success'] else 0.0
+                error = False if res['success'] else res['error_message']
+                ids_by_quote[(price, error)].append(order.id)
+        
+        now = fields.Datetime.now()
+        for (price, error), order_ids in ids_by_quote.items():
+            self.browse(order_ids).write({
+                'pedidosya_quote_price': price,
+                'pedidosya_quote_date': now,
+                'pedidosya_quote_carrier_id': carrier.id,
+                'pedidosya_quote_error': error,
+            })
+    
+    def action_pedidosya_update_quotes(self):
+        """Quote the selected orders with their PedidosYa carrier, in bulk per carrier"""
+        orders = self.filtered(lambda o: o.carrier_id.delivery_type == 'pedidosya')
+        if not orders:
+            raise UserError(_('None of the selected orders uses a PedidosYa delivery method'))
+        
+        quoted = 0
+        for carrier in orders.carrier_id:
+            results = carrier.pedidosya_rate_shipments_bulk(orders.filtered(lambda o: o.carrier_id == carrier))
+            quoted += sum(1 for res in results.values() if res['success'])
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('PedidosYa Quotes'),
+                'message': _('%s of %s orders quoted.') % (quoted, len(orders)),
+                'type': 'success' if quoted == len(orders) else 'warning',
+                'sticky': False,
+            },
+        }
\ No newline at end of file
@@ -3,9 +3,9 @@
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
 import logging
-import json
 import requests
-import datetime
+
+from .pedidosya_request import decode_response
 
 _logger = logging.getLogger(__name__)
 
@@ -45,12 +45,6 @@ class PedidosYaWebhookConfig(models.Model):
         token = self.carrier_id._get_pedidosya_auth_token()
         
         # API request to configure webhook
-        url = f"{self.carrier_id._get_pedidosya_api_url()}/v3/webhooks-configuration"
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': token
-        }
-        
         data = {
             'webhooksConfiguration': [
                 {
@@ -68,7 +62,8 @@ class PedidosYaWebhookConfig(models.Model):
         }
         
         try:
-            response = requests.put(url, headers=headers, data=json.dumps(data))
+            response = self.carrier_id._get_pedidosya_client().put(
+                '/v3/webhooks-configuration', token=token, data=data)
             response.raise_for_status()
             
             # Update last sync time
@@ -103,19 +98,15 @@ class PedidosYaWebhookConfig(models.Model):
         token = self.carrier_id._get_pedidosya_auth_token()
         
         # API request to get webhook configuration
-        url = f"{self.carrier_id._get_pedidosya_api_url()}/v3/webhooks-configuration"
-        headers = {
-            'Authorization': token
-        }
-        
         params = {
             'isTest': self.is_test
         }
         
         try:
-            response = requests.get(url, headers=headers, params=params)
+            response = self.carrier_id._get_pedidosya_client().get(
+                '/v3/webhooks-configuration', token=token, params=params)
             response.raise_for_status()
-            result = response.json()
+            result = decode_response(response)
             
             webhook_configs = result.get('webhooksConfiguration', [])
             for config in webhook_configs:
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, _
+from collections import defaultdict
+import datetime
+import logging
+import threading
+import time
+
+from .delivery_carrier import PEDIDOSYA_STATUS_SEQUENCE
+from .pedidosya_metrics import metrics
+
+_logger = logging.getLogger(__name__)
+
+# Runs of the inbox processor an event is tried in before it is left failed
+WEBHOOK_EVENT_MAX_ATTEMPTS = 5
+
+class PedidosYaWebhookEvent(models.Model):
+    _name = 'pedidosya.webhook.event'
+    _description = 'PedidosYa Webhook Event'
+    _order = 'id desc'
+    _rec_name = 'shipping_id'
+
+    shipping_id = fields.Char(string='Shipping ID', required=True, index=True, readonly=True)
+    carrier_id = fields.Many2one('delivery.carrier', string='Delivery Carrier', readonly=True,
+                                 help='Carrier identified by the webhook authorization key')
+    topic = fields.Char(string='Topic', readonly=True)
+    status = fields.Char(string='Status', readonly=True)
+    reference_id = fields.Char(string='Reference', readonly=True)
+    event_date = fields.Datetime(string='Event Date', readonly=True,
+                                 help='Time PedidosYa generated the event, the reception time when not provided')
+    payload = fields.Json(string='Payload', readonly=True)
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('done', 'Processed'),
+        ('ignored', 'Ignored'),
+        ('error', 'Failed')
+    ], string='State', default='pending', required=True, index=True, readonly=True)
+    attempts = fields.Integer(string='Attempts', readonly=True,
+                              help='Failed processing attempts, the event is retried once per run until the maximum')
+    error_message = fields.Text(string='Error', readonly=True)
+
+    @api.model
+    def _enqueue(self, data, carrier=None):
+        """Store a validated webhook event for asynchronous processing"""
+        return self.create({
+            'shipping_id': data.get('id'),
+            'carrier_id': carrier.id if carrier else False,
+            'topic': data.get('topic'),
+            'status': (data.get('data') or {}).get('status'),
+            'reference_id': data.get('referenceId'),
+            'event_date': self._parse_event_date(data.get('generated')),
+            'payload': data,
+        })
+
+    @api.model
+    def _parse_event_date(self, value):
+        """Parse an ISO 8601 event time into a naive UTC datetime"""
+        if value:
+            try:
+                date = datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+                if date.tzinfo:
+                    date = date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+                return date
+            except ValueError:
+                _logger.warning(f"Invalid PedidosYa webhook event date: {value}")
+        return fields.Datetime.now()
+
+    @api.model
+    def _cron_process_events(self, chunk_size=500):
+        """Drain the inbox in chunks, oldest events first, committing after each chunk"""
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        # Failed events get one more attempt per run, they can't block the pending ones
+        self.search([('state', '=', 'error'), ('attempts', '<', WEBHOOK_EVENT_MAX_ATTEMPTS)]).write({'state': 'pending'})
+        while True:
+            events = self.search([('state', '=', 'pending')], order='id', limit=chunk_size)
+            if not events:
+                break
+            events._process_events()
+            if auto_commit:
+                self.env.cr.commit()
+            if len(events) < chunk_size:
+                break
+
+    def _process_events(self):
+        """
+        Apply a batch of events
+        Events of the same shipment are coalesced, only the most advanced status is applied,
+        events older than what the picking already has are dropped. When the batch fails,
+        each shipment is applied on its own and the events of the failing ones are marked failed
+        """
+        start = time.monotonic()
+        self._apply_events_isolated()
+        metrics.observe_webhook('process', time.monotonic() - start, events=len(self))
+
+    def _apply_events_isolated(self):
+        try:
+            with self.env.cr.savepoint():
+                self._apply_events()
+        except Exception as e:
+            shipping_ids = set(self.mapped('shipping_id'))
+            if len(shipping_ids) > 1:
+                # Isolate the shipments that make the batch fail
+                for shipping_id in shipping_ids:
+                    self.filtered(lambda event: event.shipping_id == shipping_id)._apply_events_isolated()
+                return
+            _logger.exception(f"Could not apply PedidosYa webhook events of shipping ID {self[:1].shipping_id}")
+            for event in self:
+                event.write({'state': 'error', 'attempts': event.attempts + 1, 'error_message': str(e)})
+
+    def _apply_events(self):
+        events_by_shipping = defaultdict(lambda: self.browse())
+        for event in self.sorted('id'):
+            events_by_shipping[event.shipping_id] |= event
+
+        pickings = self.env['stock.picking'].sudo().search([
+            ('carrier_tracking_ref', 'in', list(events_by_shipping)),
+        ])
+        # Pickings of a multi-stop shipment share its events
+        pickings_by_ref = defaultdict(lambda: self.env['stock.picking'])
+        for picking in pickings:
+            pickings_by_ref[picking.carrier_tracking_ref] |= picking
+
+        statuses = {}
+        last_events = {}
+        ignored = self.browse()
+        for shipping_id, events in events_by_shipping.items():
+            shipping_pickings = pickings_by_ref.get(shipping_id)
+            if not shipping_pickings:
+                _logger.warning(f"Picking not found for PedidosYa shipping ID: {shipping_id}")
+                ignored |= events
+                continue
+            # Events may arrive out of order, keep the furthest one along the shipment lifecycle
+            event = max(events, key=lambda e: (PEDIDOSYA_STATUS_SEQUENCE.get(e.status, 0), e.event_date or e.create_date, e.id))
+            for picking in shipping_pickings:
+                last_events[picking.id] = event
+                statuses[picking.id] = (event.status, event.event_date)
+
+        changed = pickings._pedidosya_write_statuses(statuses)
+        for picking in changed:
+            event = last_events[picking.id]
+            if event.status == 'CANCELLED':
+                # Add cancel reason if provided
+                status_data = (event.payload or {}).get('data') or {}
+                cancel_reason = status_data.get('cancelReason', '')
+                cancel_code = status_data.get('cancelCode', '')
+                if cancel_reason or cancel_code:
+                    picking.message_post(
+                        body=_(f"PedidosYa shipment canceled<br/>"
+                              f"Reason: {cancel_reason}<br/>"
+                              f"Code: {cancel_code}")
+                    )
+
+            # Add message with status update
+            picking.message_post(body=_(f"PedidosYa Status Update: {event.status}"))
+            _logger.info(f"Updated picking {picking.name} with PedidosYa status: {event.status}")
+
+        # Completed pickings are validated later by the deferred validation job
+        completed = changed.filtered(lambda p: last_events[p.id].status == 'COMPLETED' and p.state != 'done')
+        completed._pedidosya_schedule_validation()
+
+        ignored.write({'state': 'ignored'})
+        (self - ignored).write({'state': 'done', 'error_message': False})
+
+    @api.autovacuum
+    def _gc_processed_events(self):
+        """Remove processed events older than a week"""
+        limit_date = fields.Datetime.now() - datetime.timedelta(days=7)
+        self.search([('state', '!=', 'pending'), ('create_date', '<', limit_date)]).unlink()
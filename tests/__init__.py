@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+
+from . import test_pedidosya_shipment
+from . import test_pedidosya_webhook
+from . import test_pedidosya_request
\ No newline at end of file
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tests.common import TransactionCase
+
+class PedidosYaCase(TransactionCase):
+    """PedidosYa carrier and outgoing pickings, without any API call"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        delivery_product = cls.env['product.product'].create({'name': 'PedidosYa Delivery', 'type': 'service'})
+        cls.carrier = cls.env['delivery.carrier'].create({
+            'name': 'PedidosYa Test',
+            'delivery_type': 'pedidosya',
+            'product_id': delivery_product.id,
+            'pedidosya_api_key': 'test',
+            'pedidosya_api_secret': 'test',
+            'pedidosya_rate_limit': 0,
+            'pedidosya_max_retries': 0,
+        })
+        cls.product = cls.env['product.product'].create({'name': 'Parcel', 'type': 'consu', 'weight': 1.0})
+        cls.customer = cls.env['res.partner'].create({
+            'name': 'PedidosYa Customer',
+            'partner_latitude': -34.9,
+            'partner_longitude': -56.16,
+        })
+        cls.picking_type = cls.env.ref('stock.picking_type_out')
+
+    def _create_pickings(self, count=1):
+        return self.env['stock.picking'].create([{
+            'picking_type_id': self.picking_type.id,
+            'location_id': self.picking_type.default_location_src_id.id,
+            'location_dest_id': self.env.ref('stock.stock_location_customers').id,
+            'partner_id': self.customer.id,
+            'carrier_id': self.carrier.id,
+            'move_ids': [(0, 0, {
+                'name': self.product.name,
+                'product_id': self.product.id,
+                'product_uom_qty': 1,
+                'product_uom': self.product.uom_id.id,
+                'location_id': self.picking_type.default_location_src_id.id,
+                'location_dest_id': self.env.ref('stock.stock_location_customers').id,
+            })],
+        } for _index in range(count)])
+
+    def _shipment(self, shipping_id):
+        return {
+            'shippingId': shipping_id,
+            'confirmationCode': shipping_id.upper(),
+            'shareLocationUrl': f"https://track.pedidosya/{shipping_id}",
+            'route': {'pricing': {'total': 100.0}},
+        }
\ No newline at end of file
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import email.utils
+import time
+from unittest.mock import patch
+
+import requests
+
+from odoo.tests.common import BaseCase
+
+from ..models import pedidosya_request
+from ..models.pedidosya_request import PedidosYaRequest, RateLimiter, RetryBudget
+
+class TestPedidosYaRequest(BaseCase):
+    """Retry rules of the API client, with the HTTP session mocked"""
+
+    def setUp(self):
+        super().setUp()
+        # Waits are recorded instead of slept
+        patcher = patch.object(pedidosya_request.time, 'sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _client(self, **kwargs):
+        # Retry budgets are shared per key and endpoint, every test gets its own
+        kwargs.setdefault('max_retries', 2)
+        return PedidosYaRequest('http://pedidosya.test', f"test:{self.id()}", backoff=0.01, **kwargs)
+
+    def _response(self, status, headers=None):
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(headers or {})
+        response._content = b'{}'
+        return response
+
+    def _send(self, client, responses, method='GET', **kwargs):
+        with patch.object(client.session, 'request', side_effect=responses) as request:
+            try:
+                return client.request(method, '/v3/shippings', **kwargs), request.call_count
+            except requests.exceptions.RequestException as e:
+                return e, request.call_count
+
+    def test_retry_server_error(self):
+        response, calls = self._send(self._client(), [self._response(503), self._response(200)])
+        self.assertEqual((response.status_code, calls), (200, 2))
+
+    def test_retry_throttled(self):
+        """Throttled calls never reached the API, even a plain POST is retried"""
+        response, calls = self._send(self._client(), [self._response(429), self._response(201)], method='POST')
+        self.assertEqual((response.status_code, calls), (201, 2))
+
+    def test_no_retry_post(self):
+        """A POST may have been applied, its server errors and read timeouts are not retried"""
+        client = self._client()
+        response, calls = self._send(client, [self._response(503), self._response(201)], method='POST')
+        self.assertEqual((response.status_code, calls), (503, 1))
+        error, calls = self._send(client, [requests.exceptions.ReadTimeout(), self._response(201)], method='POST')
+        self.assertIsInstance(error, requests.exceptions.ReadTimeout)
+        self.assertEqual(calls, 1)
+
+    def test_retry_idempotent_post(self):
+        client = self._client()
+        response, calls = self._send(client, [self._response(503), self._response(201)], method='POST',
+                                     idempotency_key='shipment-1')
+        self.assertEqual((response.status_code, calls), (201, 2))
+        # A connect timeout never reached the API
+        response, calls = self._send(client, [requests.exceptions.ConnectTimeout(), self._response(201)], method='POST')
+        self.assertEqual((response.status_code, calls), (201, 2))
+
+    def test_no_retry_other_errors(self):
+        error, calls = self._send(self._client(), [requests.exceptions.ContentDecodingError(), self._response(200)])
+        self.assertIsInstance(error, requests.exceptions.ContentDecodingError)
+        self.assertEqual(calls, 1)
+        response, calls = self._send(self._client(), [self._response(404), self._response(200)])
+        self.assertEqual((response.status_code, calls), (404, 1))
+
+    def test_max_retries(self):
+        response, calls = self._send(self._client(max_retries=2), [self._response(503)] * 4)
+        self.assertEqual((response.status_code, calls), (503, 3))
+
+    def test_retry_after(self):
+        client = self._client()
+        self._send(client, [self._response(429, {'Retry-After': '3'}), self._response(200)])
+        self.sleep.assert_called_once_with(3.0)
+        
+        self.sleep.reset_mock()
+        date = email.utils.formatdate(time.time() + 10, usegmt=True)
+        self._send(client, [self._response(503, {'Retry-After': date}), self._response(200)])
+        self.assertAlmostEqual(self.sleep.call_args.args[0], 10, delta=2)
+        
+        # Capped to the maximum backoff
+        self.sleep.reset_mock()
+        self._send(client, [self._response(429, {'Retry-After': '3600'}), self._response(200)])
+        self.sleep.assert_called_once_with(client.max_backoff)
+
+    def test_retry_budget_exhausted(self):
+        client = self._client()
+        budget = pedidosya_request._get_retry_budget(client.key, '/v3/shippings')
+        while budget.spend():
+            pass
+        response, calls = self._send(client, [self._response(503), self._response(200)])
+        self.assertEqual((response.status_code, calls), (503, 1))
+
+    def test_retry_budget(self):
+        budget = RetryBudget(max_tokens=2, refill=0.5)
+        self.assertTrue(budget.spend())
+        self.assertTrue(budget.spend())
+        self.assertFalse(budget.spend())
+        # Successful calls earn a retry back
+        budget.earn()
+        self.assertFalse(budget.spend())
+        budget.earn()
+        self.assertTrue(budget.spend())
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(rate=2, burst=2)
+        self.assertEqual(limiter.reserve(), 0.0)
+        self.assertEqual(limiter.reserve(), 0.0)
+        self.assertAlmostEqual(limiter.reserve(), 0.5, delta=0.05)
+        self.assertAlmostEqual(limiter.reserve(), 1.0, delta=0.05)
+        self.assertEqual(RateLimiter(rate=0).reserve(), 0.0)
\ No newline at end of file
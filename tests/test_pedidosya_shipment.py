@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import io
+from unittest.mock import patch
+
+import requests
+
+from odoo import fields
+from odoo.tools.pdf import PdfFileReader, PdfFileWriter
+
+from .common import PedidosYaCase
+from ..models import delivery_carrier
+from ..models.pedidosya_cache import skipped_status_updates
+
+class TestPedidosYaShipment(PedidosYaCase):
+
+    def test_resent_shipment_applies_new_statuses(self):
+        """A shipment created after a cancellation gets its statuses applied again"""
+        picking = self._create_pickings()
+        self.carrier._apply_pedidosya_shipping_result(picking, self._shipment('first'))
+        picking._pedidosya_write_statuses({picking.id: 'CANCELLED'})
+        self.assertEqual(picking.carrier_tracking_status, 'canceled')
+        
+        self.carrier._apply_pedidosya_shipping_result(picking, self._shipment('second'))
+        self.assertEqual(picking.carrier_tracking_ref, 'second')
+        self.assertFalse(picking.pedidosya_status)
+        self.assertFalse(picking.carrier_tracking_status)
+        
+        date = fields.Datetime.now() + datetime.timedelta(minutes=5)
+        changed = picking._pedidosya_write_statuses({picking.id: ('COMPLETED', date)})
+        self.assertEqual(changed, picking)
+        self.assertEqual(picking.pedidosya_status, 'COMPLETED')
+        self.assertEqual(picking.carrier_tracking_status, 'delivered')
+
+    def test_same_shipment_keeps_status(self):
+        """Writing the shipping id a picking already has is not a new shipment"""
+        picking = self._create_pickings()
+        self.carrier._apply_pedidosya_shipping_result(picking, self._shipment('same'))
+        picking._pedidosya_write_statuses({picking.id: 'PICKED_UP'})
+        picking.write({'carrier_tracking_ref': 'same'})
+        self.assertEqual(picking.pedidosya_status, 'PICKED_UP')
+
+    def test_out_of_order_status_skipped(self):
+        """A status behind the one applied, by rank or by event date, is dropped and counted"""
+        picking = self._create_pickings()
+        self.carrier._apply_pedidosya_shipping_result(picking, self._shipment('ordered'))
+        date = fields.Datetime.now()
+        self.assertEqual(picking._pedidosya_write_statuses({picking.id: ('PICKED_UP', date)}), picking)
+        
+        stale = skipped_status_updates['stale']
+        later = date + datetime.timedelta(minutes=5)
+        self.assertFalse(picking._pedidosya_write_statuses({picking.id: ('IN_PROGRESS', later)}))
+        self.assertEqual(picking.pedidosya_status, 'PICKED_UP')
+        self.assertEqual(picking.carrier_tracking_status, 'in_transit')
+        self.assertEqual(skipped_status_updates['stale'], stale + 1)
+        
+        # Same rank, only a newer event replaces it
+        sequence = delivery_carrier.PEDIDOSYA_STATUS_SEQUENCE['PICKED_UP']
+        self.assertTrue(picking._is_pedidosya_status_stale(sequence, date - datetime.timedelta(minutes=1)))
+        self.assertFalse(picking._is_pedidosya_status_stale(sequence, later))
+        
+        # Nothing comes after a final status
+        picking._pedidosya_write_statuses({picking.id: ('COMPLETED', later)})
+        self.assertFalse(picking._pedidosya_write_statuses({picking.id: ('NEAR_DROPOFF', later + datetime.timedelta(minutes=5))}))
+        self.assertEqual(picking.pedidosya_status, 'COMPLETED')
+        self.assertEqual(skipped_status_updates['stale'], stale + 2)
+    
+    def test_duplicate_status_skipped(self):
+        """A status the picking already has is neither written nor posted again"""
+        picking = self._create_pickings()
+        self.carrier._apply_pedidosya_shipping_result(picking, self._shipment('repeated'))
+        Event = self.env['pedidosya.webhook.event'].sudo()
+        data = {'topic': 'SHIPPING_STATUS', 'id': 'repeated', 'data': {'status': 'PICKED_UP'}}
+        Event._enqueue(data, self.carrier)._process_events()
+        self.assertEqual(picking.pedidosya_status, 'PICKED_UP')
+        messages = len(picking.message_ids)
+        
+        duplicate = skipped_status_updates['duplicate']
+        with patch.object(type(picking), 'write', side_effect=AssertionError('Duplicate status written')):
+            self.assertFalse(picking._pedidosya_write_statuses({picking.id: 'PICKED_UP'}))
+        self.assertEqual(skipped_status_updates['duplicate'], duplicate + 1)
+        
+        event = Event._enqueue(data, self.carrier)
+        event._process_events()
+        self.assertEqual(event.state, 'done')
+        self.assertEqual(len(picking.message_ids), messages)
+        self.assertEqual(skipped_status_updates['duplicate'], duplicate + 2)
+    
+    def test_cancel_multistop_shipment(self):
+        """Canceling one stop of a multi-stop shipment cancels it once, for all its pickings"""
+        pickings = self._create_pickings(2)
+        self.carrier._apply_pedidosya_shipping_result(pickings, self._shipment('shared'))
+        
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"status": "CANCELLED"}'
+        with patch.object(type(self.carrier), '_get_pedidosya_auth_token', return_value='token'), \
+                patch.object(delivery_carrier.PedidosYaRequest, 'post', return_value=response) as post:
+            results = self.carrier.pedidosya_cancel_shipment(pickings[0])
+        
+        post.assert_called_once()
+        self.assertEqual({result['picking_id'] for result in results if result['success']}, set(pickings.ids))
+        self.assertEqual(set(pickings.mapped('carrier_tracking_status')), {'canceled'})
+    
+    def test_canceled_multistop_shipment_is_sent_again(self):
+        """Pickings of a canceled multi-stop shipment get a new shipment instead of reusing it"""
+        pickings = self._create_pickings(2)
+        self.carrier._apply_pedidosya_shipping_result(pickings, self._shipment('shared'))
+        self.assertEqual(pickings.mapped('pedidosya_stop'), [1, 2])
+        pickings.write({'carrier_tracking_status': 'canceled'})
+        
+        response = requests.Response()
+        response.status_code = 200
+        response._content = delivery_carrier.dumps(self._shipment('new'))
+        with patch.object(type(self.carrier), '_get_pedidosya_auth_token', return_value='token'), \
+                patch.object(type(self.carrier), '_prepare_pedidosya_shipping_data', return_value={}), \
+                patch.object(delivery_carrier.PedidosYaRequest, 'post', return_value=response) as post:
+            results = self.carrier.pedidosya_send_shipping(pickings)
+        
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual([result['tracking_number'] for result in results], ['new', 'new'])
+        self.assertEqual(pickings.mapped('carrier_tracking_ref'), ['new', 'new'])
+        self.assertFalse(any(pickings.mapped('carrier_tracking_status')))
+        # Sent one by one, they are no longer stops of a multi-stop shipment
+        self.assertEqual(pickings.mapped('pedidosya_stop'), [0, 0])
+    
+    def _label_response(self, pages):
+        writer = PdfFileWriter()
+        for _page in range(pages):
+            writer.addBlankPage(100, 100)
+        response = requests.Response()
+        response.status_code = 200
+        with io.BytesIO() as buffer:
+            writer.write(buffer)
+            response._content = buffer.getvalue()
+        return response
+    
+    def test_multistop_shipment_label(self):
+        """Pickings of a multi-stop shipment share one label, fetched in one chunk and printed once"""
+        pickings = self._create_pickings(3)
+        self.carrier._apply_pedidosya_shipping_result(pickings[:2], self._shipment('shared'))
+        self.carrier._apply_pedidosya_shipping_result(pickings[2], self._shipment('single'))
+        
+        def _get(path, token=None, params=None):
+            return self._label_response(len(params['values'].split(',')))
+        
+        with patch.object(type(self.carrier), '_get_pedidosya_auth_token', return_value='token'), \
+                patch.object(delivery_carrier.PedidosYaRequest, 'get', side_effect=_get) as get:
+            result = self.carrier.pedidosya_get_shipping_labels(pickings)
+            self.assertEqual([call.kwargs['params']['values'] for call in get.call_args_list], ['shared,single'])
+            self.assertEqual(PdfFileReader(io.BytesIO(result['pdf'])).getNumPages(), 2)
+            
+            # Every picking has its label cached, printing again makes no call
+            get.reset_mock()
+            self.assertEqual(set(pickings._get_pedidosya_label_attachments()), {'shared', 'single'})
+            result = self.carrier.pedidosya_get_shipping_labels(pickings)
+            get.assert_not_called()
+            self.assertEqual(PdfFileReader(io.BytesIO(result['pdf'])).getNumPages(), 2)
+    
+    def test_label_chunk_page_mismatch(self):
+        """A chunk PDF whose pages don't match its shipments is requested again per shipment"""
+        pickings = self._create_pickings(2)
+        self.carrier._apply_pedidosya_shipping_result(pickings[0], self._shipment('first'))
+        self.carrier._apply_pedidosya_shipping_result(pickings[1], self._shipment('second'))
+        
+        def _get(path, token=None, params=None):
+            # Every label has two pages, the chunk can't be split
+            return self._label_response(2 * len(params['values'].split(',')))
+        
+        with patch.object(type(self.carrier), '_get_pedidosya_auth_token', return_value='token'), \
+                patch.object(delivery_carrier.PedidosYaRequest, 'get', side_effect=_get) as get:
+            result = self.carrier.pedidosya_get_shipping_labels(pickings)
+        
+        self.assertEqual([call.kwargs['params']['values'] for call in get.call_args_list],
+                         ['first,second', 'first', 'second'])
+        self.assertEqual(PdfFileReader(io.BytesIO(result['pdf'])).getNumPages(), 4)
+        self.assertEqual(set(pickings._get_pedidosya_label_attachments()), {'first', 'second'})
\ No newline at end of file
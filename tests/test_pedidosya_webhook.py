@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+
+from .common import PedidosYaCase
+from ..models.webhook_event import WEBHOOK_EVENT_MAX_ATTEMPTS
+
+class TestPedidosYaWebhook(PedidosYaCase):
+
+    def _event(self, shipping_id, status):
+        return self.env['pedidosya.webhook.event'].sudo()._enqueue({
+            'topic': 'SHIPPING_STATUS',
+            'id': shipping_id,
+            'data': {'status': status},
+        }, self.carrier)
+
+    def test_failing_shipment_does_not_block_inbox(self):
+        """Events of a shipment that can't be applied are marked failed, the others are applied"""
+        pickings = self._create_pickings(2)
+        good, bad = pickings
+        self.carrier._apply_pedidosya_shipping_result(good, self._shipment('good'))
+        self.carrier._apply_pedidosya_shipping_result(bad, self._shipment('bad'))
+        events = self._event('good', 'PICKED_UP') | self._event('bad', 'PICKED_UP')
+
+        message_post = type(pickings).message_post
+
+        def _message_post(picking, **kwargs):
+            if picking == bad:
+                raise ValueError('Chatter unavailable')
+            return message_post(picking, **kwargs)
+
+        with patch.object(type(pickings), 'message_post', _message_post):
+            events._process_events()
+            self.assertEqual(events.mapped('state'), ['done', 'error'])
+            self.assertEqual(good.pedidosya_status, 'PICKED_UP')
+            self.assertFalse(bad.pedidosya_status)
+            self.assertEqual(events[1].attempts, 1)
+            self.assertIn('Chatter unavailable', events[1].error_message)
+
+            # Failed events are retried by the next runs, up to the maximum
+            for _run in range(WEBHOOK_EVENT_MAX_ATTEMPTS + 1):
+                self.env['pedidosya.webhook.event']._cron_process_events()
+        self.assertEqual(events[1].state, 'error')
+        self.assertEqual(events[1].attempts, WEBHOOK_EVENT_MAX_ATTEMPTS)
\ No newline at end of file